@@ -3,7 +3,6 @@ import json
 from decimal import Decimal
 
 from django.conf import settings
-from django.core.mail import send_mail
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.db import transaction
@@ -15,7 +14,6 @@ from django.urls import reverse
 from django.views import View
 from django.forms import formset_factory, modelformset_factory
 from django.http import JsonResponse
-from django.template.loader import render_to_string
 from django.views.decorators.http import require_GET, require_POST
 from django.utils import timezone
 
@@ -30,6 +28,9 @@ from django_htmx.http import HttpResponseClientRedirect
 from core.models import User
 from program.models import Show, ShowPerformance
 from tickets.models import BoxOffice, Sale, Refund, TicketType, Ticket, PayAsYouWill, FringerType, Fringer, Checkpoint, BadgesIssued
+from tickets.inventory import reserve
+from tickets.bulk import create_tickets
+from tickets.payments import process_event, queue_receipt, record_square_callback
 
 from .forms import CheckpointForm, SaleTicketsForm, SalePAYWForm, SaleExtrasForm, SaleForm, SaleEMailForm, RefundStartForm, UserSearchForm, UserBadgesForm
 
@@ -94,16 +95,13 @@ def square_callback(request):
         # Display main page with the sale still selected
         return redirect(reverse('boxoffice:main_sale', args=[boxoffice.uuid, sale.uuid]))
 
-    # Complete the sale
-    sale.transaction_ID = server_transaction_id
-    sale.completed = timezone.now()
-    sale.save()
-    logger.info(f"Sale {sale.id} completed (SquareUp)")
-    messages.success(request, "Card payment completed")
-
-    # Send e-mail receipt
-    if sale.customer:
-        send_email_receipt(sale, sale.customer)
+    # Record the payment and complete the sale (repeated callbacks are ignored and, if completing
+    # the sale fails, it is completed later by the process_payment_events command)
+    event, created = record_square_callback(sale, server_transaction_id, client_transaction_id)
+    if process_event(event.id):
+        messages.success(request, "Card payment completed")
+    else:
+        messages.warning(request, "Card payment received, the sale will be completed shortly")
 
     # Display main page for new sale
     return redirect(reverse('boxoffice:main', args=[boxoffice.uuid]))
@@ -134,17 +132,6 @@ def get_checkpoints(boxoffice, date):
     # Get today's checkpoints
     return boxoffice.checkpoints.filter(created__date = date).order_by('-created')
 
-def send_email_receipt(sale, email):
-
-    context = {
-        'festival': sale.festival,
-        'buttons': sale.buttons,
-        'fringers': sale.fringers.count(),
-        'tickets': sale.tickets.order_by('performance__date', 'performance__time', 'performance__show__name')
-    }
-    body = render_to_string('boxoffice/sale_email.txt', context)
-    send_mail('Tickets for ' + sale.festival.title, body, settings.DEFAULT_FROM_EMAIL, [email])
-
 # Forms
 def sale_tickets_form(festival, sale, performance, post_data = None):
 
@@ -653,24 +640,16 @@ def sale_tickets_add(request, sale_uuid, performance_uuid):
     form = sale_tickets_form(request.festival, sale, performance, request.POST)
     if form.is_valid():
 
-        # Check if there are sufficient tickets
+        # Reserve seats for the tickets
         requested_tickets = form.ticket_count
-        available_tickets = performance.tickets_available()
-        if requested_tickets <= available_tickets:
+        if reserve(performance, requested_tickets):
 
             # Add tickets
             for ticket_type in form.ticket_types:
                 quantity = form.cleaned_data[SaleTicketsForm.ticket_field_name(ticket_type)]
                 if quantity > 0:
-                    for n in range(quantity):
-                        ticket = Ticket(
-                            sale = sale,
-                            user = sale.customer_user,
-                            performance = performance,
-                            type = ticket_type,
-                        )
-                        ticket.save()
-                        logger.info(f"{ticket_type.name} ticket {ticket.id} for {performance.show.name} on {performance.date} at {performance.time} added to sale {sale.id}")
+                    create_tickets(performance, ticket_type, quantity, sale.customer_user, sale = sale)
+                    logger.info(f"{quantity} x {ticket_type.name} tickets for {performance.show.name} on {performance.date} at {performance.time} added to sale {sale.id}")
 
             # Prepare for adding more tickets
             form = None
@@ -678,11 +657,12 @@ def sale_tickets_add(request, sale_uuid, performance_uuid):
 
         # Insufficient tickets
         else:
+            available_tickets = performance.tickets_available()
             logger.info(f"Sale {sale.id} insufficient tickets ({requested_tickets} requested, {available_tickets} available) for {performance.show.name} on {performance.date} at {performance.time}")
             form.add_error(None, f"There are only {available_tickets} tickets available for this performance.")
 
     # Render sales tab content
-    return  render_sales(request, boxoffice, sale = sale, accordion='tickets', performance = performance, tickets_form = form)
+    return  render_sales(request, boxoffice, sale = sale, accordion='tickets', show = performance.show if performance else None, performance = performance, tickets_form = form)
 
 @require_GET
 @login_required
@@ -932,7 +912,7 @@ def sale_complete_cash(request, sale_uuid):
 
     # Send a receipt (if we have an e-mail address)
     if sale.customer:
-        send_email_receipt(sale, sale.customer)
+        queue_receipt(sale, sale.customer)
 
     # Update sales tab for new sale
     return render_sales(request, boxoffice)
@@ -1033,7 +1013,7 @@ def sale_update(request, sale_uuid):
 
         # If e-mail address was changed send a new receipt
         if 'email' in form.changed_data:
-            send_email_receipt(sale, sale.customer)
+            queue_receipt(sale, sale.customer)
 
         # Clear form
         form = None
@@ -1073,8 +1053,8 @@ def sale_email(request, sale_uuid):
     if form.is_valid():
 
         # Send e-mail receipt
-        send_email_receipt(sale, form.cleaned_data['email'])
-        return HttpResponse('<div id=sale-email-status" class="alert alert-success">e-mail sent.</div>')
+        queue_receipt(sale, form.cleaned_data['email'])
+        return HttpResponse('<div id=sale-email-status" class="alert alert-success">e-mail queued.</div>')
 
     # Form has errors
     return HttpResponse('<div id=sale-email-status" class="alert alert-danger">Invalid e-mail address.</div>')
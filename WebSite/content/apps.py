@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ContentConfig(AppConfig):
     name = 'content'
+
+    def ready(self):
+        # Connect signals using @receiver
+        from . import signals
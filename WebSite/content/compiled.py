@@ -0,0 +1,59 @@
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.template import Template
+
+from .models import Resource
+
+# Compiled template cache
+#
+# Pages, resources and show descriptions are Django templates stored in the database. Compiling
+# them is much slower than rendering them so compiled templates are kept in a process-local LRU
+# cache keyed by (model, pk, field, updated) so an edit always produces a new key. Template sources
+# that would otherwise need a query (the festival show template) are held in the shared (database)
+# cache so an edit is seen by every process.
+_templates = OrderedDict()
+_lock = Lock()
+
+def get_compiled_template(key, source):
+
+    # Get compiled template from the cache (compiling and adding it if necessary)
+    with _lock:
+        template = _templates.get(key)
+        if template:
+            _templates.move_to_end(key)
+            return template
+    template = Template(source)
+    with _lock:
+        _templates[key] = template
+        while len(_templates) > getattr(settings, 'COMPILED_TEMPLATE_CACHE_SIZE', 256):
+            _templates.popitem(last = False)
+    return template
+
+def get_template(instance, field = 'body'):
+    return get_compiled_template((instance._meta.label, instance.pk, field, instance.updated), getattr(instance, field))
+
+def _show_template_key(festival_id):
+    return f'content:show_template:{festival_id}'
+
+def get_show_template(festival):
+
+    # Get the festival's ShowTemplate resource (if any) using the shared cache for the source
+    key = _show_template_key(festival.id)
+    source = cache.get(key)
+    if source == None:
+        resource = Resource.objects.filter(festival = festival, name = 'ShowTemplate').first()
+        source = (resource.pk, resource.updated, resource.body) if resource else ()
+        cache.set(key, source, None)
+    if not source:
+        return None
+    pk, updated, body = source
+    return get_compiled_template((Resource._meta.label, pk, 'body', updated), body)
+
+def invalidate_show_template(festival_id):
+
+    # Clear the source once the change is committed (so a concurrent request cannot cache the old source)
+    transaction.on_commit(lambda: cache.delete(_show_template_key(festival_id)))
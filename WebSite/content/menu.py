@@ -0,0 +1,48 @@
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from core.middleware import festival_changed
+from .models import Navigator
+
+# Navigator menu
+#
+# The navigation bar is the same on every page (and for every user, the login and account links
+# are outside the menu) so the navigator tree for a festival is loaded in one query, rendered once
+# and the HTML held in a process-local cache. Each entry is validated against the festival version
+# the middleware has already read for the request, so a hit costs no queries. A change to a
+# navigator, page or document starts a new festival version once it is committed (see
+# content.signals) so every process renders the menu again.
+_menus = {}
+
+def get_navigator_tree(festival):
+
+    # Load all navigators (with their pages) and attach items to their parent menus
+    navigators = list(Navigator.objects.filter(festival = festival).select_related('page'))
+    items = {}
+    for navigator in navigators:
+        navigator.menu_items = []
+        items[navigator.id] = navigator
+    roots = []
+    for navigator in navigators:
+        if navigator.parent_id == None:
+            roots.append(navigator)
+        elif navigator.parent_id in items:
+            items[navigator.parent_id].menu_items.append(navigator)
+    return roots
+
+def get_navigator_menu(festival, version):
+
+    # Get rendered menu from the cache (rendering it if necessary)
+    cached = _menus.get(festival.id)
+    if cached and cached[0] == version:
+        return cached[1]
+    menu = mark_safe(render_to_string('content/_navigator_menu.html', {'navigators': get_navigator_tree(festival)}))
+    _menus[festival.id] = (version, menu)
+    return menu
+
+def invalidate_navigator_menu(festival_id):
+
+    # Start a new festival version once the change is committed (so a concurrent request cannot
+    # cache the old menu under the new version)
+    transaction.on_commit(festival_changed)
@@ -0,0 +1,38 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .compiled import invalidate_show_template
+from .menu import invalidate_navigator_menu
+from .models import Navigator, Page, Image, Document, Resource
+from .urlmap import invalidate_festival_urls
+
+
+# Navigator menu cache (see content.menu)
+@receiver(post_save, sender = Navigator)
+@receiver(post_delete, sender = Navigator)
+@receiver(post_save, sender = Page)
+@receiver(post_delete, sender = Page)
+@receiver(post_save, sender = Document)
+@receiver(post_delete, sender = Document)
+def navigator_menu_changed(sender, instance, **kwargs):
+    invalidate_navigator_menu(instance.festival_id)
+
+
+# Show template source cache (see content.compiled)
+@receiver(post_save, sender = Resource)
+@receiver(post_delete, sender = Resource)
+def resource_changed(sender, instance, **kwargs):
+    invalidate_show_template(instance.festival_id)
+
+
+# Festival URL maps (see content.urlmap)
+@receiver(post_save, sender = Page)
+@receiver(post_delete, sender = Page)
+@receiver(post_save, sender = Image)
+@receiver(post_delete, sender = Image)
+@receiver(post_save, sender = Document)
+@receiver(post_delete, sender = Document)
+@receiver(post_save, sender = Resource)
+@receiver(post_delete, sender = Resource)
+def festival_urls_changed(sender, instance, **kwargs):
+    invalidate_festival_urls(instance.festival_id)
@@ -0,0 +1,11 @@
+from django import template
+
+from content.menu import get_navigator_menu
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context = True)
+def navigator_menu(context):
+    request = context['request']
+    return get_navigator_menu(request.festival, request.festival_version)
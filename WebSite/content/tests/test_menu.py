@@ -0,0 +1,36 @@
+import pytest
+from django.core.cache import cache
+
+from content import menu
+from content.models import Navigator
+from core.middleware import get_festival_version
+from core.models import Festival
+
+
+@pytest.fixture
+def festival():
+    cache.clear()
+    menu._menus.clear()
+    festival = Festival.objects.create(name = 'TEST', title = 'Test festival', is_live = True)
+    Navigator.objects.create(festival = festival, label = 'Shows', type = Navigator.SHOWS)
+    return festival
+
+@pytest.mark.django_db
+def test_menu_cached_without_queries(festival, django_assert_num_queries):
+    version = get_festival_version()
+    html = menu.get_navigator_menu(festival, version)
+    assert 'Shows' in html
+    with django_assert_num_queries(0):
+        assert menu.get_navigator_menu(festival, version) == html
+
+@pytest.mark.django_db
+def test_menu_rendered_after_commit(festival, django_capture_on_commit_callbacks):
+    version = get_festival_version()
+    assert 'Venues' not in menu.get_navigator_menu(festival, version)
+
+    # The cached menu is kept until the change is committed and the version changes
+    with django_capture_on_commit_callbacks(execute = True):
+        Navigator.objects.create(festival = festival, label = 'Venues', type = Navigator.VENUES)
+        assert get_festival_version() == version
+    assert get_festival_version() != version
+    assert 'Venues' in menu.get_navigator_menu(festival, get_festival_version())
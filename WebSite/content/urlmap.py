@@ -0,0 +1,38 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.urls import reverse
+
+from .models import Page, Image, Document, Resource
+
+# Festival URL map
+#
+# Content pages, resources and show descriptions can refer to any of the festival's images,
+# documents, pages and resources by name. The name to URL maps are built once per festival and
+# held in the shared cache until any of those objects is changed (see content.signals).
+def _urlmap_key(festival_id):
+    return f'content:urlmap:{festival_id}'
+
+def get_festival_urls(festival):
+
+    # Get URL maps from the cache (building them if necessary)
+    key = _urlmap_key(festival.id)
+    urls = cache.get(key)
+    if urls == None:
+        pages = list(Page.objects.filter(festival = festival).only('uuid', 'name'))
+        resources = list(Resource.objects.filter(festival = festival).only('uuid', 'name'))
+        urls = {
+            'image_urls': { image.name:image.get_absolute_url() for image in Image.objects.filter(festival = festival).only('name', 'image') if image.image },
+            'document_urls': { document.name:document.get_absolute_url() for document in Document.objects.filter(festival = festival).only('uuid', 'name', 'file') if document.file },
+            'page_urls': { page.name:page.get_absolute_url() for page in pages },
+            'page_uuid_urls': { page.name:reverse('content:page', args=[page.uuid]) for page in pages },
+            'page_test_urls': { page.name:page.get_test_url() for page in pages },
+            'resource_urls': { resource.name:resource.get_absolute_url() for resource in resources },
+            'resource_test_urls': { resource.name:resource.get_test_url() for resource in resources },
+        }
+        cache.set(key, urls, None)
+    return urls
+
+def invalidate_festival_urls(festival_id):
+
+    # Clear the maps once the change is committed (so a concurrent request cannot cache the old maps)
+    transaction.on_commit(lambda: cache.delete(_urlmap_key(festival_id)))
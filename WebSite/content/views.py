@@ -16,6 +16,8 @@ from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Field, HTML, Submit, Button, Row, Column
 from crispy_forms.bootstrap import FormActions, TabHolder, Tab, Div
 
+from .compiled import get_template
+from .urlmap import get_festival_urls
 from .models import Page, PageImage, Navigator, Image, Document, Resource
 from .forms import AdminPageForm, AdminPageImageForm, AdminNavigatorForm, AdminImageForm, AdminDocumentForm, AdminResourceForm
 
@@ -36,11 +38,12 @@ def page(request, page_uuid):
     page = get_object_or_404(Page, uuid=page_uuid)
 
     # Render the page body as a Django template
-    image_urls = { image.name:image.get_absolute_url() for image in request.festival.images.all() if image.image }
+    urls = get_festival_urls(request.festival)
+    image_urls = dict(urls['image_urls'])
     image_urls.update({ image.name:image.get_absolute_url() for image in page.images.all() if image.image })
-    document_urls = { document.name:document.get_absolute_url() for document in request.festival.documents.all() if document.file }
-    page_urls = { page.name:page.get_absolute_url() for page in request.festival.pages.all() }
-    resource_urls = { resource.name:resource.get_absolute_url() for resource in request.festival.resources.all() }
+    document_urls = urls['document_urls']
+    page_urls = urls['page_urls']
+    resource_urls = urls['resource_urls']
     body_context = {
         'user': request.user,
         'page': page,
@@ -50,7 +53,7 @@ def page(request, page_uuid):
         'resource_urls': resource_urls,
         'archive_url': '/festival/archive/index',
     }
-    template = Template(page.body)
+    template = get_template(page)
     body_html = template.render(Context(body_context))
 
     # Render the page
@@ -67,11 +70,12 @@ def page_test(request, page_uuid):
     page = get_object_or_404(Page, uuid=page_uuid)
 
     # Render the page body as a Django template
-    image_urls = { image.name:image.get_absolute_url() for image in request.festival.images.all() if image.image }
+    urls = get_festival_urls(request.festival)
+    image_urls = dict(urls['image_urls'])
     image_urls.update({ image.name:image.get_absolute_url() for image in page.images.all() if image.image })
-    document_urls = { document.name:document.get_absolute_url() for document in request.festival.documents.all() if document.file }
-    page_urls = { page.name:page.get_test_url() for page in request.festival.pages.all() }
-    resource_urls = { resource.name:resource.get_test_url() for resource in request.festival.resources.all() }
+    document_urls = urls['document_urls']
+    page_urls = urls['page_test_urls']
+    resource_urls = urls['resource_test_urls']
     body_context = {
         'user': request.user,
         'page': page,
@@ -80,7 +84,7 @@ def page_test(request, page_uuid):
         'page_urls': page_urls,
         'resource_urls': resource_urls,
     }
-    template = Template(page.body_test or page.body)
+    template = get_template(page, 'body_test' if page.body_test else 'body')
     body_html = template.render(Context(body_context))
 
     # Render the page
@@ -112,10 +116,11 @@ def resource(request, resource_uuid):
 
     # Get the document and return it
     resource = get_object_or_404(Resource, uuid=resource_uuid)
-    image_urls = { image.name:image.get_absolute_url() for image in request.festival.images.all() if image.image }
-    document_urls = { document.name:document.get_absolute_url() for document in request.festival.documents.all() if document.file }
-    page_urls = { page.name:page.get_absolute_url() for page in request.festival.pages.all() }
-    resource_urls = { resource.name:resource.get_absolute_url() for resource in request.festival.resources.all() }
+    urls = get_festival_urls(request.festival)
+    image_urls = urls['image_urls']
+    document_urls = urls['document_urls']
+    page_urls = urls['page_urls']
+    resource_urls = urls['resource_urls']
     context = {
         'page': page,
         'image_urls': image_urls,
@@ -123,7 +128,7 @@ def resource(request, resource_uuid):
         'page_urls': page_urls,
         'resource_urls': resource_urls,
     }
-    template = Template(resource.body)
+    template = get_template(resource)
     return HttpResponse(template.render(Context(context)), content_type=resource.type)
 
 
@@ -131,10 +136,11 @@ def resource_test(request, resource_uuid):
 
     # Get the document and return it
     resource = get_object_or_404(Resource, uuid=resource_uuid)
-    image_urls = { image.name:image.get_absolute_url() for image in request.festival.images.all() if image.image }
-    document_urls = { document.name:document.get_absolute_url() for document in request.festival.documents.all() if document.file }
-    page_urls = { page.name:page.get_test_url() for page in request.festival.pages.all() }
-    resource_urls = { resource.name:resource.get_test_url() for resource in request.festival.resources.all() }
+    urls = get_festival_urls(request.festival)
+    image_urls = urls['image_urls']
+    document_urls = urls['document_urls']
+    page_urls = urls['page_test_urls']
+    resource_urls = urls['resource_test_urls']
     context = {
         'page': page,
         'image_urls': image_urls,
@@ -142,7 +148,7 @@ def resource_test(request, resource_uuid):
         'page_urls': page_urls,
         'resource_urls': resource_urls,
     }
-    template = Template(resource.body_test or resource.body)
+    template = get_template(resource, 'body_test' if resource.body_test else 'body')
     return HttpResponse(template.render(Context(context)), content_type=resource.type)
 
 
@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.outbox import send_queued
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = 'Send the e-mails that are due in the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type = int, default = getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 100), help = 'Number of messages claimed and sent at a time')
+        parser.add_argument('--max-attempts', type = int, default = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 6), help = 'Attempts before a message is marked as failed')
+        parser.add_argument('--retry', type = int, default = getattr(settings, 'EMAIL_OUTBOX_RETRY_SECONDS', 60), help = 'Seconds before a failed message is retried (doubled after each attempt)')
+        parser.add_argument('--stale', type = int, default = getattr(settings, 'EMAIL_OUTBOX_STALE_MINUTES', 15), help = 'Minutes before messages claimed by a stopped worker are sent again')
+        parser.add_argument('--loop', action = 'store_true', help = 'Keep running, sending every --interval seconds')
+        parser.add_argument('--interval', type = int, default = 30, help = 'Seconds between runs in loop mode')
+
+    def handle(self, *args, **options):
+
+        # Send once or until stopped (in loop mode errors are logged and the next run continues)
+        if not options['loop']:
+            self.send(options)
+            return
+        while True:
+            try:
+                self.send(options)
+            except Exception:
+                logger.exception('Sending queued e-mail failed')
+            time.sleep(options['interval'])
+
+    def send(self, options):
+        sent, failed = send_queued(options['batch'], options['max_attempts'], options['stale'], options['retry'])
+        self.stdout.write(f'{sent} e-mails sent, {failed} failed')
@@ -1,13 +1,70 @@
 # pylint: disable=missing-docstring
-from datetime import datetime
+from copy import copy
+from datetime import datetime, date as date_type, time as time_type
+from uuid import uuid4
 from dateutil.parser import parse
 
 from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import get_object_or_404, redirect
 from django.utils import timezone
 
 from .models import Festival
 
+# Festival cache
+#
+# Festivals (including their cached properties) are kept in a process-local cache. The version
+# key is held in the shared (database) cache so a change made by any process (see core.signals)
+# causes every process to reload its festivals (and other per-festival data validated against
+# the same version, see content.menu).
+FESTIVAL_VERSION_KEY = 'core:festival_version'
+_festivals = {}
+
+def festival_changed():
+    cache.set(FESTIVAL_VERSION_KEY, uuid4().hex, None)
+    _festivals.clear()
+
+def get_festival_version():
+
+    # Get the shared version (starting a new one if necessary)
+    version = cache.get(FESTIVAL_VERSION_KEY)
+    if version == None:
+        version = uuid4().hex
+        if not cache.add(FESTIVAL_VERSION_KEY, version, None):
+            version = cache.get(FESTIVAL_VERSION_KEY)
+    return version
+
+def get_festival(festival_id = None, version = None):
+
+    # Get festival (or the live festival) from the cache loading it (and the content used by
+    # every page) if necessary
+    version = version or get_festival_version()
+    key = festival_id or 'live'
+    cached = _festivals.get(key)
+    if cached and cached[0] == version:
+        festival = cached[1]
+    else:
+        festival = Festival.objects.get(id = festival_id) if festival_id else Festival.get_live()
+        if festival:
+            for name in ('stylesheet', 'banner', 'banner_mobile', 'privacy_policy'):
+                getattr(festival, name)
+        _festivals[key] = (version, festival)
+
+    # Each request gets its own copy (sharing the cached property values)
+    return copy(festival) if festival else None
+
+def _parse_date(value):
+    try:
+        return date_type.fromisoformat(value)
+    except ValueError:
+        return parse(value).date()
+
+def _parse_time(value):
+    try:
+        return time_type.fromisoformat(value)
+    except ValueError:
+        return parse(value).time()
+
 class FestivalMiddleware:
 
     def __init__(self, get_response):
@@ -15,14 +72,16 @@ class FestivalMiddleware:
 
     def __call__(self, request):
 
-        # Check if there is a festival cookie; if not default to the live festival
+        # Check if there is a festival cookie; if not default to the live festival. The version is
+        # kept on the request so other process-local caches can be validated against it.
         festival = None
+        request.festival_version = get_festival_version()
         try:
             festival_id = int(request.get_signed_cookie(settings.FESTIVAL_COOKIE, default=0))
             if festival_id:
-                festival = Festival.objects.get(id=festival_id)
+                festival = get_festival(festival_id, request.festival_version)
             if not festival:
-                festival = Festival.get_live()
+                festival = get_festival(version = request.festival_version)
         except (ValueError, Festival.DoesNotExist):
             festival = None
         if not festival:
@@ -30,8 +89,9 @@ class FestivalMiddleware:
         request.festival = festival
 
         # Add curret date/time to request
-        date = parse(request.session.get('date', str(timezone.now().date()))).date()
-        time = parse(request.session.get('time', str(timezone.now().time()))).time()
+        now = timezone.now()
+        date = _parse_date(request.session['date']) if 'date' in request.session else now.date()
+        time = _parse_time(request.session['time']) if 'time' in request.session else now.time()
         request.now = datetime.combine(date, time)
 
         # Process request
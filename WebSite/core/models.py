@@ -157,11 +157,14 @@ class User(TimeStampedModel, AbstractBaseUser, PermissionsMixin):
     def badges_purchased(self):
         return self.sales.filter(boxoffice__isnull=True, venue__isnull=True, completed__isnull=False, buttons__gt=0)
 
+    def get_entitlements(self):
+        from tickets.entitlements import get_balance
+        return get_balance(self)
+
     @property
     def badges_to_collect(self):
-        purchased = sum(s.buttons for s in self.badges_purchased())
-        issued = sum(bi.badges for bi in self.badges_issued.all())
-        return purchased - issued
+        balance = self.get_entitlements()
+        return balance.badges_purchased - balance.badges_issued
     
     def get_full_name(self):
         return f'{self.first_name} {self.last_name}'
@@ -180,21 +183,80 @@ class User(TimeStampedModel, AbstractBaseUser, PermissionsMixin):
         send_mail(subject, message, from_email, [self.email])
 
     # Volunteers
-    @property
-    def volunteer_comps_earned(self):
+    def _comps_earned(self, balance):
 
-        # Calculate comps earned (rounded down) and limit to maximum for festival
-        comps = 0
-        for shift in self.volunteer_shifts.all():
-            comps += shift.role.comps_per_shift
-        comps = int(comps)
+        # Comps earned (rounded down) limited to maximum for festival
+        comps = int(round(balance.comps_earned, 6))
         max_comps = self.festival.volunteer_comps
         return comps if max_comps == 0 else min(comps, max_comps)
 
+    @property
+    def volunteer_comps_earned(self):
+        return self._comps_earned(self.get_entitlements())
+
     @property
     def volunteer_comps_used(self):
-        return self.tickets.filter(type=self.festival.volunteer_ticket_type, sale__completed__isnull = False).count()
+        return self.get_entitlements().comps_used
 
     @property
     def volunteer_comps_available(self):
-        return self.volunteer_comps_earned - self.volunteer_comps_used
+        balance = self.get_entitlements()
+        return self._comps_earned(balance) - balance.comps_used
+
+
+class EmailBatch(TimeStampedModel):
+
+    # An e-mail queued for a list of recipients (see core.outbox)
+    festival = models.ForeignKey(Festival, null = True, blank = True, on_delete = models.CASCADE, related_name = 'email_batches')
+    created_by = models.ForeignKey(User, null = True, blank = True, on_delete = models.SET_NULL, related_name = '+')
+    subject = models.CharField(max_length = 128)
+    body = models.TextField()
+    from_email = models.CharField(max_length = 254)
+    total = models.IntegerField(default = 0)
+    sent = models.IntegerField(default = 0)
+    failed = models.IntegerField(default = 0)
+    completed = models.DateTimeField(null = True, blank = True)
+
+    def __str__(self):
+        return f'{self.subject} ({self.sent}/{self.total})'
+
+    @property
+    def pending(self):
+        return self.total - self.sent - self.failed
+
+
+class OutboxMessage(models.Model):
+
+    # A single queued e-mail (either one recipient of a batch or a message with its own content)
+    STATE_PENDING = 1
+    STATE_SENDING = 2
+    STATE_SENT = 3
+    STATE_FAILED = 4
+    STATE_CHOICES = (
+        (STATE_PENDING, 'Pending'),
+        (STATE_SENDING, 'Sending'),
+        (STATE_SENT, 'Sent'),
+        (STATE_FAILED, 'Failed'),
+    )
+
+    batch = models.ForeignKey(EmailBatch, null = True, blank = True, on_delete = models.CASCADE, related_name = 'messages')
+    to = models.CharField(max_length = 254)
+    subject = models.CharField(max_length = 128, blank = True, default = '')
+    body = models.TextField(blank = True, default = '')
+    from_email = models.CharField(max_length = 254, blank = True, default = '')
+    reference = models.CharField(max_length = 64, blank = True, default = '')
+    state = models.PositiveIntegerField(choices = STATE_CHOICES, default = STATE_PENDING)
+    attempts = models.IntegerField(default = 0)
+    next_attempt = models.DateTimeField(null = True, blank = True)
+    error = models.TextField(blank = True, default = '')
+    sent = models.DateTimeField(null = True, blank = True)
+    created = models.DateTimeField(auto_now_add = True)
+    updated = models.DateTimeField(auto_now = True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['state', 'id']),
+        ]
+
+    def __str__(self):
+        return f'{self.to} ({self.get_state_display()})'
@@ -0,0 +1,153 @@
+import datetime
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .models import EmailBatch, OutboxMessage
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+# E-mail outbox
+#
+# E-mails are queued in the database and sent by the send_queued_email command rather than
+# inside the request. Bulk e-mails are queued as a batch with a row for each recipient and
+# transactional e-mails (such as sale confirmations) are queued in the same transaction as the
+# change they report, so they are sent if and only if it commits. The worker claims pending
+# messages in chunks (marking them as sending so other workers skip them), sends them through a
+# single connection and records the outcome of each message and the progress of its batch, so a
+# run that is interrupted can be resumed where it stopped. Failed messages are retried with
+# exponential backoff (from EMAIL_OUTBOX_RETRY_SECONDS) until EMAIL_OUTBOX_MAX_ATTEMPTS is
+# reached and messages left sending by a worker that stopped part way through are returned to
+# the queue after EMAIL_OUTBOX_STALE_MINUTES.
+def queue_email(festival, subject, body, recipients, created_by = None, from_email = None):
+
+    # Create the batch and a message for each recipient
+    with transaction.atomic():
+        batch = EmailBatch.objects.create(
+            festival = festival,
+            created_by = created_by,
+            subject = subject,
+            body = body,
+            from_email = from_email or settings.DEFAULT_FROM_EMAIL,
+            total = len(recipients),
+        )
+        OutboxMessage.objects.bulk_create([OutboxMessage(batch = batch, to = to) for to in recipients], batch_size = 500)
+    logger.info(f"e-mail '{subject}' queued for {len(recipients)} recipients (batch {batch.id})")
+    return batch
+
+def queue_message(to, subject, body, reference = '', from_email = None):
+
+    # Queue a single e-mail (in the caller's transaction)
+    message = OutboxMessage.objects.create(to = to, subject = subject, body = body, reference = reference, from_email = from_email or settings.DEFAULT_FROM_EMAIL)
+    logger.info(f"e-mail '{subject}' to {to} queued")
+    return message
+
+def release_stale(minutes):
+
+    # Return messages claimed by a worker that did not finish to the queue
+    cutoff = timezone.now() - datetime.timedelta(minutes = minutes)
+    released = OutboxMessage.objects.filter(state = OutboxMessage.STATE_SENDING, updated__lt = cutoff).update(state = OutboxMessage.STATE_PENDING, updated = timezone.now())
+    if released:
+        logger.warning(f"{released} stale e-mails returned to the outbox")
+    return released
+
+def _claim(chunk_size, after_id):
+
+    # Claim the next chunk of pending messages
+    with transaction.atomic():
+        messages = list(OutboxMessage.objects.select_for_update(skip_locked = True, of = ('self',))
+                                             .filter(state = OutboxMessage.STATE_PENDING, id__gt = after_id)
+                                             .filter(Q(next_attempt__isnull = True) | Q(next_attempt__lte = timezone.now()))
+                                             .select_related('batch')
+                                             .order_by('id')[:chunk_size])
+        if messages:
+            OutboxMessage.objects.filter(id__in = [m.id for m in messages]).update(state = OutboxMessage.STATE_SENDING, attempts = F('attempts') + 1, updated = timezone.now())
+    return messages
+
+def _send_messages(connection, messages, max_attempts, retry_seconds):
+
+    # Send each message (so failures are recorded against the recipient)
+    sent = []
+    failed = {}
+    for message in messages:
+        content = message.batch or message
+        email = EmailMessage(content.subject, content.body, content.from_email, [message.to], connection = connection)
+        try:
+            if connection.send_messages([email]):
+                sent.append(message)
+            else:
+                failed[message] = 'Not sent'
+        except Exception as e:
+            failed[message] = str(e) or type(e).__name__
+    _record(sent, failed, max_attempts, retry_seconds)
+    return len(sent), len(failed)
+
+def _record(sent, failed, max_attempts, retry_seconds):
+
+    # Save the outcome of each message and the progress of their batches
+    now = timezone.now()
+    progress = {}
+    OutboxMessage.objects.filter(id__in = [m.id for m in sent]).update(state = OutboxMessage.STATE_SENT, error = '', sent = now, updated = now)
+    for message in sent:
+        progress.setdefault(message.batch_id, [0, 0])[0] += 1
+    for message, error in failed.items():
+
+        # Retry after a delay that doubles with each attempt (the claim has already counted this one)
+        attempts = message.attempts + 1
+        state = OutboxMessage.STATE_FAILED if attempts >= max_attempts else OutboxMessage.STATE_PENDING
+        next_attempt = now + datetime.timedelta(seconds = retry_seconds * 2 ** (attempts - 1)) if state == OutboxMessage.STATE_PENDING else None
+        OutboxMessage.objects.filter(id = message.id).update(state = state, error = error, next_attempt = next_attempt, updated = now)
+        logger.warning(f"e-mail to {message.to} failed (attempt {attempts}): {error}")
+        if state == OutboxMessage.STATE_FAILED:
+            progress.setdefault(message.batch_id, [0, 0])[1] += 1
+    for batch_id, (batch_sent, batch_failed) in progress.items():
+        if batch_id:
+            EmailBatch.objects.filter(id = batch_id).update(sent = F('sent') + batch_sent, failed = F('failed') + batch_failed)
+
+    # Batches are complete when none of their messages are waiting to be sent
+    waiting = OutboxMessage.objects.filter(batch = OuterRef('pk'), state__in = (OutboxMessage.STATE_PENDING, OutboxMessage.STATE_SENDING))
+    EmailBatch.objects.filter(id__in = {m.batch_id for m in list(sent) + list(failed)}, completed__isnull = True).exclude(Exists(waiting)).update(completed = now)
+
+def send_queued(chunk_size = None, max_attempts = None, stale_minutes = None, retry_seconds = None):
+
+    # Send everything due in the outbox through one connection
+    chunk_size = chunk_size or getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 100)
+    max_attempts = max_attempts or getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 6)
+    retry_seconds = retry_seconds if retry_seconds != None else getattr(settings, 'EMAIL_OUTBOX_RETRY_SECONDS', 60)
+    release_stale(stale_minutes or getattr(settings, 'EMAIL_OUTBOX_STALE_MINUTES', 15))
+    sent = failed = 0
+    after_id = 0
+    connection = None
+    try:
+        while True:
+
+            # Each message is tried at most once in a run
+            messages = _claim(chunk_size, after_id)
+            if not messages:
+                break
+            after_id = messages[-1].id
+
+            # Open the connection for the first chunk (returning the chunk to the queue if that fails)
+            if not connection:
+                connection = get_connection()
+                try:
+                    connection.open()
+                except Exception as e:
+                    _record([], {message: str(e) or type(e).__name__ for message in messages}, max_attempts, retry_seconds)
+                    connection = None
+                    raise
+            chunk_sent, chunk_failed = _send_messages(connection, messages, max_attempts, retry_seconds)
+            sent += chunk_sent
+            failed += chunk_failed
+    finally:
+        if connection:
+            connection.close()
+    if sent or failed:
+        logger.info(f"{sent} e-mails sent, {failed} failed")
+    return sent, failed
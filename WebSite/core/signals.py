@@ -0,0 +1,28 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .middleware import festival_changed
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Festival cache (see core.middleware). Any change to a festival or to the objects held by its
+# cached properties invalidates the cached festivals in every process (once the change has been
+# committed, so a concurrent request cannot cache the old data under the new version).
+@receiver(post_save, sender = 'core.Festival')
+@receiver(post_delete, sender = 'core.Festival')
+@receiver(post_save, sender = 'content.Image')
+@receiver(post_delete, sender = 'content.Image')
+@receiver(post_save, sender = 'content.Resource')
+@receiver(post_delete, sender = 'content.Resource')
+@receiver(post_save, sender = 'content.Document')
+@receiver(post_delete, sender = 'content.Document')
+@receiver(post_save, sender = 'tickets.FringerType')
+@receiver(post_delete, sender = 'tickets.FringerType')
+@receiver(post_save, sender = 'tickets.TicketType')
+@receiver(post_delete, sender = 'tickets.TicketType')
+def festival_data_saved(sender, **kwargs):
+    transaction.on_commit(festival_changed)
@@ -0,0 +1,18 @@
+import pytest
+
+from core.middleware import get_festival
+from core.models import Festival
+
+
+@pytest.mark.django_db
+def test_festival_reloaded_after_commit(django_capture_on_commit_callbacks):
+    festival = Festival.objects.create(name = 'TEST', title = 'Test festival', is_live = True)
+    assert get_festival(festival.id).title == 'Test festival'
+
+    # The cached festival is kept until the change is committed
+    with django_capture_on_commit_callbacks(execute = True) as callbacks:
+        festival.title = 'Renamed festival'
+        festival.save()
+        assert get_festival(festival.id).title == 'Test festival'
+    assert len(callbacks) == 1
+    assert get_festival(festival.id).title == 'Renamed festival'
@@ -0,0 +1,170 @@
+import datetime
+from smtplib import SMTPRecipientsRefused
+from unittest import mock
+
+import pytest
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from core import outbox
+from core.models import Festival, User, EmailBatch, OutboxMessage
+from tickets.models import Sale
+from tickets.payments import complete_sale
+
+
+class FailingBackend(EmailBackend):
+
+    # Refuses mail for any address starting with 'bad'
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to[0].startswith('bad'):
+                raise SMTPRecipientsRefused({message.to[0]: (550, b'Refused')})
+        return super().send_messages(messages)
+
+
+@pytest.fixture
+def locmem(settings):
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    settings.DEFAULT_FROM_EMAIL = 'festival@example.com'
+    return settings
+
+def create_batch(recipients):
+    festival = Festival.objects.create(name = 'TEST', title = 'Test festival', is_live = True)
+    return outbox.queue_email(festival, 'Hello', 'Message body', recipients)
+
+def retry_now():
+    OutboxMessage.objects.filter(state = OutboxMessage.STATE_PENDING).update(next_attempt = timezone.now())
+
+
+@pytest.mark.django_db
+def test_batch_sent_through_one_connection(locmem):
+
+    batch = create_batch([f'user{i}@example.com' for i in range(7)])
+    with mock.patch('core.outbox.get_connection', wraps = outbox.get_connection) as get_connection:
+        call_command('send_queued_email', '--batch', '3')
+    assert get_connection.call_count == 1
+    assert sorted(m.to[0] for m in mail.outbox) == [f'user{i}@example.com' for i in range(7)]
+    assert all(m.subject == 'Hello' and m.from_email == 'festival@example.com' for m in mail.outbox)
+    batch.refresh_from_db()
+    assert (batch.sent, batch.failed, batch.pending) == (7, 0, 0)
+    assert batch.completed != None
+    assert not OutboxMessage.objects.exclude(state = OutboxMessage.STATE_SENT).exists()
+
+    # Nothing is sent twice
+    call_command('send_queued_email')
+    assert len(mail.outbox) == 7
+
+@pytest.mark.django_db
+def test_failed_messages_are_retried(locmem):
+
+    batch = create_batch(['good1@example.com', 'bad@example.com', 'good2@example.com'])
+    locmem.EMAIL_BACKEND = 'core.tests.test_outbox.FailingBackend'
+    call_command('send_queued_email', '--batch', '2')
+    assert sorted(m.to[0] for m in mail.outbox) == ['good1@example.com', 'good2@example.com']
+    failed = OutboxMessage.objects.get(to = 'bad@example.com')
+    assert (failed.state, failed.attempts) == (OutboxMessage.STATE_PENDING, 1)
+    assert 'Refused' in failed.error
+    batch.refresh_from_db()
+    assert (batch.sent, batch.failed, batch.completed) == (2, 0, None)
+
+    # Resumed run only sends the outstanding message (once it is due)
+    locmem.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    call_command('send_queued_email')
+    assert len(mail.outbox) == 2
+    retry_now()
+    call_command('send_queued_email')
+    assert sorted(m.to[0] for m in mail.outbox) == ['bad@example.com', 'good1@example.com', 'good2@example.com']
+    batch.refresh_from_db()
+    assert (batch.sent, batch.failed) == (3, 0)
+    assert batch.completed != None
+
+@pytest.mark.django_db
+def test_messages_fail_after_max_attempts(locmem):
+
+    batch = create_batch(['bad@example.com', 'good@example.com'])
+    locmem.EMAIL_BACKEND = 'core.tests.test_outbox.FailingBackend'
+    for attempt in range(2):
+        call_command('send_queued_email', '--max-attempts', '2')
+        retry_now()
+    failed = OutboxMessage.objects.get(to = 'bad@example.com')
+    assert (failed.state, failed.attempts) == (OutboxMessage.STATE_FAILED, 2)
+    batch.refresh_from_db()
+    assert (batch.sent, batch.failed, batch.pending) == (1, 1, 0)
+    assert batch.completed != None
+
+@pytest.mark.django_db
+def test_stale_messages_are_released(locmem):
+
+    create_batch(['user@example.com'])
+    OutboxMessage.objects.update(state = OutboxMessage.STATE_SENDING, updated = timezone.now() - datetime.timedelta(hours = 1))
+    call_command('send_queued_email', '--stale', '30')
+    assert [m.to[0] for m in mail.outbox] == ['user@example.com']
+
+@pytest.mark.django_db
+def test_admin_email_is_queued(locmem, client):
+
+    festival = Festival.objects.create(name = 'TEST', title = 'Test festival', is_live = True)
+    admin = User.objects.create_user(festival, 'admin@example.com', 'password', is_admin = True)
+    for i in range(3):
+        User.objects.create_user(festival, f'user{i}@example.com', 'password')
+    client.force_login(admin)
+    response = client.post(reverse('festival:admin_user_email_send'), {'subject': 'News', 'body': 'Festival news'})
+    assert response.status_code == 200
+    assert len(mail.outbox) == 0
+    batch = EmailBatch.objects.get()
+    assert (batch.festival, batch.created_by, batch.total) == (festival, admin, 4)
+    call_command('send_queued_email')
+    assert len(mail.outbox) == 4
+
+@pytest.mark.django_db
+def test_retries_back_off(locmem):
+
+    create_batch(['bad@example.com'])
+    locmem.EMAIL_BACKEND = 'core.tests.test_outbox.FailingBackend'
+    delays = []
+    for attempt in range(3):
+        start = timezone.now()
+        call_command('send_queued_email', '--retry', '60')
+        message = OutboxMessage.objects.get()
+        delays.append(round((message.next_attempt - start).total_seconds() / 60))
+        retry_now()
+    assert delays == [1, 2, 4]
+    assert message.attempts == 3
+
+@pytest.mark.django_db
+def test_message_is_queued_with_transaction(locmem):
+
+    # Messages are only sent if the transaction that queued them commits
+    with pytest.raises(RuntimeError):
+        with transaction.atomic():
+            outbox.queue_message('lost@example.com', 'Receipt', 'Body')
+            raise RuntimeError()
+    outbox.queue_message('customer@example.com', 'Receipt', 'Body', reference = 'sale:1')
+    call_command('send_queued_email')
+    assert [(m.to[0], m.subject, m.body) for m in mail.outbox] == [('customer@example.com', 'Receipt', 'Body')]
+    assert OutboxMessage.objects.get().state == OutboxMessage.STATE_SENT
+
+@pytest.mark.django_db
+def test_sale_completion_does_not_send_mail(locmem):
+
+    festival = Festival.objects.create(name = 'TEST', title = 'Test festival', is_live = True)
+    user = User.objects.create_user(festival, 'customer@example.com', 'password')
+    sale = Sale.objects.create(festival = festival, user = user, buttons = 2, transaction_type = Sale.TRANSACTION_TYPE_STRIPE)
+    locmem.EMAIL_BACKEND = 'core.tests.test_outbox.FailingBackend'
+    with mock.patch.object(FailingBackend, 'open', side_effect = OSError('SMTP unavailable')):
+        with transaction.atomic():
+            assert complete_sale(sale.id)
+    sale.refresh_from_db()
+    assert sale.completed != None
+    message = OutboxMessage.objects.get()
+    assert (message.to, message.reference, message.state) == ('customer@example.com', f'sale:{sale.id}', OutboxMessage.STATE_PENDING)
+    assert len(mail.outbox) == 0
+
+    # Delivered by the worker
+    locmem.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    call_command('send_queued_email')
+    assert [m.subject for m in mail.outbox] == ['Confirmation from Test festival']
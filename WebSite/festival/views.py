@@ -16,13 +16,13 @@ from django.utils.safestring import mark_safe
 from django.views import View
 from django.views.generic import ListView, CreateView, UpdateView
 from django.views.decorators.http import require_GET, require_POST
-from django.core.mail import send_mail
 
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Field, HTML, Submit, Button, Row, Column
 from crispy_forms.bootstrap import FormActions, TabHolder, Tab, Div
 
 from core.models import Festival, User
+from core.outbox import queue_email, queue_message
 
 from program.models import Company, Show, ShowPerformance
 from tickets.models import BoxOffice, Sale, TicketType, Ticket, FringerType, Fringer, PayAsYouWill, Bucket
@@ -582,7 +582,8 @@ def admin_user_email(request):
             { 'text': 'Festival Admin', 'url': reverse('festival:admin') },
             { 'text': 'e-mail' },
         ],
-        'form': form
+        'form': form,
+        'batches': request.festival.email_batches.order_by('-created')[:10],
     }
     return render(request, 'festival/admin_user_email.html', context)
 
@@ -596,12 +597,10 @@ def admin_user_email_send(request):
     form = EMailForm(request.POST)
     if form.is_valid():
 
-        # Send e-mail
-        count = 0
-        for user in User.objects.filter(festival = request.festival).order_by('email'):
-            send_mail(form.cleaned_data['subject'], form.cleaned_data['body'], settings.DEFAULT_FROM_EMAIL, [user.email])
-            count = count + 1
-        messages.success(request, f"{count} e-mails sent")
+        # Queue e-mail (it is sent by the send_queued_email command)
+        recipients = list(User.objects.filter(festival = request.festival).order_by('email').values_list('email', flat = True))
+        queue_email(request.festival, form.cleaned_data['subject'], form.cleaned_data['body'], recipients, created_by = request.user)
+        messages.success(request, f"{len(recipients)} e-mails queued")
         form = EMailForm()
 
     else:
@@ -619,7 +618,8 @@ def admin_user_email_send(request):
             { 'text': 'Festival Admin', 'url': reverse('festival:admin') },
             { 'text': 'e-mail' },
         ],
-        'form': form
+        'form': form,
+        'batches': request.festival.email_batches.order_by('-created')[:10],
     }
     return render(request, 'festival/admin_user_email.html', context)
 
@@ -738,7 +738,7 @@ def admin_sale_confirmation(request, sale_uuid):
             'tickets': sale.tickets.order_by('performance__date', 'performance__time', 'performance__show__name')
         }
         body = render_to_string('tickets/sale_email.txt', context)
-        send_mail('Tickets for ' + request.festival.title, body, settings.DEFAULT_FROM_EMAIL, [sale.customer])
+        queue_message(sale.customer, 'Tickets for ' + request.festival.title, body, reference = f'sale:{sale.id}')
         is_sent = True
 
     return JsonResponse({
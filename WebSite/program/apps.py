@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ProgramConfig(AppConfig):
     name = 'program'
+
+    def ready(self):
+        # Connect signals using @receiver
+        from . import signals
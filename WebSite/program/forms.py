@@ -9,30 +9,34 @@ from .models import Venue, VenueContact, VenueSponsor, Company, CompanyContact,
 
 class SearchForm(forms.Form):
 
-    class GenreChoiceField(forms.ModelMultipleChoiceField):
-
-        def label_from_instance(self, obj):
-            return obj.name
-
     def __init__(self, *args, **kwargs):
 
-        # Save festival
-        self.festival = kwargs.pop('festival', None)
+        # Save program snapshot
+        self.program = kwargs.pop('program', None)
 
         # Call base class
         super().__init__(*args, **kwargs)
 
+        # Search by keyword
+        self.fields['keywords'] = forms.CharField(max_length = 128, required = False)
+
         # Search by day
-        self.fields['days'] = forms.MultipleChoiceField(choices = ShowPerformance.objects.filter(show__festival=self.festival).order_by('date').values_list('date', 'date').distinct(), required = False, widget = forms.CheckboxSelectMultiple)
+        self.fields['days'] = forms.MultipleChoiceField(choices = [(date, date) for date in self.program.dates], required = False, widget = forms.CheckboxSelectMultiple)
 
         # Search by ticketed venue with option to include non-ticketed
-        venue_list = [(v.id, v.name) for v in Venue.objects.filter(festival=self.festival, is_searchable = True)]
+        venue_list = [(v.id, v.name) for v in self.program.venues if v.is_searchable]
         venue_list.append((0, 'Alt Spaces'))
         self.fields['venues'] = forms.MultipleChoiceField(choices = venue_list, required = False, widget = forms.CheckboxSelectMultiple)
 
         # Search by genre
-        #self.fields['genres'] = forms.ModelMultipleChoiceField(Genre.objects.filter(festival=self.festival), to_field_name = "id", required = False, widget = forms.CheckboxSelectMultiple())
-        self.fields['genres'] = SearchForm.GenreChoiceField(Genre.objects.filter(festival=self.festival), to_field_name = "id", required = False, widget = forms.CheckboxSelectMultiple())
+        self.fields['genres'] = forms.MultipleChoiceField(choices = [(g.id, g.name) for g in self.program.genres], required = False, widget = forms.CheckboxSelectMultiple)
+
+    def add_counts(self, counts):
+
+        # Add the number of matching shows to each choice
+        self.fields['days'].choices = [(date, f"{date} ({counts['days'].get(date, 0)})") for date in self.program.dates]
+        self.fields['venues'].choices = [(id, f"{name} ({counts['alt_spaces'] if id == 0 else counts['venues'].get(id, 0)})") for id, name in self.fields['venues'].choices]
+        self.fields['genres'].choices = [(id, f"{name} ({counts['genres'].get(id, 0)})") for id, name in self.fields['genres'].choices]
 
 
 class AdminGenreForm(forms.ModelForm):
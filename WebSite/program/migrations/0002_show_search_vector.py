@@ -0,0 +1,25 @@
+# Generated by Django 5.0.14 on 2026-10-17 13:12
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('program', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='show',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='show',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='program_show_search_vector'),
+        ),
+        migrations.RunSQL("update program_show s set search_vector = setweight(to_tsvector('english', coalesce(s.name, '')), 'A') || setweight(to_tsvector('english', coalesce(c.name, '')), 'B') || setweight(to_tsvector('english', coalesce(s.listing_short, '') || ' ' || coalesce(s.listing, '')), 'C') || setweight(to_tsvector('english', coalesce(s.detail, '')), 'D') from program_company c where c.id = s.company_id", reverse_sql=''),
+    ]
@@ -1,4 +1,6 @@
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.utils.functional import cached_property
 
@@ -102,6 +104,9 @@ class Venue(TimeStampedModel):
 
     @property
     def sponsor(self):
+        if 'sponsors' in getattr(self, '_prefetched_objects_cache', {}):
+            sponsors = self.sponsors.all()
+            return sponsors[0] if sponsors else None
         return self.sponsors.first()
 
     def get_first_performance(self, date = None):
@@ -216,10 +221,12 @@ class Show(TimeStampedModel):
     is_cancelled = models.BooleanField(blank = True, default = False)
     replaced_by = models.OneToOneField('self', on_delete = models.SET_NULL, related_name = 'replacement_for', blank = True, null = True)
     warnings = models.CharField(max_length = 64, blank = True, default = '')
+    search_vector = SearchVectorField(null = True, blank = True, editable = False)
 
     class Meta:
         unique_together = ('festival', 'name')
         ordering = ('festival', 'name')
+        indexes = [GinIndex(fields = ['search_vector'], name = 'program_show_search_vector')]
 
     def __str__(self):
         return f'{self.festival.name}/{self.name}'
@@ -251,12 +258,23 @@ class Show(TimeStampedModel):
     def performance_venues(self):
         return Venue.objects.filter(performances__show=self).distinct()
 
+    def _performances_by_venue(self):
+        # Group performances (in date and time order) by venue (in name order) using prefetched
+        # performances if available (see program.showpage)
+        if 'performances' in getattr(self, '_prefetched_objects_cache', {}):
+            performances = sorted(self.performances.all(), key = lambda p: (p.date, p.time))
+        else:
+            performances = self.performances.select_related('venue').order_by('date', 'time')
+        venues = {}
+        for performance in performances:
+            venues.setdefault(performance.venue, []).append(performance)
+        return sorted(venues.items(), key = lambda vp: vp[0].name)
+
     def get_venue_dates(self):
         # Return performance dates by venue as a dictionary to support the show listing pages
         venues = []
-        for venue in self.performance_venues:
-            dates = [p.date for p in self.performances.filter(venue=venue)]
-            dates = list(set(dates))
+        for venue, performances in self._performances_by_venue():
+            dates = list(set([p.date for p in performances]))
             dates.sort()
             venues.append({'venue': venue, 'dates': dates})
         return venues
@@ -264,8 +282,7 @@ class Show(TimeStampedModel):
     def get_venue_performances(self):
         # Return performances by venue as a dictionary to support the show listing pages
         venues = []
-        for venue in self.performance_venues:
-            performances = self.performances.filter(venue=venue).order_by('date', 'time')
+        for venue, performances in self._performances_by_venue():
             venues.append({'venue': venue, 'performances': performances})
         return venues
 
@@ -329,17 +346,24 @@ class ShowPerformance(TimeStampedModel):
         return hasattr(self, 'close_checkpoint')
 
     def tickets_reserved(self):
-        return self.tickets.filter(sale__isnull=False, sale__completed__isnull=True).count()
+        from tickets.inventory import get_inventory
+        return get_inventory(self).reserved
 
     def tickets_confirmed(self):
-        return self.tickets.filter(sale__isnull=False, sale__completed__isnull=False, refund__isnull=True).count()
+        from tickets.inventory import get_inventory
+        return get_inventory(self).confirmed
 
     def tickets_refunded(self):
-        return self.tickets.filter(refund__isnull = False).count()
+        from tickets.inventory import get_inventory
+        return get_inventory(self).refunded
+
+    def tokens_issued(self):
+        from tickets.inventory import get_inventory
+        return get_inventory(self).tokens_issued
 
     def tickets_available(self):
-        available = self.venue.capacity - self.tickets_confirmed() - self.tickets_reserved() if self.venue.capacity else 0
-        return available if available > 0 else 0
+        from tickets.inventory import available
+        return available(self)
 
 
 class ShowReview(TimeStampedModel):
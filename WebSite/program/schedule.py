@@ -0,0 +1,82 @@
+from .snapshot import get_program
+
+# Schedule
+#
+# The public schedule only changes when an admin edits a show, venue or performance so the day
+# grid for a festival is built from the program snapshot (see program.snapshot) and kept by each
+# process for that version of the program. The version is read from the database so a change
+# made by any process is seen by every process once it has been committed.
+_schedules = {}
+
+def build_schedule(festival, program = None):
+
+    # Get all performances (scheduled and non-scheduled venues) from the program snapshot
+    days = []
+    day = None
+    venue = None
+    program = program or get_program(festival)
+    performances = [p for date in program.dates for p in program.performances_by_date[date]]
+    for performance in sorted(performances, key = lambda p: (p.date, p.venue.name, p.time)):
+
+        # If the date has changed start a new day
+        if not day or performance.date != day['date']:
+            day = {
+                'date': performance.date,
+                'ticketed_venues': [],
+                'payw_venues': [],
+                'other': [],
+            }
+            days.append(day)
+            venue = None
+        details = {
+            'show_uuid': performance.show.uuid,
+            'show_name': performance.show.name,
+            'time': performance.time,
+            'is_cancelled': performance.show.is_cancelled,
+        }
+
+        # Performances at non-scheduled venues are listed together
+        if not performance.venue.is_scheduled:
+            day['other'].append(details)
+            continue
+
+        # If the venue has changed start a new one
+        if not venue or performance.venue.name != venue['name']:
+            venue = {
+                'name': performance.venue.name,
+                'is_ticketed': performance.venue.is_ticketed,
+                'color': performance.venue.color,
+                'performances': [],
+            }
+            if venue['is_ticketed']:
+                day['ticketed_venues'].append(venue)
+            else:
+                day['payw_venues'].append(venue)
+        venue['performances'].append(details)
+
+    # Only days with scheduled performances are shown; performances at non-scheduled venues are
+    # added to the end of the pay-what-you-will venues in time order
+    schedule = []
+    for day in days:
+        if not (day['ticketed_venues'] or day['payw_venues']):
+            continue
+        other = sorted(day.pop('other'), key = lambda p: p['time'])
+        if other:
+            day['payw_venues'].append({
+                'name': 'Other (alt spaces)',
+                'is_ticketed': False,
+                'color': '',
+                'performances': other,
+            })
+        schedule.append(day)
+    return schedule
+
+def get_schedule(festival):
+
+    # Get schedule for the current program version (building it if necessary)
+    program = get_program(festival)
+    cached = _schedules.get(festival.id)
+    if not cached or cached[0] != program.version:
+        cached = (program.version, build_schedule(festival, program))
+        _schedules[festival.id] = cached
+    return cached[1]
@@ -0,0 +1,243 @@
+import datetime
+import hashlib
+import logging
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from reportlab.platypus import SimpleDocTemplate, Table, Paragraph, PageBreak
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.units import cm
+from reportlab.lib import colors
+
+from .models import ShowPerformance, Venue
+
+logger = logging.getLogger(__name__)
+
+# Schedule PDF
+#
+# The printable schedule takes seconds of CPU to lay out so it is generated once per version of
+# the program and saved to media storage with a name that includes a hash of its content. The
+# current artifact (path, etag and modified time) for each festival and host (the show links are
+# absolute) is held in the shared (database) cache so every process serves the same file. When the
+# program changes (see program.signals) the cached artifacts are dropped once the change is
+# committed and the next request for each host builds the new version. Superseded files are kept
+# for a while (SCHEDULE_PDF_RETAIN_MINUTES) as a request may have just read the old artifact.
+def _pdf_key(festival_id, host):
+    return f'program:schedule_pdf:{festival_id}:{host}'
+
+def _hosts_key(festival_id):
+    return f'program:schedule_pdf_hosts:{festival_id}'
+
+def _get_pdf_data(festival):
+
+    # Get scheduled venues and all performances of shows that are not cancelled
+    venues = list(Venue.objects.filter(festival = festival, is_scheduled = True).order_by('name').values('id', 'name', 'color', 'is_ticketed'))
+    performances = list(ShowPerformance.objects.filter(show__festival = festival, show__is_cancelled = False)
+                                               .order_by('date', 'time', 'id')
+                                               .values_list('date', 'time', 'venue_id', 'show__uuid', 'show__name', 'show__is_ticketed'))
+
+    # Days with ticketed performances (at any venue)
+    days = sorted({p[0] for p in performances if p[5]})
+
+    # Performances by day and venue (in time order)
+    slots = {}
+    for date, time, venue_id, show_uuid, show_name, is_ticketed in performances:
+        slots.setdefault((date, venue_id), []).append((time, show_uuid, show_name))
+
+    # Ticketed venues on the first page, pay-what-you-will venues in groups of seven after that
+    ticketed = [v for v in venues if v['is_ticketed']]
+    payw = [v for v in venues if not v['is_ticketed']]
+    pages = [ticketed] if ticketed else []
+    pages += [payw[i:i+7] for i in range(0, len(payw), 7)]
+    return {
+        'days': days,
+        'pages': pages,
+        'slots': slots,
+    }
+
+def _get_pdf_hash(data, host):
+    return hashlib.sha256(repr((host, data['days'], data['pages'], sorted(data['slots'].items()))).encode()).hexdigest()
+
+def _get_styles():
+    return {
+        'Venue': ParagraphStyle(
+            name = 'Venue',
+            align = TA_CENTER,
+            fontSize = 10,
+            textColor = colors.white,
+        ),
+        'Day': ParagraphStyle(
+            name = 'Day',
+            fontSize = 10,
+        ),
+        'Time': ParagraphStyle(
+            name = 'Time',
+            fontSize = 8,
+            leading = 8,
+            textColor = colors.indianred,
+        ),
+        'Show': ParagraphStyle(
+            name = 'Show',
+            fontSize = 8,
+            leading = 8,
+            textColor = '#1a7cf3',
+        ),
+    }
+
+def _venues_table(data, host, venues, styles):
+
+    venues_data = []
+    table_data = []
+    table_styles = []
+    for v in venues:
+        venues_data.append(Paragraph(f'<para align="center"><b>{v["name"]}</b></para>', styles['Venue']))
+        venues_data.append('')
+    table_data.append(venues_data)
+    for i, v in enumerate(venues):
+        table_styles.append(('SPAN', (2*i, 0), (2*i + 1, 0)))
+        table_styles.append(('BACKGROUND', (2*i, 0), (2*i + 1, 0), v['color']))
+
+    # Days
+    day_color = ('#fbe4d5', '#fff2cc', '#e2efd9', '#deeaf6')
+    for index, day in enumerate(data['days']):
+
+        # Add a row for the day
+        first_row = len(table_data)
+        table_data.append([Paragraph(f"{day:%A %d}", styles['Day'])] + ['' for i in range(2*len(venues) - 1)])
+        table_styles.append(('SPAN', (0, first_row), (-1, first_row)))
+
+        # Add a row for each slot
+        venue_performances = [data['slots'].get((day, v['id']), []) for v in venues]
+        slots = max([len(vp) for vp in venue_performances])
+        for i in range(slots):
+            slot_data = []
+            for performances in venue_performances:
+                if i < len(performances):
+                    time, show_uuid, show_name = performances[i]
+                    slot_data.append(Paragraph(f'{time:%H:%M}', styles['Time']))
+                    slot_url = f'http://{host}{reverse("program:show", args = [show_uuid])}'
+                    slot_data.append(Paragraph(f'<a href="{slot_url}">{show_name}</a>', styles['Show']))
+                else:
+                    slot_data.append('')
+                    slot_data.append('')
+            table_data.append(slot_data)
+
+        # Set background color
+        table_styles.append(('BACKGROUND', (0, first_row), (-1, len(table_data)), day_color[index % len(day_color)]))
+        for i in range(len(venues) - 1):
+            table_styles.append(('LINEAFTER', (2*i + 1, first_row + 1), (2*i + 1, len(table_data)), 1, colors.gray))
+
+    # Table styles
+    table_styles.append(('VALIGN', (0, 0), (-1, -1), 'TOP'))
+    table_styles.append(('ALIGN', (0, 0), (-1, 0), 'CENTER'))
+    table_styles.append(('LEFTPADDING', (0, 0), (-1, -1), 2))
+    table_styles.append(('RIGHTPADDING', (0, 0), (-1, -1), 2))
+    table_styles.append(('TOPPADDING', (0, 0), (-1, -1), 1))
+    table_styles.append(('BOTTOMPADDING', (0, 0), (-1, -1), 2))
+    table_styles.append(('BOX', (0, 0), (-1, -1), 2, colors.gray))
+    table_styles.append(('GRID', (0, 0), (-1, 0), 1, colors.gray))
+    table_styles.append(('LINEBELOW', (0, 1), (-1, -1), 0.25, colors.gray))
+
+    slot_width_cm = 28.3 / len(venues)
+    time_width_cm = 0.9
+    show_width_cm = slot_width_cm - time_width_cm
+    return Table(
+        table_data,
+        colWidths = len(venues) * [time_width_cm*cm, show_width_cm*cm],
+        hAlign = 'LEFT',
+        vAlign = 'TOP',
+        style = table_styles,
+    )
+
+def render_schedule_pdf(data, host):
+
+    # Create a Platypus story with a page for each group of venues
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize = landscape(A4),
+        leftMargin = 0.5*cm,
+        rightMargin = 0.5*cm,
+        topMargin = 0.5*cm,
+        bottomMargin = 0.5*cm,
+    )
+    styles = _get_styles()
+    story = []
+    for venues in data['pages']:
+        if story:
+            story.append(PageBreak())
+        story.append(_venues_table(data, host, venues, styles))
+    doc.build(story)
+    return buffer.getvalue()
+
+def _delete_superseded(festival, path):
+
+    # Delete the festival's PDFs that are no longer the current artifact for any host and were
+    # replaced long enough ago that no request can still be serving them
+    directory = f'schedules/{festival.uuid}'
+    current = {path}
+    for host in cache.get(_hosts_key(festival.id), set()):
+        artifact = cache.get(_pdf_key(festival.id, host))
+        if artifact:
+            current.add(artifact['path'])
+    try:
+        directories, files = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    cutoff = timezone.now() - datetime.timedelta(minutes = getattr(settings, 'SCHEDULE_PDF_RETAIN_MINUTES', 60))
+    for name in files:
+        name = f'{directory}/{name}'
+        if name not in current and default_storage.get_modified_time(name) < cutoff:
+            default_storage.delete(name)
+            logger.info(f'Superseded schedule PDF {name} deleted')
+
+def build_schedule_pdf(festival, host):
+
+    # Generate the PDF (unless this version already exists)
+    data = _get_pdf_data(festival)
+    etag = _get_pdf_hash(data, host)
+    path = f'schedules/{festival.uuid}/schedule-{etag[:32]}.pdf'
+    if not default_storage.exists(path):
+        path = default_storage.save(path, ContentFile(render_schedule_pdf(data, host)))
+        logger.info(f'Schedule PDF for {festival.name} ({host}) saved to {path}')
+        _delete_superseded(festival, path)
+    return {
+        'path': path,
+        'etag': etag,
+        'modified': default_storage.get_modified_time(path),
+    }
+
+def get_schedule_pdf(festival, host, rebuild = False):
+
+    # Get current artifact from the cache (building it if necessary)
+    key = _pdf_key(festival.id, host)
+    artifact = None if rebuild else cache.get(key)
+    if artifact == None or not default_storage.exists(artifact['path']):
+        artifact = build_schedule_pdf(festival, host)
+        cache.set(key, artifact, None)
+
+    # Remember the host so its artifact can be dropped when the program changes
+    hosts = cache.get(_hosts_key(festival.id), set())
+    if host not in hosts:
+        cache.set(_hosts_key(festival.id), hosts | {host}, None)
+    return artifact
+
+def invalidate_schedule_pdf(festival_id):
+
+    # Drop the current artifacts once the change is committed (so a concurrent request cannot
+    # cache a PDF of the old program)
+    transaction.on_commit(lambda: _drop_artifacts(festival_id))
+
+def _drop_artifacts(festival_id):
+    hosts = cache.get(_hosts_key(festival_id), set())
+    if hosts:
+        cache.delete_many([_pdf_key(festival_id, host) for host in hosts])
@@ -0,0 +1,147 @@
+import math
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, OuterRef, Subquery
+from django.utils.html import strip_tags
+
+from .models import Company, Show
+
+# Show search
+#
+# Keyword search covers the show name (weight A), company name (B), listing (C) and detail (D).
+# On PostgreSQL each show has a stored tsvector (GIN indexed, see migration 0002) that is kept
+# up to date by program.signals and ranked with ts_rank. Other databases use an in-process
+# inverted index built from the same fields once per program version. Day, venue and genre
+# facets (and their counts) are answered from the program snapshot indexes (see
+# program.snapshot) so no joins are needed.
+SEARCH_CONFIG = 'english'
+FIELD_WEIGHTS = {'A': 1.0, 'B': 0.4, 'C': 0.2, 'D': 0.1}
+STOP_WORDS = frozenset(['a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it', 'of', 'on', 'or', 'the', 'to', 'with'])
+
+def _search_vector():
+    company_name = Subquery(Company.objects.filter(pk = OuterRef('company_id')).values('name'))
+    return (
+        SearchVector('name', weight = 'A', config = SEARCH_CONFIG)
+        + SearchVector(company_name, weight = 'B', config = SEARCH_CONFIG)
+        + SearchVector('listing_short', 'listing', weight = 'C', config = SEARCH_CONFIG)
+        + SearchVector('detail', weight = 'D', config = SEARCH_CONFIG)
+    )
+
+def update_search_vectors(shows):
+
+    # Only PostgreSQL stores search vectors
+    if connection.vendor == 'postgresql':
+        shows.update(search_vector = _search_vector())
+
+def _stem(word):
+
+    # Crude plural stemming so 'puppet' matches 'puppets' (PostgreSQL uses a full stemmer)
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+def _tokenize(text):
+    return [_stem(word) for word in re.findall(r'\w+', text.lower()) if word not in STOP_WORDS]
+
+class ShowIndex:
+
+    __slots__ = ('version', 'postings', 'show_count')
+
+    def __init__(self, festival, version):
+
+        # Weighted term frequencies by term and show
+        self.version = version
+        self.postings = {}
+        self.show_count = 0
+        for show in Show.objects.filter(festival = festival).values('id', 'name', 'company__name', 'listing_short', 'listing', 'detail'):
+            self.show_count += 1
+            fields = (
+                ('A', show['name']),
+                ('B', show['company__name'] or ''),
+                ('C', f"{show['listing_short']} {show['listing']}"),
+                ('D', strip_tags(show['detail'])),
+            )
+            for weight, text in fields:
+                for term in _tokenize(text):
+                    scores = self.postings.setdefault(term, {})
+                    scores[show['id']] = scores.get(show['id'], 0) + FIELD_WEIGHTS[weight]
+
+    def search(self, keywords):
+
+        # Shows containing every term ranked by weighted term frequency and rarity
+        terms = _tokenize(keywords)
+        if not terms:
+            return {}
+        ranks = None
+        for term in set(terms):
+            scores = self.postings.get(term, {})
+            idf = math.log(1 + self.show_count / (1 + len(scores)))
+            if ranks == None:
+                ranks = {show_id: score * idf for show_id, score in scores.items()}
+            else:
+                ranks = {show_id: rank + scores[show_id] * idf for show_id, rank in ranks.items() if show_id in scores}
+        return ranks
+
+_indexes = {}
+
+def _search_index(festival, program, keywords):
+
+    # In-process inverted index (rebuilt when the program changes)
+    index = _indexes.get(festival.id)
+    if not index or index.version != program.version:
+        index = ShowIndex(festival, program.version)
+        _indexes[festival.id] = index
+    return index.search(keywords)
+
+def _search_database(festival, keywords):
+    query = SearchQuery(keywords, search_type = 'websearch', config = SEARCH_CONFIG)
+    shows = Show.objects.filter(festival = festival, search_vector = query).annotate(rank = SearchRank(F('search_vector'), query))
+    return dict(shows.values_list('id', 'rank'))
+
+def search_keywords(festival, program, keywords):
+
+    # Return ranks by show id for shows matching the keywords
+    if connection.vendor == 'postgresql':
+        return _search_database(festival, keywords)
+    return _search_index(festival, program, keywords)
+
+def _union(index, keys):
+    return set().union(*[index.get(key, ()) for key in keys])
+
+def search_shows(festival, program, keywords = '', days = (), venues = (), genres = (), alt_spaces = False):
+
+    # Shows matching each of the filters (None if the filter is not used)
+    all_ids = frozenset(show.id for show in program.shows)
+    ranks = search_keywords(festival, program, keywords) if keywords.strip() else None
+    alt_space_ids = frozenset(show.id for show in program.shows if not show.is_ticketed)
+    filters = {
+        'keywords': set(ranks) if ranks != None else None,
+        'days': _union(program.shows_by_date, days) if days else None,
+        'venues': (_union(program.shows_by_venue, venues) | (alt_space_ids if alt_spaces else set())) if (venues or alt_spaces) else None,
+        'genres': _union(program.shows_by_genre, genres) if genres else None,
+    }
+
+    # Results match every filter (ranked if searching by keyword)
+    def matching(exclude = None):
+        ids = set(all_ids)
+        for name, filter_ids in filters.items():
+            if name != exclude and filter_ids != None:
+                ids &= filter_ids
+        return ids
+    results = program.get_shows(matching())
+    if ranks != None:
+        results.sort(key = lambda show: -ranks[show.id])
+
+    # Facet counts are for the shows matching all the other filters
+    day_ids = matching('days')
+    venue_ids = matching('venues')
+    genre_ids = matching('genres')
+    counts = {
+        'days': {date: len(day_ids & ids) for date, ids in program.shows_by_date.items()},
+        'venues': {venue.id: len(venue_ids & program.shows_by_venue.get(venue.id, frozenset())) for venue in program.venues},
+        'genres': {genre.id: len(genre_ids & program.shows_by_genre.get(genre.id, frozenset())) for genre in program.genres},
+        'alt_spaces': len(venue_ids & alt_space_ids),
+    }
+    return results, counts
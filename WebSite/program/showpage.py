@@ -0,0 +1,32 @@
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+
+from tickets.inventory import available, seats_available
+from .models import Show, ShowPerformance
+
+# Show page
+#
+# The show page lists the show's performances grouped by venue (with each venue's sponsor and
+# the seats available for each performance), its images and its reviews. Everything is loaded
+# with a fixed number of queries and grouped in Python (see Show.get_venue_performances) rather
+# than querying each venue and performance separately.
+def get_show_page(show_uuid):
+
+    # Get show with everything the page uses
+    performances = ShowPerformance.objects.select_related('venue', 'inventory').order_by('date', 'time')
+    show = get_object_or_404(
+        Show.objects.select_related('festival', 'company', 'replaced_by__company').prefetch_related(
+            Prefetch('performances', queryset = performances),
+            Prefetch('performances__venue__sponsors'),
+            'genres',
+            'images',
+            'reviews',
+        ),
+        uuid = show_uuid,
+    )
+
+    # Seats available for each performance (from the prefetched inventory rows)
+    for performance in show.performances.all():
+        inventory = getattr(performance, 'inventory', None)
+        performance.available = seats_available(performance.venue.capacity or 0, inventory) if inventory else available(performance)
+    return show
@@ -0,0 +1,30 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Company, Show, ShowPerformance, Venue
+from .schedule_pdf import invalidate_schedule_pdf
+from .search import update_search_vectors
+
+
+# Schedule PDF (see program.schedule_pdf)
+@receiver(post_save, sender = Show)
+@receiver(post_delete, sender = Show)
+@receiver(post_save, sender = Venue)
+@receiver(post_delete, sender = Venue)
+def program_changed(sender, instance, **kwargs):
+    invalidate_schedule_pdf(instance.festival_id)
+
+@receiver(post_save, sender = ShowPerformance)
+@receiver(post_delete, sender = ShowPerformance)
+def performance_changed(sender, instance, **kwargs):
+    invalidate_schedule_pdf(instance.show.festival_id)
+
+
+# Show search vectors (see program.search)
+@receiver(post_save, sender = Show)
+def show_saved(sender, instance, **kwargs):
+    update_search_vectors(Show.objects.filter(pk = instance.pk))
+
+@receiver(post_save, sender = Company)
+def company_saved(sender, instance, **kwargs):
+    update_search_vectors(Show.objects.filter(company = instance))
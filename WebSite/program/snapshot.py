@@ -0,0 +1,204 @@
+from django.core.files.storage import default_storage
+from django.db.models import Count, Max, OuterRef, Subquery
+
+from core.models import Festival
+from .models import Company, Genre, Show, ShowPerformance, Venue, VenueSponsor
+
+# Program snapshot
+#
+# The public program pages list a few hundred shows that hardly change during the festival. Each
+# worker loads the whole program for a festival once into compact read-only objects (with indexes
+# by date, venue, genre and company) and reuses it until the program version changes. The version
+# is the latest update time and row count of each program table (counts catch deletes) and is
+# checked with a single query per request.
+class _Snapshot:
+
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for name, value in kwargs.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is read-only')
+
+    def _set(self, name, value):
+
+        # Only used while the snapshot is being linked together
+        object.__setattr__(self, name, value)
+
+
+class ProgramImage(_Snapshot):
+
+    __slots__ = ('name', 'url')
+
+    def __bool__(self):
+        return bool(self.name)
+
+
+class ProgramGenre(_Snapshot):
+
+    __slots__ = ('id', 'name')
+
+
+class ProgramCompany(_Snapshot):
+
+    __slots__ = ('id', 'uuid', 'name')
+
+
+class ProgramSponsor(_Snapshot):
+
+    __slots__ = ('name', 'image', 'color', 'background', 'message', 'website')
+
+
+class ProgramVenue(_Snapshot):
+
+    __slots__ = ('id', 'uuid', 'name', 'image', 'listing', 'listing_short', 'is_ticketed', 'is_scheduled', 'is_searchable', 'map_index', 'color', 'sponsor')
+
+
+class ProgramPerformance(_Snapshot):
+
+    __slots__ = ('id', 'uuid', 'date', 'time', 'show', 'venue')
+
+
+class ProgramShow(_Snapshot):
+
+    __slots__ = ('id', 'uuid', 'name', 'company', 'image', 'listing', 'listing_short', 'genres', 'genre_text', 'has_warnings', 'age_range', 'duration',
+                 'is_ticketed', 'is_suspended', 'is_cancelled', 'replaced_by', 'warnings', 'performances', 'genre_list', 'performance_dates')
+
+    def get_venue_dates(self):
+        # Return performance dates by venue (in venue name order) to support the show listing pages
+        venues = {}
+        for performance in self.performances:
+            venues.setdefault(performance.venue, set()).add(performance.date)
+        return [{'venue': venue, 'dates': sorted(dates)} for venue, dates in sorted(venues.items(), key = lambda vd: vd[0].name)]
+
+    def get_venue_performances(self):
+        # Return performances by venue (in venue name order) to support the show pages
+        venues = {}
+        for performance in self.performances:
+            venues.setdefault(performance.venue, []).append(performance)
+        return [{'venue': venue, 'performances': performances} for venue, performances in sorted(venues.items(), key = lambda vp: vp[0].name)]
+
+
+class ProgramSnapshot(_Snapshot):
+
+    __slots__ = ('festival_id', 'version', 'shows', 'venues', 'genres', 'companies', 'dates', 'shows_by_uuid', 'venues_by_uuid',
+                 'shows_by_date', 'shows_by_venue', 'shows_by_genre', 'shows_by_company', 'performances_by_date', 'performances_by_venue')
+
+    def get_shows(self, show_ids):
+        # Return shows (in listing order) from a set of ids
+        return [show for show in self.shows if show.id in show_ids]
+
+
+def _image(name):
+    return ProgramImage(name = name, url = default_storage.url(name) if name else '')
+
+def _program_changes(queryset, festival_path):
+    changes = queryset.filter(**{festival_path: OuterRef('pk')}).order_by().values(festival_path)
+    return (
+        Subquery(changes.annotate(latest = Max('updated')).values('latest')),
+        Subquery(changes.annotate(rows = Count('id')).values('rows')),
+    )
+
+def get_program_version(festival):
+
+    # Latest update and row count for each program table in one query
+    tables = {
+        'show': (Show.objects.all(), 'festival'),
+        'performance': (ShowPerformance.objects.all(), 'show__festival'),
+        'venue': (Venue.objects.all(), 'festival'),
+        'sponsor': (VenueSponsor.objects.all(), 'venue__festival'),
+        'company': (Company.objects.all(), 'festival'),
+        'genre': (Genre.objects.all(), 'festival'),
+    }
+    annotations = {}
+    for name, (queryset, festival_path) in tables.items():
+        annotations[f'{name}_updated'], annotations[f'{name}_count'] = _program_changes(queryset, festival_path)
+    show_genres = Show.genres.through.objects.filter(show__festival = OuterRef('pk')).order_by().values('show__festival')
+    annotations['show_genre_count'] = Subquery(show_genres.annotate(rows = Count('id')).values('rows'))
+    version = Festival.objects.filter(pk = festival.id).values(**annotations).first()
+    return tuple(version.values()) if version else None
+
+def load_program(festival, version = None):
+
+    # Genres, companies and venues (with their first sponsor)
+    genres = {g['id']: ProgramGenre(id = g['id'], name = g['name']) for g in Genre.objects.filter(festival = festival).order_by('name').values('id', 'name')}
+    companies = {c['id']: ProgramCompany(**c) for c in Company.objects.filter(festival = festival).order_by('name').values('id', 'uuid', 'name')}
+    sponsors = {}
+    for s in VenueSponsor.objects.filter(venue__festival = festival).order_by('venue', 'name').values('venue_id', 'name', 'image', 'color', 'background', 'message', 'website'):
+        if s['venue_id'] not in sponsors:
+            sponsors[s['venue_id']] = ProgramSponsor(name = s['name'], image = _image(s['image']), color = s['color'], background = s['background'], message = s['message'], website = s['website'])
+    venues = {}
+    for v in Venue.objects.filter(festival = festival).order_by('name').values('id', 'uuid', 'name', 'image', 'listing', 'listing_short', 'is_ticketed', 'is_scheduled', 'is_searchable', 'map_index', 'color'):
+        v['image'] = _image(v['image'])
+        venues[v['id']] = ProgramVenue(sponsor = sponsors.get(v['id']), **v)
+
+    # Shows (with their genres)
+    show_genres = {}
+    for show_id, genre_id in Show.genres.through.objects.filter(show__festival = festival).order_by('genre__name').values_list('show_id', 'genre_id'):
+        show_genres.setdefault(show_id, []).append(genres[genre_id])
+    shows = {}
+    replaced_by = {}
+    for s in Show.objects.filter(festival = festival).values('id', 'uuid', 'name', 'company_id', 'image', 'listing', 'listing_short', 'genre_text', 'has_warnings', 'age_range', 'duration',
+                                                              'is_ticketed', 'is_suspended', 'is_cancelled', 'replaced_by_id', 'warnings'):
+        replaced_by[s['id']] = s.pop('replaced_by_id')
+        s['company'] = companies.get(s.pop('company_id'))
+        s['image'] = _image(s['image'])
+        s['genres'] = tuple(show_genres.get(s['id'], ()))
+        s['genre_list'] = s['genre_text'] or ', '.join(g.name for g in s['genres'])
+        shows[s['id']] = ProgramShow(replaced_by = None, performances = (), performance_dates = (), **s)
+    for show_id, replacement_id in replaced_by.items():
+        if replacement_id:
+            shows[show_id]._set('replaced_by', shows.get(replacement_id))
+
+    # Performances
+    show_performances = {}
+    performances_by_date = {}
+    performances_by_venue = {}
+    for p in ShowPerformance.objects.filter(show__festival = festival).order_by('date', 'time', 'id').values('id', 'uuid', 'date', 'time', 'show_id', 'venue_id'):
+        performance = ProgramPerformance(id = p['id'], uuid = p['uuid'], date = p['date'], time = p['time'], show = shows[p['show_id']], venue = venues[p['venue_id']])
+        show_performances.setdefault(p['show_id'], []).append(performance)
+        performances_by_date.setdefault(p['date'], []).append(performance)
+        performances_by_venue.setdefault(p['venue_id'], []).append(performance)
+    for show_id, performances in show_performances.items():
+        shows[show_id]._set('performances', tuple(performances))
+        shows[show_id]._set('performance_dates', tuple(sorted({p.date for p in performances})))
+
+    # Indexes
+    shows_by_genre = {}
+    shows_by_company = {}
+    for show in shows.values():
+        for genre in show.genres:
+            shows_by_genre.setdefault(genre.id, set()).add(show.id)
+        if show.company:
+            shows_by_company.setdefault(show.company.id, set()).add(show.id)
+    return ProgramSnapshot(
+        festival_id = festival.id,
+        version = version,
+        shows = tuple(sorted(shows.values(), key = lambda s: (s.name.lower(), s.id))),
+        venues = tuple(venues.values()),
+        genres = tuple(genres.values()),
+        companies = tuple(companies.values()),
+        dates = tuple(sorted(performances_by_date)),
+        shows_by_uuid = {s.uuid: s for s in shows.values()},
+        venues_by_uuid = {v.uuid: v for v in venues.values()},
+        shows_by_date = {date: frozenset(p.show.id for p in performances) for date, performances in performances_by_date.items()},
+        shows_by_venue = {venue_id: frozenset(p.show.id for p in performances) for venue_id, performances in performances_by_venue.items()},
+        shows_by_genre = {genre_id: frozenset(ids) for genre_id, ids in shows_by_genre.items()},
+        shows_by_company = {company_id: frozenset(ids) for company_id, ids in shows_by_company.items()},
+        performances_by_date = {date: tuple(performances) for date, performances in performances_by_date.items()},
+        performances_by_venue = {venue_id: tuple(performances) for venue_id, performances in performances_by_venue.items()},
+    )
+
+_programs = {}
+
+def get_program(festival):
+
+    # Get the festival's program snapshot (reloading it if the program has changed)
+    version = get_program_version(festival)
+    program = _programs.get(festival.id)
+    if not program or program.version != version:
+        program = load_program(festival, version)
+        _programs[festival.id] = program
+    return program
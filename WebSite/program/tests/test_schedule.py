@@ -0,0 +1,48 @@
+import datetime
+
+import pytest
+
+from core.models import Festival
+from program import schedule
+from program.models import Company, Venue, Show, ShowPerformance
+
+
+@pytest.mark.django_db
+def test_schedule_follows_program_version():
+    festival = Festival.objects.create(name = 'TEST', title = 'Test festival', is_live = True)
+    venue = Venue.objects.create(festival = festival, name = 'Venue', is_ticketed = True, is_scheduled = True, capacity = 10)
+    company = Company.objects.create(festival = festival, name = 'Company')
+    show = Show.objects.create(festival = festival, company = company, name = 'Show', is_ticketed = True)
+    ShowPerformance.objects.create(show = show, venue = venue, date = datetime.date(2026, 6, 1), time = datetime.time(19, 0))
+    assert [day['date'].day for day in schedule.get_schedule(festival)] == [1]
+    assert schedule.get_schedule(festival) is schedule.get_schedule(festival)
+
+    # A change that sends no signals (as if made by another process) is seen through the version
+    ShowPerformance.objects.bulk_create([ShowPerformance(show = show, venue = venue, date = datetime.date(2026, 6, 2), time = datetime.time(19, 0))])
+    assert [day['date'].day for day in schedule.get_schedule(festival)] == [1, 2]
+
+@pytest.mark.django_db
+def test_schedule_lists_alt_spaces():
+    festival = Festival.objects.create(name = 'TEST', title = 'Test festival', is_live = True)
+    ticketed = Venue.objects.create(festival = festival, name = 'Venue', is_ticketed = True, is_scheduled = True, capacity = 10)
+    payw = Venue.objects.create(festival = festival, name = 'Bar', is_scheduled = True)
+    park = Venue.objects.create(festival = festival, name = 'Park')
+    company = Company.objects.create(festival = festival, name = 'Company')
+    show = Show.objects.create(festival = festival, company = company, name = 'Show', is_ticketed = True)
+    street = Show.objects.create(festival = festival, company = company, name = 'Street', is_cancelled = True)
+    ShowPerformance.objects.create(show = show, venue = ticketed, date = datetime.date(2026, 6, 1), time = datetime.time(19, 0))
+    ShowPerformance.objects.create(show = show, venue = payw, date = datetime.date(2026, 6, 1), time = datetime.time(14, 0))
+    ShowPerformance.objects.create(show = street, venue = park, date = datetime.date(2026, 6, 1), time = datetime.time(16, 0))
+    ShowPerformance.objects.create(show = street, venue = park, date = datetime.date(2026, 6, 1), time = datetime.time(12, 0))
+
+    # Performances at non-scheduled venues follow the pay-what-you-will venues in time order
+    day, = schedule.get_schedule(festival)
+    assert [venue['name'] for venue in day['ticketed_venues']] == ['Venue']
+    assert [venue['name'] for venue in day['payw_venues']] == ['Bar', 'Other (alt spaces)']
+    other = day['payw_venues'][1]
+    assert not other['is_ticketed']
+    assert [(p['show_name'], p['time'].hour, p['is_cancelled']) for p in other['performances']] == [('Street', 12, True), ('Street', 16, True)]
+
+    # A day with only non-scheduled performances is not shown
+    ShowPerformance.objects.create(show = street, venue = park, date = datetime.date(2026, 6, 2), time = datetime.time(12, 0))
+    assert [day['date'].day for day in schedule.get_schedule(festival)] == [1]
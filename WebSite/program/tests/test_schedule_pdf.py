@@ -0,0 +1,75 @@
+import datetime
+
+import pytest
+from django.core.files.storage import default_storage
+from django.urls import reverse
+
+from core.models import Festival
+from program import schedule_pdf
+from program.models import Company, Venue, Show, ShowPerformance
+
+
+@pytest.fixture
+def show(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    festival = Festival.objects.create(name = 'TEST', title = 'Test festival', is_live = True)
+    venue = Venue.objects.create(festival = festival, name = 'Venue', is_ticketed = True, is_scheduled = True, capacity = 10, color = '#ff0000')
+    company = Company.objects.create(festival = festival, name = 'Company')
+    show = Show.objects.create(festival = festival, company = company, name = 'Show', is_ticketed = True)
+    ShowPerformance.objects.create(show = show, venue = venue, date = datetime.date(2026, 6, 1), time = datetime.time(19, 0))
+    return show
+
+def add_performance(show, day, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute = True):
+        ShowPerformance.objects.create(show = show, venue = show.performances.first().venue, date = datetime.date(2026, 6, day), time = datetime.time(19, 0))
+
+@pytest.mark.django_db
+def test_pdf_rebuilt_on_next_request(show, django_capture_on_commit_callbacks):
+    festival = show.festival
+    old = schedule_pdf.get_schedule_pdf(festival, 'testserver')
+    assert schedule_pdf.get_schedule_pdf(festival, 'testserver') == old
+
+    # The cached artifact is kept until the change is committed and then rebuilt by the next request
+    with django_capture_on_commit_callbacks(execute = True):
+        ShowPerformance.objects.create(show = show, venue = show.performances.first().venue, date = datetime.date(2026, 6, 2), time = datetime.time(19, 0))
+        assert schedule_pdf.get_schedule_pdf(festival, 'testserver') == old
+    new = schedule_pdf.get_schedule_pdf(festival, 'testserver')
+    assert new['path'] != old['path']
+    assert default_storage.exists(new['path'])
+
+@pytest.mark.django_db
+def test_superseded_pdf_retained(settings, show, django_capture_on_commit_callbacks):
+
+    # The previous PDF is kept for requests that have just read its artifact
+    festival = show.festival
+    first = schedule_pdf.get_schedule_pdf(festival, 'testserver')
+    add_performance(show, 2, django_capture_on_commit_callbacks)
+    second = schedule_pdf.get_schedule_pdf(festival, 'testserver')
+    assert default_storage.exists(first['path'])
+
+    # Once the retention period has passed it is deleted (but never the current PDF)
+    settings.SCHEDULE_PDF_RETAIN_MINUTES = 0
+    add_performance(show, 3, django_capture_on_commit_callbacks)
+    third = schedule_pdf.get_schedule_pdf(festival, 'testserver')
+    assert not default_storage.exists(first['path'])
+    assert not default_storage.exists(second['path'])
+    assert default_storage.exists(third['path'])
+
+@pytest.mark.django_db
+def test_view_rebuilds_deleted_pdf(client, show, monkeypatch):
+
+    # The file is deleted between reading the artifact from the cache and opening it
+    festival = show.festival
+    artifact = schedule_pdf.get_schedule_pdf(festival, 'testserver')
+    default_storage.delete(artifact['path'])
+    exists = default_storage.exists
+    checked = []
+    def stale_exists(name):
+        checked.append(name)
+        return True if len(checked) == 1 else exists(name)
+    monkeypatch.setattr(default_storage, 'exists', stale_exists)
+    response = client.get(reverse('program:schedule_pdf'))
+    assert response.status_code == 200
+    assert response['ETag'] == f'"{artifact["etag"]}"'
+    assert b''.join(response.streaming_content).startswith(b'%PDF')
+    assert exists(artifact['path'])
@@ -0,0 +1,131 @@
+import datetime
+from unittest import mock
+
+import pytest
+from django.db import connection
+
+from core.models import Festival
+from program import search
+from program.forms import SearchForm
+from program.models import Company, Genre, Venue, Show, ShowPerformance
+from program.snapshot import get_program
+
+
+DAY1 = datetime.date(2026, 6, 1)
+DAY2 = datetime.date(2026, 6, 2)
+
+@pytest.fixture
+def program_data():
+
+    # Two ticketed venues, an alt space, two genres and four shows
+    festival = Festival.objects.create(name = 'TEST', title = 'Test festival', is_live = True)
+    venues = {
+        'main': Venue.objects.create(festival = festival, name = 'Main', is_ticketed = True, is_searchable = True, capacity = 10),
+        'studio': Venue.objects.create(festival = festival, name = 'Studio', is_ticketed = True, is_searchable = True, capacity = 10),
+        'park': Venue.objects.create(festival = festival, name = 'Park', is_ticketed = False),
+    }
+    genres = {name: Genre.objects.create(festival = festival, name = name) for name in ('Comedy', 'Drama')}
+    shows = {}
+    for name, company, listing, is_ticketed, genre, venue, date in (
+        ('Puppet Show', 'Acme', 'Fun for all', True, 'Comedy', 'main', DAY1),
+        ('Night Falls', 'Other', 'A puppet adventure', True, 'Drama', 'studio', DAY2),
+        ('Quiet Hour', 'Puppet Theatre', 'Stories', False, 'Comedy', 'park', DAY1),
+        ('Unrelated', 'Other Company', 'Nothing here', True, 'Drama', 'main', DAY2),
+    ):
+        show = Show.objects.create(festival = festival, company = Company.objects.create(festival = festival, name = company), name = name, listing = listing, is_ticketed = is_ticketed)
+        show.genres.add(genres[genre])
+        ShowPerformance.objects.create(show = show, venue = venues[venue], date = date, time = datetime.time(19, 0))
+        shows[name] = show
+    return festival, venues, genres, shows
+
+def run(festival, **filters):
+    results, counts = search.search_shows(festival, get_program(festival), **filters)
+    return [show.name for show in results], counts
+
+@pytest.mark.django_db
+def test_keyword_rank_order(program_data):
+
+    # Name (A) outranks company (B) which outranks listing (C)
+    festival, venues, genres, shows = program_data
+    names, counts = run(festival, keywords = 'puppets')
+    assert names == ['Puppet Show', 'Quiet Hour', 'Night Falls']
+    assert run(festival, keywords = 'puppet adventure')[0] == ['Night Falls']
+    assert run(festival, keywords = 'the')[0] == []
+
+@pytest.mark.django_db
+def test_facet_filters_and_counts(program_data):
+    festival, venues, genres, shows = program_data
+    main, studio = venues['main'].id, venues['studio'].id
+    comedy, drama = genres['Comedy'].id, genres['Drama'].id
+
+    # Day (the day counts ignore the day filter)
+    names, counts = run(festival, days = [DAY1])
+    assert sorted(names) == ['Puppet Show', 'Quiet Hour']
+    assert counts['days'] == {DAY1: 2, DAY2: 2}
+    assert (counts['venues'][main], counts['venues'][studio], counts['alt_spaces']) == (1, 0, 1)
+    assert (counts['genres'][comedy], counts['genres'][drama]) == (2, 0)
+
+    # Venue
+    names, counts = run(festival, venues = [studio])
+    assert names == ['Night Falls']
+    assert counts['days'] == {DAY1: 0, DAY2: 1}
+    assert (counts['venues'][main], counts['venues'][studio], counts['alt_spaces']) == (2, 1, 1)
+    assert (counts['genres'][comedy], counts['genres'][drama]) == (0, 1)
+
+    # Alt spaces
+    names, counts = run(festival, alt_spaces = True)
+    assert names == ['Quiet Hour']
+    assert counts['days'] == {DAY1: 1, DAY2: 0}
+
+    # Genre combined with a keyword
+    names, counts = run(festival, genres = [drama])
+    assert sorted(names) == ['Night Falls', 'Unrelated']
+    assert counts['days'] == {DAY1: 0, DAY2: 2}
+    assert (counts['venues'][main], counts['venues'][studio], counts['alt_spaces']) == (1, 1, 0)
+    names, counts = run(festival, keywords = 'puppet', genres = [drama])
+    assert names == ['Night Falls']
+    assert (counts['genres'][comedy], counts['genres'][drama]) == (2, 1)
+
+@pytest.mark.django_db
+def test_show_save_updates_fallback_index(program_data):
+    festival, venues, genres, shows = program_data
+    assert run(festival, keywords = 'marionette')[0] == []
+    show = shows['Unrelated']
+    show.name = 'Marionette'
+    show.save()
+    assert run(festival, keywords = 'marionette')[0] == ['Marionette']
+    assert run(festival, keywords = 'unrelated')[0] == []
+
+@pytest.mark.django_db
+def test_show_save_updates_search_vector(program_data):
+
+    # The signal updates the saved show's vector (only stored on PostgreSQL)
+    festival, venues, genres, shows = program_data
+    show = shows['Unrelated']
+    with mock.patch('program.signals.update_search_vectors') as update:
+        show.save()
+    assert [list(args[0]) for args, kwargs in update.call_args_list] == [[show]]
+
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != 'postgresql', reason = 'search vectors are only stored on PostgreSQL')
+def test_search_vector_ranking(program_data):
+    festival, venues, genres, shows = program_data
+    show = shows['Unrelated']
+    show.name = 'Marionette'
+    show.save()
+    assert run(festival, keywords = 'marionette')[0] == ['Marionette']
+    assert run(festival, keywords = 'puppet')[0] == ['Puppet Show', 'Quiet Hour', 'Night Falls']
+
+@pytest.mark.django_db
+def test_search_form_counts(program_data):
+
+    # Each choice is labelled with the number of matching shows
+    festival, venues, genres, shows = program_data
+    program = get_program(festival)
+    form = SearchForm(program = program, data = {'keywords': 'puppet', 'venues': ['0']})
+    assert form.is_valid()
+    results, counts = search.search_shows(festival, program, keywords = form.cleaned_data['keywords'], alt_spaces = '0' in form.cleaned_data['venues'])
+    form.add_counts(counts)
+    assert [show.name for show in results] == ['Quiet Hour']
+    assert [label for id, label in form.fields['venues'].choices] == ['Main (1)', 'Studio (1)', 'Alt Spaces (1)']
+    assert [label for id, label in form.fields['genres'].choices] == ['Comedy (1)', 'Drama (0)']
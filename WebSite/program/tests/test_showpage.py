@@ -0,0 +1,76 @@
+import datetime
+
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Festival, User
+from program.models import Company, Venue, VenueSponsor, Show, ShowImage, ShowPerformance, ShowReview
+from tickets.models import Sale, Ticket, TicketType
+
+
+# Festival version, show (with company and festival), performances (with venue and inventory),
+# sponsors, genres, images, reviews and the show template (once the caches are warm)
+QUERIES = 8
+
+@pytest.fixture
+def show():
+
+    # Ticketed show with sales open
+    festival = Festival.objects.create(name = 'TEST', title = 'Test festival', is_live = True, online_sales_open = datetime.date(2020, 1, 1))
+    company = Company.objects.create(festival = festival, name = 'Company')
+    return Show.objects.create(festival = festival, company = company, name = 'Show', is_ticketed = True)
+
+def add_venue(show, index, performances):
+
+    # Sponsored venue with performances on consecutive days
+    venue = Venue.objects.create(festival = show.festival, name = f'Venue {index}', is_ticketed = True, capacity = 10)
+    VenueSponsor.objects.create(venue = venue, name = f'Sponsor {index}', website = f'https://sponsor{index}.example.com')
+    return [ShowPerformance.objects.create(show = show, venue = venue, date = datetime.date(2026, 6, 1 + day), time = datetime.time(10 + index, 0)) for day in range(performances)]
+
+def add_extras(show, start, count):
+    for i in range(start, start + count):
+        ShowImage.objects.create(show = show, name = f'Image {i}')
+        ShowReview.objects.create(show = show, source = f'Source {i}', rating = 4, body = 'Review')
+
+def get_page(client, show):
+    response = client.get(reverse('program:show', args = [show.uuid]))
+    assert response.status_code == 200
+    return response.content.decode()
+
+@pytest.mark.django_db
+def test_show_page_queries_constant(client, show, django_assert_num_queries):
+
+    # One venue with one performance, image and review
+    add_venue(show, 1, 1)
+    add_extras(show, 0, 1)
+    get_page(client, show)
+    with django_assert_num_queries(QUERIES):
+        get_page(client, show)
+
+    # Several venues each with several performances, images and reviews
+    for index in range(2, 5):
+        add_venue(show, index, 4)
+    add_extras(show, 1, 4)
+    get_page(client, show)
+    with django_assert_num_queries(QUERIES):
+        content = get_page(client, show)
+    assert content.count('Venue 4') == 1
+    assert 'https://sponsor4.example.com' in content
+    assert 'Source 4' in content
+
+@pytest.mark.django_db
+def test_show_page_marks_sold_out(client, show):
+
+    # Fill the venue for the first performance only
+    sold_out, available = add_venue(show, 1, 2)
+    adult = TicketType.objects.create(festival = show.festival, name = 'Adult')
+    user = User.objects.create_user(show.festival, 'customer@example.com', 'password')
+    sale = Sale.objects.create(festival = show.festival, user = user, customer = user.email, completed = timezone.now())
+    for i in range(sold_out.venue.capacity):
+        Ticket.objects.create(performance = sold_out, type = adult, sale = sale)
+    content = get_page(client, show)
+    assert 'Mon at 11:00 (sold out)' in content
+    assert reverse('tickets:buy', args = [sold_out.uuid]) not in content
+    assert reverse('tickets:buy', args = [available.uuid]) in content
+    assert 'Tue at 11:00 (sold out)' not in content
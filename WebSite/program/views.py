@@ -1,17 +1,18 @@
 import os
 import datetime
 
-from django.db.models import Q
-from django.db.models.functions import Lower
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
 from django.contrib.messages.views import SuccessMessageMixin
-from django.http import HttpResponse
+from django.core.files.storage import default_storage
+from django.http import HttpResponse, FileResponse
 from django.shortcuts import get_object_or_404, render, redirect
-from django.template import engines, Template, Context
+from django.template import engines, Template, Context, RequestContext
 from django.urls import reverse, reverse_lazy
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.views import View
 from django.views.decorators.http import require_POST
 from django.views.generic import ListView, CreateView, UpdateView
@@ -20,15 +21,9 @@ from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Field, HTML, Submit, Button, Row, Column
 from crispy_forms.bootstrap import FormActions, TabHolder, Tab
 
-from reportlab.pdfgen.canvas import Canvas
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
-from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
-from reportlab.lib.enums import TA_LEFT, TA_CENTER
-from reportlab.lib.pagesizes import A4, portrait, landscape
-from reportlab.lib.units import cm
-from reportlab.lib import colors
-
 from core.models import Festival
+from content.compiled import get_template, get_show_template
+from content.urlmap import get_festival_urls
 from content.models import Image, Resource
 from .models import (
     Genre,
@@ -43,14 +38,20 @@ from .forms import (
    AdminCompanyForm, AdminCompanyContactForm,
    AdminShowForm, AdminShowPerformanceForm, AdminShowReviewForm, AdminShowImageForm,
 )
+from .schedule import get_schedule
+from .schedule_pdf import get_schedule_pdf
+from .search import search_shows
+from .showpage import get_show_page
+from .snapshot import get_program
 
 def shows(request, festival_uuid=None):
 
-    # Get festival
+    # Get festival and program
     festival = get_object_or_404(Festival, uuid=festival_uuid) if festival_uuid else request.festival
+    program = get_program(festival)
 
     # Create the search form
-    search = SearchForm(festival=festival, data=request.GET)
+    search = SearchForm(program=program, data=request.GET)
 
     # Create context
     context = {
@@ -58,22 +59,18 @@ def shows(request, festival_uuid=None):
         'search': search,
     }
 
-    # If valid add search results to context
+    # If valid add search results (and the number of shows for each choice) to context
     if search.is_valid():
-        shows = Show.objects.filter(festival=festival).select_related('company').prefetch_related('genres', 'performances')
-        if search.cleaned_data['days']:
-            shows = shows.filter(performances__date__in = search.cleaned_data['days'])
-        if search.cleaned_data['venues']:
-            if '0' in search.cleaned_data['venues']:
-                shows = shows.filter(Q(performances__venue_id__in = search.cleaned_data['venues']) | Q(is_ticketed = False))
-            else:
-                shows = shows.filter(performances__venue_id__in = search.cleaned_data['venues'])
-        if search.cleaned_data['genres']:
-            shows = shows.filter(genres__id__in = search.cleaned_data['genres'] )
-        shows = shows.order_by(Lower('name'))
-        results = []
-        for show in shows.distinct():
-            results.append(show)
+        results, counts = search_shows(
+            festival,
+            program,
+            keywords = search.cleaned_data['keywords'],
+            days = [datetime.date.fromisoformat(day) for day in search.cleaned_data['days']],
+            venues = [int(id) for id in search.cleaned_data['venues'] if id != '0'],
+            genres = [int(id) for id in search.cleaned_data['genres']],
+            alt_spaces = '0' in search.cleaned_data['venues'],
+        )
+        search.add_counts(counts)
         context['results'] = results
 
     # Render search results
@@ -81,18 +78,19 @@ def shows(request, festival_uuid=None):
 
 def show(request, show_uuid):
 
-    # Get show
-    show = get_object_or_404(Show, uuid=show_uuid)
+    # Get show (with its performances, venues, images and reviews)
+    show = get_show_page(show_uuid)
 
     # Check for HTML description
     html = None
     if show.detail:
         media_url = getattr(settings, 'MEDIA_URL', '/media')
-        image_urls = { image.name:os.path.join(media_url, image.image.url) for image in request.festival.images.all() if image.image }
+        urls = get_festival_urls(request.festival)
+        image_urls = dict(urls['image_urls'])
         image_urls.update({ image.name:os.path.join(media_url, image.image.url) for image in show.images.all() if image.image })
-        document_urls = { document.name:reverse('content:document', args=[document.uuid]) for document in request.festival.documents.all() if document.file }
-        page_urls = { page.name:reverse('content:page', args=[page.uuid]) for page in request.festival.pages.all() }
-        resource_urls = { resource.name:reverse('content:resource', args=[resource.uuid]) for resource in request.festival.resources.all() }
+        document_urls = urls['document_urls']
+        page_urls = urls['page_uuid_urls']
+        resource_urls = urls['resource_urls']
         body_context = {
             'show': show,
             'image_urls': image_urls,
@@ -100,16 +98,11 @@ def show(request, show_uuid):
             'page_urls': page_urls,
             'resource_urls': resource_urls,
         }
-        template = Template(show.detail)
+        template = get_template(show, 'detail')
         html = template.render(Context(body_context))
 
     # Get show template and render page
-    festival_template = Resource.objects.filter(festival=request.festival, name='ShowTemplate').first()
-    engine = engines['django']
-    if festival_template:
-        show_template = engine.from_string(festival_template.body)
-    else:
-        show_template = engine.get_template('program/show.html')
+    festival_template = get_show_template(request.festival)
     sales_closed = request.festival.online_sales_close and (request.now.date() > request.festival.online_sales_close)
     sales_open = request.festival.online_sales_open and (request.now.date() >= request.festival.online_sales_open) and not sales_closed
     context ={
@@ -119,94 +112,18 @@ def show(request, show_uuid):
         'sales_open': sales_open, 
         'sales_closed': sales_closed,
     }
-    return HttpResponse(show_template.render(context, request))
-
-
-def _add_non_scheduled_performances(festival, day):
-    performances = []
-    for performance in ShowPerformance.objects.filter(show__festival=festival, venue__is_scheduled=False, date = day['date']).order_by('time').values('time', 'show__uuid', 'show__name', 'show__is_cancelled'):
-        performances.append(
-            {
-                'show_uuid': performance['show__uuid'],
-                'show_name': performance['show__name'],
-                'time': performance['time'],
-                'is_cancelled': performance['show__is_cancelled'],
-            }
-        )
-    if performances:
-        day['venues'].append(
-            {
-                'name': 'Other (alt spaces)',
-                'color': '',
-                'performances': performances,
-            }
-        )
+    if festival_template:
+        return HttpResponse(festival_template.render(RequestContext(request, context)))
+    return render(request, 'program/show.html', context)
+
 
 def schedule(request, festival_uuid=None):
 
     # Get festival
     festival = get_object_or_404(Festival, uuid=festival_uuid) if festival_uuid else request.festival
 
-    # Build the schedule
-    days = []
-    day = None
-    for performance in ShowPerformance.objects.filter(show__festival=festival, venue__is_scheduled=True) \
-                                              .order_by('date', 'venue__name', 'time') \
-                                              .values('date', 'venue__is_ticketed', 'venue__name', 'venue__color', 'time', 'show__uuid', 'show__name', 'show__is_cancelled'):
-            
-        # If the date has changed start a new day
-        if day and performance['date'] != day['date']:
-            if venue:
-                if venue['is_ticketed']:
-                    day['ticketed_venues'].append(venue)
-                else:
-                    day['payw_venues'].append(venue)
-                venue = None
-            _add_non_scheduled_performances(festival, day)
-            days.append(day)
-            day = None
-        if not day:
-            day = {
-                'date': performance['date'],
-                'ticketed_venues': [],
-                'payw_venues': [],
-            }
-            venue = None
-
-        # If the venue has changed add it to the page and start a new one
-        if venue and performance['venue__name'] != venue['name']:
-            if venue['is_ticketed']:
-                day['ticketed_venues'].append(venue)
-            else:
-                day['payw_venues'].append(venue)
-            venue = None
-        if not venue:
-            venue = {
-                'name': performance['venue__name'],
-                'is_ticketed': performance['venue__is_ticketed'],
-                'color': performance['venue__color'],
-                'performances': [],
-            }
-
-        # Add performance to venue
-        venue['performances'].append(
-            {
-                'show_uuid': performance['show__uuid'],
-                'show_name': performance['show__name'],
-                'time': performance['time'],
-                'is_cancelled': performance['show__is_cancelled'],
-            }
-        )
-
-    # Add final day and venue
-    if day:
-        if venue:
-            if venue['is_ticketed']:
-                day['ticketed_venues'].append(venue)
-            else:
-                day['payw_venues'].append(venue)
-        _add_non_scheduled_performances(festival, day)
-        days.append(day)
+    # Get the schedule
+    days = get_schedule(festival)
 
     # Render schedule
     context = {
@@ -214,220 +131,46 @@ def schedule(request, festival_uuid=None):
     }
     return render(request, 'program/schedule.html', context)
 
-def venues_schedule_pdf(request, festival, venues, styles):
-
-    venues_data = []
-    table_data = []
-    table_styles = []
-    for v in venues:
-        venues_data.append(Paragraph(f'<para align="center"><b>{v.name}</b></para>', styles['Venue']))
-        venues_data.append('')
-    table_data.append(venues_data)
-    for i, v in enumerate(venues):
-        table_styles.append(('SPAN', (2*i, 0), (2*i + 1, 0)))
-        table_styles.append(('BACKGROUND', (2*i, 0), (2*i + 1, 0), v.color ))
-
-    # Days
-    days = ShowPerformance.objects.filter(show__festival=festival, show__is_cancelled=False, show__is_ticketed=True).order_by('date').values('date').distinct()
-    day_color = ('#fbe4d5', '#fff2cc', '#e2efd9', '#deeaf6')
-    for index, day in enumerate(days):
-
-        # Add a row for the day
-        first_row = len(table_data)
-        table_data.append([Paragraph(f"{day['date']:%A %d}", styles['Day'])] + ['' for i in range(2*len(venues) - 1)])
-        table_styles.append(('SPAN', (0, first_row), (-1, first_row)))
-
-        # Get performances for each venue
-        venue_performances = [ ShowPerformance.objects.filter(venue=v, show__is_cancelled=False, date = day['date']).order_by('time') for v in venues]
-        if venue_performances:
-            slots = max([len(vp) for vp in venue_performances])
-            for i in range(slots):
-                slot_data = []
-                for v in range(len(venues)):
-                    if (i < len(venue_performances[v])):
-                        performance = venue_performances[v][i]
-                        slot_data.append(Paragraph(f'{performance.time:%H:%M}', styles['Time']))
-                        slot_url = f'http://{ request.get_host() }{ reverse("program:show", args = [performance.show.uuid]) }' 
-                        slot_data.append(Paragraph(f'<a href="{ slot_url }">{ performance.show.name }</a>', styles['Show']))
-                    else:
-                        slot_data.append('')
-                        slot_data.append('')
-                table_data.append(slot_data)
-
-        # Set background color
-        table_styles.append(('BACKGROUND', (0, first_row), (-1, len(table_data)), day_color[index % len(day_color)]))
-        for i in range(len(venues) - 1):
-            table_styles.append(('LINEAFTER', (2*i + 1, first_row + 1), (2*i + 1, len(table_data)), 1, colors.gray))
-
-    # Table styles
-    table_styles.append(('VALIGN', (0, 0), (-1, -1), 'TOP'))
-    table_styles.append(('ALIGN', (0, 0), (-1, 0), 'CENTER'))
-    table_styles.append(('LEFTPADDING', (0, 0), (-1, -1), 2))
-    table_styles.append(('RIGHTPADDING', (0, 0), (-1, -1), 2))
-    table_styles.append(('TOPPADDING', (0, 0), (-1, -1), 1))
-    table_styles.append(('BOTTOMPADDING', (0, 0), (-1, -1), 2))
-    table_styles.append(('BOX', (0, 0), (-1, -1), 2, colors.gray))
-    table_styles.append(('GRID', (0, 0), (-1, 0), 1, colors.gray))
-    table_styles.append(('LINEBELOW', (0, 1), (-1, -1), 0.25, colors.gray))
-
-    slot_width_cm = 28.3 / len(venues)
-    time_width_cm = 0.9
-    show_width_cm = slot_width_cm - time_width_cm
-    table = Table(
-        table_data,
-        colWidths = len(venues) * [time_width_cm*cm, show_width_cm*cm],
-        hAlign = 'LEFT',
-        vAlign = 'TOP',
-        style = table_styles,
-    )
-    return table
-
-
 def schedule_pdf(request, festival_uuid=None):
 
     # Get festival
     festival = get_object_or_404(Festival, uuid=festival_uuid) if festival_uuid else request.festival
 
-    # Create a Platypus story
-    response = HttpResponse(content_type = 'application/pdf')
+    # Get the pre-rendered PDF for the current version of the program
+    artifact = get_schedule_pdf(festival, request.get_host())
+    response = get_conditional_response(request, etag = f'"{artifact["etag"]}"', last_modified = artifact['modified'].timestamp())
+    if response:
+        return response
+
+    # Open it (rebuilding it if the file has been deleted since it was read from the cache)
+    try:
+        file = default_storage.open(artifact['path'])
+    except FileNotFoundError:
+        artifact = get_schedule_pdf(festival, request.get_host(), rebuild = True)
+        file = default_storage.open(artifact['path'])
+    response = FileResponse(file, content_type = 'application/pdf')
     response["Content-Disposition"] = 'inline; filename="TheatrefestSchedule.pdf"'
-    doc = SimpleDocTemplate(
-        response,
-        pagesize = landscape(A4),
-        leftMargin = 0.5*cm,
-        rightMargin = 0.5*cm,
-        topMargin = 0.5*cm,
-        bottomMargin = 0.5*cm,
-    )
-    styles = getSampleStyleSheet()
-    story = []
-
-    # Paragraph styles
-    venue_style = ParagraphStyle(
-        name = 'Venue',
-        align = TA_CENTER,
-        fontSize = 10,
-        textColor = colors.white,
-    )
-    day_style = ParagraphStyle(
-        name = 'Day',
-        fontSize = 10,
-    )
-    time_style = ParagraphStyle(
-        name = 'Time',
-        fontSize = 8,
-        leading = 8,
-        textColor = colors.indianred,
-    )
-    show_style = ParagraphStyle(
-        name = 'Show',
-        fontSize = 8,
-        leading = 8,
-        textColor = '#1a7cf3',
-    )
-    styles = {
-        'Venue': venue_style,
-        'Day': day_style,
-        'Time': time_style,
-        'Show': show_style,
-    }
-
-    # Ticketed venues
-    venues = Venue.objects.filter(festival=festival, is_scheduled=True, is_ticketed=True).order_by('name')
-    story.append(venues_schedule_pdf(request, festival, venues, styles))
-    # venues_data = []
-    # table_data = []
-    # table_styles = []
-    # for v in venues:
-    #     venues_data.append(Paragraph(f'<para align="center"><b>{v.name}</b></para>', venue_style))
-    #     venues_data.append('')
-    # table_data.append(venues_data)
-    # for i, v in enumerate(venues):
-    #     table_styles.append(('SPAN', (2*i, 0), (2*i + 1, 0)))
-    #     table_styles.append(('BACKGROUND', (2*i, 0), (2*i + 1, 0), v.color ))
-
-    # # Days
-    # days = ShowPerformance.objects.filter(show__festival=festival, show__is_cancelled=False, show__is_ticketed=True).order_by('date').values('date').distinct()
-    # day_color = ('#fbe4d5', '#fff2cc', '#e2efd9', '#deeaf6')
-    # for index, day in enumerate(days):
-
-    #     # Add a row for the day
-    #     first_row = len(table_data)
-    #     table_data.append([Paragraph(f"{day['date']:%A %d}", day_style)] + ['' for i in range(2*len(venues) - 1)])
-    #     table_styles.append(('SPAN', (0, first_row), (-1, first_row)))
-
-    #     # Get performances for each venue
-    #     venue_performances = [ ShowPerformance.objects.filter(venue=v, show__is_cancelled=False, date = day['date']).order_by('time') for v in venues]
-    #     slots = max([len(vp) for vp in venue_performances])
-    #     for i in range(slots):
-    #         slot_data = []
-    #         for v in range(len(venues)):
-    #             if (i < len(venue_performances[v])):
-    #                 performance = venue_performances[v][i]
-    #                 slot_data.append(Paragraph(f'{performance.time:%H:%M}', time_style))
-    #                 slot_url = f'http://{ request.get_host() }{ reverse("program:show", args = [performance.show.uuid]) }' 
-    #                 slot_data.append(Paragraph(f'<a href="{ slot_url }">{ performance.show.name }</a>', show_style))
-    #             else:
-    #                 slot_data.append('')
-    #                 slot_data.append('')
-    #         table_data.append(slot_data)
-
-    #     # Set background color
-    #     table_styles.append(('BACKGROUND', (0, first_row), (-1, len(table_data)), day_color[index % len(day_color)]))
-    #     for i in range(len(venues) - 1):
-    #         table_styles.append(('LINEAFTER', (2*i + 1, first_row + 1), (2*i + 1, len(table_data)), 1, colors.gray))
-
-    # # Table styles
-    # table_styles.append(('VALIGN', (0, 0), (-1, -1), 'TOP'))
-    # table_styles.append(('ALIGN', (0, 0), (-1, 0), 'CENTER'))
-    # table_styles.append(('LEFTPADDING', (0, 0), (-1, -1), 2))
-    # table_styles.append(('RIGHTPADDING', (0, 0), (-1, -1), 2))
-    # table_styles.append(('TOPPADDING', (0, 0), (-1, -1), 1))
-    # table_styles.append(('BOTTOMPADDING', (0, 0), (-1, -1), 2))
-    # table_styles.append(('BOX', (0, 0), (-1, -1), 2, colors.gray))
-    # table_styles.append(('GRID', (0, 0), (-1, 0), 1, colors.gray))
-    # table_styles.append(('LINEBELOW', (0, 1), (-1, -1), 0.25, colors.gray))
-
-    # slot_width_cm = 28.3 / len(venues)
-    # time_width_cm = 0.9
-    # show_width_cm = slot_width_cm - time_width_cm
-    # table = Table(
-    #     table_data,
-    #     colWidths = len(venues) * [time_width_cm*cm, show_width_cm*cm],
-    #     hAlign = 'LEFT',
-    #     vAlign = 'TOP',
-    #     style = table_styles,
-    # )
-    # story.append(table)
-
-    # PAYW venues
-    venues = Venue.objects.filter(festival=festival, is_scheduled=True, is_ticketed=False).order_by('name')
-    i = 0
-    while i < len(venues):
-        story.append(PageBreak())
-        story.append(venues_schedule_pdf(request, festival, venues[i:i+7], styles))
-        i += 7
-
-    # Create PDF document and return it
-    doc.build(story)
+    response['ETag'] = f'"{artifact["etag"]}"'
+    response['Last-Modified'] = http_date(artifact['modified'].timestamp())
     return response
 
 
 def venues(request, festival_uuid=None):
 
-    # Get festival
+    # Get festival and program
     festival = get_object_or_404(Festival, uuid=festival_uuid) if festival_uuid else request.festival
+    program = get_program(festival)
 
     # List ticketd and non-ticketd vebues separately
     context = {
-        'ticketed_venues': Venue.objects.filter(festival=festival, is_ticketed=True).order_by('map_index', 'name'),
-        'nonticketed_venues': Venue.objects.filter(festival=festival, is_ticketed=False).order_by('map_index', 'name'),
+        'ticketed_venues': sorted([v for v in program.venues if v.is_ticketed], key = lambda v: (v.map_index, v.name)),
+        'nonticketed_venues': sorted([v for v in program.venues if not v.is_ticketed], key = lambda v: (v.map_index, v.name)),
     }
 
     # Get venue map
-    venue_map = Image.objects.filter(festival=request.festival, name='VenueMap').first()
+    venue_map = get_festival_urls(request.festival)['image_urls'].get('VenueMap')
     if venue_map:
-        context['venue_map'] = venue_map.get_absolute_url()
+        context['venue_map'] = venue_map
 
     # Render venue list
     return render(request, 'program/venues.html', context)
@@ -435,13 +178,17 @@ def venues(request, festival_uuid=None):
 
 def venue(request, venue_uuid):
 
-    # Get venue
-    venue = get_object_or_404(Venue, uuid = venue_uuid)
+    # Get venue (from the current festival's program if possible)
+    program = get_program(request.festival)
+    venue = program.venues_by_uuid.get(venue_uuid)
+    if not venue:
+        program = get_program(get_object_or_404(Venue, uuid = venue_uuid).festival)
+        venue = program.venues_by_uuid[venue_uuid]
 
     # Render venue details
     context = {
         'venue': venue,
-        'shows': venue.shows.order_by(Lower('name')),
+        'shows': program.get_shows(program.shows_by_venue.get(venue.id, ())),
     }
     return render(request, 'program/venue.html', context)
 
@@ -0,0 +1,149 @@
+import datetime
+from bisect import bisect_left, bisect_right
+
+from django.db.models import Count
+from django.utils import timezone
+
+from program.models import ShowPerformance
+from tickets.models import Sale, Refund, Checkpoint
+
+
+# Checkpoint reconciliation
+#
+# The box office and venue summaries compare the cash, fringers and buttons counted at each
+# checkpoint with the sales (and refunds) completed between checkpoints. Rather than running
+# separate aggregates for every window the sales and refunds for the day are loaded once, sorted
+# by completion time and accumulated into running totals. The totals for any window are then
+# the difference between the running totals at its two ends (found by bisecting the completion
+# times).
+class Transactions:
+
+    def __init__(self, sales, refunds, start, end):
+
+        # Load sales and refunds completed between start and end
+        self.sale_times = [None]
+        self.sale_totals = [{'cash': 0, 'card': 0, 'fringers': 0, 'buttons': 0}]
+        for sale in sales.filter(completed__gte = start, completed__lte = end).values('id', 'completed', 'transaction_type', 'amount', 'buttons').annotate(fringer_count = Count('fringers')).order_by('completed'):
+            totals = dict(self.sale_totals[-1])
+            if sale['transaction_type'] == Sale.TRANSACTION_TYPE_CASH:
+                totals['cash'] += sale['amount']
+            elif sale['transaction_type'] == Sale.TRANSACTION_TYPE_SQUAREUP:
+                totals['card'] += sale['amount']
+            totals['fringers'] += sale['fringer_count']
+            totals['buttons'] += sale['buttons']
+            self.sale_times.append(sale['completed'])
+            self.sale_totals.append(totals)
+        self.refund_times = [None]
+        self.refund_totals = [{'cash': 0}]
+        if refunds != None:
+            for refund in refunds.filter(completed__gte = start, completed__lte = end).values('completed', 'amount').order_by('completed'):
+                self.refund_times.append(refund['completed'])
+                self.refund_totals.append({'cash': self.refund_totals[-1]['cash'] + refund['amount']})
+        self.include_refunds = refunds != None
+
+    def _window(self, times, totals, start, end, inclusive):
+
+        # Difference between the running totals either side of the window (the first entry
+        # in times is a placeholder for the initial zero totals)
+        if inclusive:
+            first = bisect_left(times, start, 1)
+            last = bisect_left(times, end, 1)
+        else:
+            first = bisect_right(times, start, 1)
+            last = bisect_left(times, end, 1)
+        last = max(first, last)
+        return {key: totals[last - 1][key] - totals[first - 1][key] for key in totals[0]}
+
+    def sales(self, start, end, inclusive = False):
+        return self._window(self.sale_times, self.sale_totals, start, end, inclusive)
+
+    def refunds(self, start, end, inclusive = False):
+        return self._window(self.refund_times, self.refund_totals, start, end, inclusive)
+
+    def period(self, title, open, close, start = None, end = None):
+
+        # Reconcile a period between two checkpoints (by default the sales between the checkpoints
+        # are used, otherwise those completed in [start, end)). There is nothing to reconcile
+        # without two different checkpoints.
+        if not (open and close) or (open == close):
+            return {
+                'title': title,
+                'open': open,
+                'close': close,
+            }
+        if start:
+            sales = self.sales(start, end, inclusive = True)
+            refunds = self.refunds(start, end, inclusive = True)
+        else:
+            sales = self.sales(open.created, close.created)
+            refunds = self.refunds(open.created, close.created)
+        period = {
+            'title': title,
+            'open': open,
+            'close': close,
+            'sales': sales,
+            'variance': {
+                'cash': close.cash - open.cash - sales['cash'],
+                'fringers': close.fringers - open.fringers + sales['fringers'],
+                'buttons': close.buttons - open.buttons + sales['buttons'],
+            },
+        }
+        if self.include_refunds:
+            period['refunds'] = refunds
+            period['variance']['cash'] += refunds['cash']
+        return period
+
+
+def _get_day(date):
+
+    # Start and end of a (local) day
+    start = timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+    return start, start + datetime.timedelta(days = 1)
+
+def _get_load_range(day_start, day_end, checkpoints):
+
+    # Loaded sales must cover the whole day and every checkpoint window
+    times = [c.created for c in checkpoints if c]
+    return min([day_start] + times), max([day_end] + times)
+
+
+def get_boxoffice_periods(boxoffice, date):
+
+    # Daily summary followed by the periods between consecutive checkpoints
+    day_start, day_end = _get_day(date)
+    checkpoints = list(boxoffice.checkpoints.filter(created__gte = day_start, created__lt = day_end).order_by('created'))
+    start, end = _get_load_range(day_start, day_end, checkpoints)
+    transactions = Transactions(Sale.objects.filter(boxoffice = boxoffice), Refund.objects.filter(boxoffice = boxoffice), start, end)
+    first = checkpoints[0] if checkpoints else None
+    last = checkpoints[-1] if checkpoints else None
+    if first and last and first != last:
+        periods = [transactions.period(f"Daily Summary: {first.created.astimezone():%I:%M%p} to {last.created.astimezone():%I:%M%p}", first, last, day_start, day_end)]
+    else:
+        periods = [transactions.period('Daily Summary', first, last)]
+    for open, close in zip(checkpoints, checkpoints[1:]):
+        periods.append(transactions.period(f"{open.created.astimezone():%I:%M%p} to {close.created.astimezone():%I:%M%p}", open, close))
+    return periods
+
+def get_venue_periods(venue, date):
+
+    # Daily summary followed by each performance
+    day_start, day_end = _get_day(date)
+    checkpoints = list(Checkpoint.objects.filter(venue = venue, created__gte = day_start, created__lt = day_end).order_by('created'))
+    performances = list(ShowPerformance.objects.filter(venue = venue, date = date).select_related('show', 'open_checkpoint', 'close_checkpoint').order_by('time'))
+    performance_checkpoints = []
+    for performance in performances:
+        performance_checkpoints.append((
+            performance.open_checkpoint if performance.has_open_checkpoint else None,
+            performance.close_checkpoint if performance.has_close_checkpoint else None,
+        ))
+    start, end = _get_load_range(day_start, day_end, checkpoints + [c for pair in performance_checkpoints for c in pair])
+    transactions = Transactions(Sale.objects.filter(venue = venue), None, start, end)
+    first = checkpoints[0] if checkpoints else None
+    last = checkpoints[-1] if checkpoints else None
+    if first and last and first != last:
+        periods = [transactions.period(f"Daily Summary: {first.created.astimezone():%I:%M%p} to {last.created.astimezone():%I:%M%p}", first, last, day_start, day_end)]
+    else:
+        periods = [transactions.period('Daily Summary', first, last)]
+    for performance, (open, close) in zip(performances, performance_checkpoints):
+        periods.append(transactions.period(f"{performance.time:%I:%M%p} {performance.show.name}", open, close))
+    return periods
@@ -1,13 +1,13 @@
 import os
 import io
 import datetime
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 from decimal import Decimal
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.db.models import Exists, OuterRef
-from django.db.models.aggregates import Sum
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.aggregates import Count, Max, Min, Sum
 from django.shortcuts import get_object_or_404, render, redirect
 from django.template import Template, Context
 from django.views import View
@@ -30,206 +30,188 @@ import xlsxwriter as xlsx
 from core.models import User
 from program.models import Company, Venue, Show, ShowPerformance
 from tickets.models import BoxOffice, Sale, Refund, FringerType, Fringer, TicketType, Ticket, Checkpoint, PayAsYouWill, Bucket
+from volunteers.models import Shift
+
+from .checkpoints import get_boxoffice_periods, get_venue_periods
 
 def date_list(from_date, to_date):
 
     return [from_date + datetime.timedelta(days = d) for d in range((to_date - from_date).days + 1)]
 
 
-@require_GET
-@login_required
-@user_passes_test(lambda u: u.is_admin)
-def festival_summary(request):
+def _add_summary_amount(summary, index, amount):
 
-    # General stuff
-    festival = request.festival
-    boxoffice_list = [bo for bo in BoxOffice.objects.filter(festival=festival).order_by('name')]
-    venue_list = [v for v in Venue.objects.filter(festival=festival, is_ticketed=True).order_by('name')]
+    # Add an amount to a summary row (index None is pre-sales)
+    if index == None:
+        summary['pre'] += amount
+    else:
+        summary['dates'][index] += amount
+    summary['total'] += amount
 
-    # Sales by channel
-    dates = date_list(festival.boxoffice_open, festival.boxoffice_close)
-    presales = Sale.objects.filter(festival=festival, completed__lt = dates[0], boxoffice__isnull = True, venue__isnull = True).aggregate(Sum('amount'))['amount__sum'] or 0
-    online = {
-        'pre': presales,
-        'dates': [],
-        'total': presales,
-    }
-    boxoffices = {}
-    for bo in boxoffice_list:
-        bo_pre = Sale.objects.filter(festival=festival, completed__lt = dates[0], boxoffice = bo, venue__isnull = True).aggregate(Sum('amount'))['amount__sum'] or 0
-        boxoffices[bo.name] = {
-            'pre': bo_pre,
-            'dates': [],
-            'total': bo_pre,
-        }
-        presales += bo_pre
-    venues = OrderedDict([(v.name, {'dates': [], 'total': 0}) for v in venue_list])
+def _get_summary_totals(rows, date_count):
+
+    # Column totals for a set of summary rows
     totals = {
-        'pre': presales,
-        'dates': [],
-        'total': presales,
+        'pre': sum(row.get('pre', 0) for row in rows),
+        'dates': [sum(row['dates'][i] for row in rows) for i in range(date_count)],
     }
-    for date in dates:
-        query = Sale.objects.filter(festival = festival, completed__date = date)
-        date_total = 0
-        date_amount = query.filter(boxoffice__isnull = True, venue__isnull = True).aggregate(Sum('amount'))['amount__sum'] or 0
-        online['dates'].append(date_amount)
-        online['total'] += date_amount
-        date_total += date_amount
-        for boxoffice in boxoffice_list:
-            date_amount = query.filter(boxoffice = boxoffice).aggregate(Sum('amount'))['amount__sum'] or 0
-            boxoffices[boxoffice.name]['dates'].append(date_amount)
-            boxoffices[boxoffice.name]['total'] += date_amount
-            date_total += date_amount
-        for venue in venue_list:
-            date_amount = query.filter(venue = venue).aggregate(Sum('amount'))['amount__sum'] or 0
-            venues[venue.name]['dates'].append(date_amount)
-            venues[venue.name]['total'] += date_amount
-            date_total += date_amount
-        totals['dates'].append(date_total)
-        totals['total'] += date_total
+    totals['total'] = totals['pre'] + sum(totals['dates'])
+    return totals
+
+def _get_festival_summary(festival, boxoffice_list, venue_list):
+
+    # Load totals grouped by date (and channel, payment type or ticket/fringer type) and pivot them
+    # in memory so the number of queries does not depend on the number of dates, box offices or venues.
+    dates = date_list(festival.boxoffice_open, festival.boxoffice_close)
+    date_index = {date: index for index, date in enumerate(dates)}
+    paper_fringer_type = festival.paper_fringer_type
+    sales = Sale.objects.filter(festival = festival, completed__isnull = False).values('completed__date', 'boxoffice_id', 'venue_id', 'transaction_type').annotate(
+        amount_sum = Sum('amount'),
+        buttons_sum = Sum('buttons'),
+        donation_sum = Sum('donation'),
+    ).order_by()
+    fringers = Fringer.objects.filter(sale__festival = festival, sale__completed__isnull = False).values('sale__completed__date', 'type_id', 'type__is_online').annotate(
+        count = Count('id'),
+        price_sum = Sum('type__price'),
+        shows_sum = Sum('type__shows'),
+    ).order_by()
+    tickets = Ticket.objects.filter(sale__festival = festival, sale__completed__isnull = False).values('sale__completed__date', 'type_id').annotate(
+        price_sum = Sum('type__price'),
+        active = Count('id', filter = Q(refund__isnull = True)),
+        online = Count('id', filter = Q(refund__isnull = True, sale__venue__isnull = True, sale__boxoffice__isnull = True)),
+        boxoffice = Count('id', filter = Q(refund__isnull = True, sale__boxoffice__isnull = False)),
+        venue = Count('id', filter = Q(refund__isnull = True, sale__venue__isnull = False)),
+        efringers = Count('id', filter = Q(refund__isnull = True, fringer__type__is_online = True)),
+    ).order_by()
+    payws = PayAsYouWill.objects.filter(sale__festival = festival, sale__completed__isnull = False).values('sale__completed__date').annotate(
+        boxoffice = Sum('amount', filter = Q(fringer__isnull = True)),
+        efringers = Sum('amount', filter = Q(fringer__isnull = False)),
+    ).order_by()
+
+    # Sales by channel
+    online = {'pre': 0, 'dates': [0] * len(dates), 'total': 0}
+    boxoffices = {bo.name: {'pre': 0, 'dates': [0] * len(dates), 'total': 0} for bo in boxoffice_list}
+    venues = OrderedDict([(v.name, {'dates': [0] * len(dates), 'total': 0}) for v in venue_list])
+    boxoffice_names = {bo.id: bo.name for bo in boxoffice_list}
+    venue_names = {v.id: v.name for v in venue_list}
+    for sale in sales:
+        amount = sale['amount_sum'] or 0
+        index = date_index.get(sale['completed__date'])
+        if index == None:
+            if sale['completed__date'] < dates[0] and sale['venue_id'] == None:
+                if sale['boxoffice_id'] == None:
+                    _add_summary_amount(online, None, amount)
+                elif sale['boxoffice_id'] in boxoffice_names:
+                    _add_summary_amount(boxoffices[boxoffice_names[sale['boxoffice_id']]], None, amount)
+            continue
+        if sale['boxoffice_id'] == None and sale['venue_id'] == None:
+            _add_summary_amount(online, index, amount)
+        if sale['boxoffice_id'] in boxoffice_names:
+            _add_summary_amount(boxoffices[boxoffice_names[sale['boxoffice_id']]], index, amount)
+        if sale['venue_id'] in venue_names:
+            venues[venue_names[sale['venue_id']]]['dates'][index] += amount
+            venues[venue_names[sale['venue_id']]]['total'] += amount
     sales_by_channel = {
         'dates': dates,
         'online': online,
         'boxoffices': boxoffices,
         'venues': venues,
-        'totals': totals,
+        'totals': _get_summary_totals([online, *boxoffices.values(), *venues.values()], len(dates)),
     }
 
     # Sales by type
-    dates = date_list(festival.boxoffice_open, festival.boxoffice_close)
-    efringers_pre = Fringer.objects.filter(type__is_online=True, sale__festival=festival, sale__completed__lt=dates[0]).aggregate(Sum('type__price'))['type__price__sum'] or 0
-    tickets_pre = Ticket.objects.filter(sale__festival=festival, sale__completed__lt=dates[0]).aggregate(Sum('type__price'))['type__price__sum'] or 0
-    buttons_pre = festival.button_price * (Sale.objects.filter(festival=festival, completed__lt=dates[0]).aggregate(Sum('buttons'))['buttons__sum'] or 0)
     types = OrderedDict([
-        ('buttons', {'title': 'Badges', 'pre': buttons_pre, 'dates': [], 'total': buttons_pre}),
-        ('fringers', {'title': 'Paper fringers', 'pre': 0, 'dates': [], 'total': 0}),
-        ('efringers', {'title': 'eFringers', 'pre': efringers_pre, 'dates': [], 'total': efringers_pre}),
-        ('tickets', {'title': 'Tickets', 'pre': tickets_pre, 'dates': [], 'total': tickets_pre}),
-        ('payw', {'title': 'PAYW', 'pre': 0, 'dates': [], 'total': 0}),
-        ('donations', {'title': 'Donations', 'pre': 0, 'dates': [], 'total': 0}),
+        ('buttons', {'title': 'Badges', 'pre': 0, 'dates': [0] * len(dates), 'total': 0}),
+        ('fringers', {'title': 'Paper fringers', 'pre': 0, 'dates': [0] * len(dates), 'total': 0}),
+        ('efringers', {'title': 'eFringers', 'pre': 0, 'dates': [0] * len(dates), 'total': 0}),
+        ('tickets', {'title': 'Tickets', 'pre': 0, 'dates': [0] * len(dates), 'total': 0}),
+        ('payw', {'title': 'PAYW', 'pre': 0, 'dates': [0] * len(dates), 'total': 0}),
+        ('donations', {'title': 'Donations', 'pre': 0, 'dates': [0] * len(dates), 'total': 0}),
     ])
-    totals = {
-        'pre': efringers_pre + tickets_pre + buttons_pre,
-        'dates': [],
-        'total': efringers_pre + tickets_pre + buttons_pre,
-    }
-    for date in dates:
-        date_total = 0
-        date_amount = festival.button_price * (Sale.objects.filter(festival = festival, completed__date = date).aggregate(Sum('buttons'))['buttons__sum'] or 0)
-        types['buttons']['dates'].append(date_amount)
-        types['buttons']['total'] += date_amount
-        date_total += date_amount
-        date_amount = Fringer.objects.filter(type=festival.paper_fringer_type, sale__festival = festival, sale__completed__date = date).aggregate(Sum('type__price'))['type__price__sum'] or 0
-        types['fringers']['dates'].append(date_amount)
-        types['fringers']['total'] += date_amount
-        date_total += date_amount
-        date_amount = Fringer.objects.filter(type__is_online=True, sale__festival = festival, sale__completed__date = date).aggregate(Sum('type__price'))['type__price__sum'] or 0
-        types['efringers']['dates'].append(date_amount)
-        types['efringers']['total'] += date_amount
-        date_total += date_amount
-        date_amount = Ticket.objects.filter(sale__festival = festival, sale__completed__date = date).aggregate(Sum('type__price'))['type__price__sum'] or 0
-        types['tickets']['dates'].append(date_amount)
-        types['tickets']['total'] += date_amount
-        date_total += date_amount
-        date_amount = PayAsYouWill.objects.filter(sale__festival = festival, sale__completed__date = date, fringer_id__isnull = True).aggregate(Sum('amount'))['amount__sum'] or 0
-        types['payw']['dates'].append(date_amount)
-        types['payw']['total'] += date_amount
-        date_total += date_amount
-        date_amount = Sale.objects.filter(festival = festival, completed__date = date).aggregate(Sum('donation'))['donation__sum'] or 0
-        types['donations']['dates'].append(date_amount)
-        types['donations']['total'] += date_amount
-        date_total += date_amount
-        totals['dates'].append(date_total)
-        totals['total'] += date_total
+    buttons = {'pre': 0, 'dates': [0] * len(dates), 'total': 0}
+    for sale in sales:
+        index = date_index.get(sale['completed__date'])
+        if index != None or sale['completed__date'] < dates[0]:
+            _add_summary_amount(buttons, index, sale['buttons_sum'] or 0)
+        if index != None:
+            _add_summary_amount(types['donations'], index, sale['donation_sum'] or 0)
+    types['buttons']['pre'] = festival.button_price * buttons['pre']
+    types['buttons']['dates'] = [festival.button_price * count for count in buttons['dates']]
+    types['buttons']['total'] = types['buttons']['pre'] + sum(types['buttons']['dates'])
+    for fringer in fringers:
+        index = date_index.get(fringer['sale__completed__date'])
+        if fringer['type__is_online'] and (index != None or fringer['sale__completed__date'] < dates[0]):
+            _add_summary_amount(types['efringers'], index, fringer['price_sum'] or 0)
+        if fringer['type_id'] == paper_fringer_type.id and index != None:
+            _add_summary_amount(types['fringers'], index, fringer['price_sum'] or 0)
+    for ticket in tickets:
+        index = date_index.get(ticket['sale__completed__date'])
+        if index != None or ticket['sale__completed__date'] < dates[0]:
+            _add_summary_amount(types['tickets'], index, ticket['price_sum'] or 0)
+    for payw in payws:
+        index = date_index.get(payw['sale__completed__date'])
+        if index != None:
+            _add_summary_amount(types['payw'], index, payw['boxoffice'] or 0)
     sales_by_type = {
         'dates': dates,
         'types': types,
-        'totals': totals,
+        'totals': _get_summary_totals(types.values(), len(dates)),
     }
 
     # Sales by payment
-    dates = date_list(festival.boxoffice_open, festival.boxoffice_close)
-    cash_pre = Sale.objects.filter(festival = festival, completed__lt=dates[0], transaction_type = Sale.TRANSACTION_TYPE_CASH).aggregate(Sum('amount'))['amount__sum'] or 0
-    stripe_pre = Sale.objects.filter(festival = festival, completed__lt=dates[0], transaction_type = Sale.TRANSACTION_TYPE_STRIPE).aggregate(Sum('amount'))['amount__sum'] or 0
-    squareup_pre = Sale.objects.filter(festival = festival, completed__lt=dates[0], transaction_type = Sale.TRANSACTION_TYPE_SQUAREUP).aggregate(Sum('amount'))['amount__sum'] or 0
     payments = OrderedDict([
-        ('cash', {'title': 'Cash', 'pre': cash_pre, 'dates': [], 'total': cash_pre}),
-        ('stripe', {'title': 'Stripe', 'pre': stripe_pre, 'dates': [], 'total': stripe_pre}),
-        ('squareup', {'title': 'SquareUp', 'pre': squareup_pre, 'dates': [], 'total': squareup_pre}),
+        ('cash', {'title': 'Cash', 'pre': 0, 'dates': [0] * len(dates), 'total': 0}),
+        ('stripe', {'title': 'Stripe', 'pre': 0, 'dates': [0] * len(dates), 'total': 0}),
+        ('squareup', {'title': 'SquareUp', 'pre': 0, 'dates': [0] * len(dates), 'total': 0}),
     ])
-    totals = {
-        'pre': cash_pre + stripe_pre + squareup_pre,
-        'dates': [],
-        'total': cash_pre + stripe_pre + squareup_pre,
+    payment_keys = {
+        Sale.TRANSACTION_TYPE_CASH: 'cash',
+        Sale.TRANSACTION_TYPE_STRIPE: 'stripe',
+        Sale.TRANSACTION_TYPE_SQUAREUP: 'squareup',
     }
-    for date in dates:
-        date_total = 0
-        date_amount = Sale.objects.filter(festival = festival, completed__date=date, transaction_type = Sale.TRANSACTION_TYPE_CASH).aggregate(Sum('amount'))['amount__sum'] or 0
-        payments['cash']['dates'].append(date_amount)
-        payments['cash']['total'] += date_amount
-        date_total += date_amount
-        date_amount = Sale.objects.filter(festival = festival, completed__date=date, transaction_type = Sale.TRANSACTION_TYPE_STRIPE).aggregate(Sum('amount'))['amount__sum'] or 0
-        payments['stripe']['dates'].append(date_amount)
-        payments['stripe']['total'] += date_amount
-        date_total += date_amount
-        date_amount = Sale.objects.filter(festival = festival, completed__date=date, transaction_type = Sale.TRANSACTION_TYPE_SQUAREUP).aggregate(Sum('amount'))['amount__sum'] or 0
-        payments['squareup']['dates'].append(date_amount)
-        payments['squareup']['total'] += date_amount
-        date_total += date_amount
-        totals['dates'].append(date_total)
-        totals['total'] += date_total
+    for sale in sales:
+        index = date_index.get(sale['completed__date'])
+        if sale['transaction_type'] in payment_keys and (index != None or sale['completed__date'] < dates[0]):
+            _add_summary_amount(payments[payment_keys[sale['transaction_type']]], index, sale['amount_sum'] or 0)
     sales_by_payment = {
         'dates': dates,
         'payments': payments,
-        'totals': totals,
+        'totals': _get_summary_totals(payments.values(), len(dates)),
     }
 
     # Bucket collections
-    first_performance = ShowPerformance.objects.filter(show__festival = festival, show__is_ticketed = False).order_by('date', 'time').first()
-    last_performance = ShowPerformance.objects.filter(show__festival = festival, show__is_ticketed = False).order_by('date', 'time').last()
-    dates = date_list(first_performance.date, last_performance.date)
+    performance_dates = ShowPerformance.objects.filter(show__festival = festival, show__is_ticketed = False).aggregate(Min('date'), Max('date'))
+    dates = date_list(performance_dates['date__min'], performance_dates['date__max'])
+    date_index = {date: index for index, date in enumerate(dates)}
     types = OrderedDict([
-        ('cash', {'title': 'Cash', 'dates': [], 'post': 0, 'total': 0}),
-        ('fringers', {'title': 'Paper fringers', 'dates': [], 'post': 0, 'total': 0}),
-        ('boxoffice', {'title': 'Box office', 'dates': [], 'post': 0, 'total': 0}),
-        ('efringers', {'title': 'eFringers', 'dates': [], 'post': 0, 'total': 0}),
-        ('cards', {'title': 'Card payments', 'dates': [], 'post': 0, 'total': 0}),
+        ('cash', {'title': 'Cash', 'dates': [0] * len(dates), 'post': 0, 'total': 0}),
+        ('fringers', {'title': 'Paper fringers', 'dates': [0] * len(dates), 'post': 0, 'total': 0}),
+        ('boxoffice', {'title': 'Box office', 'dates': [0] * len(dates), 'post': 0, 'total': 0}),
+        ('efringers', {'title': 'eFringers', 'dates': [0] * len(dates), 'post': 0, 'total': 0}),
+        ('cards', {'title': 'Card payments', 'dates': [0] * len(dates), 'post': 0, 'total': 0}),
     ])
+    fringer_buckets = 0
+    for bucket in Bucket.objects.filter(company__festival = festival).values('date').annotate(cash_sum = Sum('cash'), fringers_sum = Sum('fringers'), cards_sum = Sum('cards')).order_by():
+        fringer_buckets += bucket['fringers_sum'] or 0
+        index = date_index.get(bucket['date'])
+        if index != None:
+            for key, amount in (('cash', bucket['cash_sum'] or 0), ('fringers', 4 * (bucket['fringers_sum'] or 0)), ('cards', bucket['cards_sum'] or 0)):
+                types[key]['dates'][index] += amount
+                types[key]['total'] += amount
+    for payw in payws:
+        index = date_index.get(payw['sale__completed__date'])
+        if index != None:
+            for key, amount in (('boxoffice', payw['boxoffice'] or 0), ('efringers', payw['efringers'] or 0)):
+                types[key]['dates'][index] += amount
+                types[key]['total'] += amount
+        elif payw['sale__completed__date'] > dates[-1]:
+            types['efringers']['post'] += payw['efringers'] or 0
+            types['efringers']['total'] += payw['efringers'] or 0
     totals = {
-        'dates': [],
-        'post': 0,
-        'total': 0,
+        'dates': [sum(type['dates'][i] for type in types.values()) for i in range(len(dates))],
+        'post': types['efringers']['post'],
     }
-    for date in dates:
-        date_total = 0
-        date_amount = Bucket.objects.filter(company__festival = festival, date = date).aggregate(Sum('cash'))['cash__sum'] or 0
-        types['cash']['dates'].append(date_amount)
-        types['cash']['total'] += date_amount
-        date_total += date_amount
-        date_amount = 4 * (Bucket.objects.filter(company__festival = festival, date = date).aggregate(Sum('fringers'))['fringers__sum'] or 0)
-        types['fringers']['dates'].append(date_amount)
-        types['fringers']['total'] += date_amount
-        date_total += date_amount
-        date_amount = PayAsYouWill.objects.filter(sale__festival = festival, sale__completed__date = date, fringer_id__isnull = True).aggregate(Sum('amount'))['amount__sum'] or 0
-        types['boxoffice']['dates'].append(date_amount)
-        types['boxoffice']['total'] += date_amount
-        date_total += date_amount
-        date_amount = PayAsYouWill.objects.filter(sale__festival = festival, sale__completed__date = date, fringer_id__isnull = False).aggregate(Sum('amount'))['amount__sum'] or 0
-        types['efringers']['dates'].append(date_amount)
-        types['efringers']['total'] += date_amount
-        date_total += date_amount
-        date_amount = Bucket.objects.filter(company__festival = festival, date = date).aggregate(Sum('cards'))['cards__sum'] or 0
-        types['cards']['dates'].append(date_amount)
-        types['cards']['total'] += date_amount
-        date_total += date_amount
-        totals['dates'].append(date_total)
-        totals['total'] += date_total
-    efringers_post = PayAsYouWill.objects.filter(sale__festival = festival, sale__completed__date__gt = dates[-1], fringer_id__isnull = False).aggregate(Sum('amount'))['amount__sum'] or 0
-    types['efringers']['post'] = efringers_post
-    types['efringers']['total'] += efringers_post
-    totals['post'] = efringers_post
-    totals['total'] += efringers_post
+    totals['total'] = sum(totals['dates']) + totals['post']
     buckets = {
         'dates': dates,
         'types': types,
@@ -237,7 +219,7 @@ def festival_summary(request):
     }
 
     # Tickets
-    tickets = {
+    tickets_by_type = {
         'types': [],
         'totals': {
             'online': 0,
@@ -246,31 +228,32 @@ def festival_summary(request):
             'total': 0,
         }
     }
-    ticket_types = TicketType.objects.filter(festival=festival).order_by('seqno')
-    for ticket_type in ticket_types:
-        query = Ticket.objects.filter(type=ticket_type, sale__festival = festival, sale__completed__isnull = False, refund__isnull = True)
-        online = query.filter(sale__venue__isnull = True, sale__boxoffice__isnull = True).count() or 0
-        boxoffice = query.filter(sale__boxoffice__isnull = False).count() or 0
-        venue = query.filter(sale__venue__isnull = False).count() or 0
-        tickets['types'].append({
+    ticket_counts = defaultdict(lambda: {'active': 0, 'online': 0, 'boxoffice': 0, 'venue': 0})
+    efringer_tickets = 0
+    for ticket in tickets:
+        for key in ('active', 'online', 'boxoffice', 'venue'):
+            ticket_counts[ticket['type_id']][key] += ticket[key]
+        efringer_tickets += ticket['efringers']
+    for ticket_type in TicketType.objects.filter(festival=festival).order_by('seqno'):
+        counts = ticket_counts[ticket_type.id]
+        tickets_by_type['types'].append({
             'description': ticket_type.name,
-            'online': online,
-            'boxoffice': boxoffice,
-            'venue': venue,
-            'total': online + boxoffice + venue,
+            'online': counts['online'],
+            'boxoffice': counts['boxoffice'],
+            'venue': counts['venue'],
+            'total': counts['online'] + counts['boxoffice'] + counts['venue'],
         })
-        tickets['totals']['online'] += online
-        tickets['totals']['boxoffice'] += boxoffice
-        tickets['totals']['venue'] += venue
-        tickets['totals']['total'] += online + boxoffice + venue
+        tickets_by_type['totals']['online'] += counts['online']
+        tickets_by_type['totals']['boxoffice'] += counts['boxoffice']
+        tickets_by_type['totals']['venue'] += counts['venue']
+        tickets_by_type['totals']['total'] += counts['online'] + counts['boxoffice'] + counts['venue']
 
     # Paper fringers
-    fringers_sold = Fringer.objects.filter(type=festival.paper_fringer_type, sale__festival = festival, sale__completed__isnull = False).count() or 0
+    fringers_sold = sum(f['count'] for f in fringers if f['type_id'] == paper_fringer_type.id)
     fringer_total = 6 * fringers_sold
-    fringer_tickets = Ticket.objects.filter(type=festival.paper_fringer_type.ticket_type, sale__festival = festival, sale__completed__isnull = False, refund__isnull = True).count() or 0
-    fringer_buckets = Bucket.objects.filter(company__festival = festival).aggregate(Sum('fringers'))['fringers__sum'] or 0
+    fringer_tickets = ticket_counts[paper_fringer_type.ticket_type_id]['active']
     fringer_unused = fringer_total - fringer_tickets - fringer_buckets
-    fringers = {
+    fringers_use = {
         'sold': fringers_sold,
         'tickets': fringer_tickets,
         'tickets_pcent': ((100 * fringer_tickets) / fringer_total) if fringers_sold else 0,
@@ -281,12 +264,11 @@ def festival_summary(request):
     }
 
     # eFringers
-    efringers_sold = Fringer.objects.filter(type__is_online=True, sale__festival = festival, sale__completed__isnull = False).count() or 0
-    efringer_total = Fringer.objects.filter(type__is_online=True, sale__festival = festival, sale__completed__isnull = False).aggregate(Sum('type__shows'))['type__shows__sum'] or 0
-    efringer_tickets = Ticket.objects.filter(fringer__type__is_online=True, sale__festival = festival, sale__completed__isnull = False, refund__isnull = True).count() or 0
+    efringers_sold = sum(f['count'] for f in fringers if f['type__is_online'])
+    efringer_total = sum(f['shows_sum'] or 0 for f in fringers if f['type__is_online'])
     efringer_buckets = PayAsYouWill.objects.filter(show__festival = festival, sale__completed__isnull = False, fringer__isnull = False).count() or 0
     efringer_unused = efringer_total - efringer_tickets - efringer_buckets
-    efringers = {
+    efringers_use = {
         'sold':  efringers_sold,
         'tickets': efringer_tickets,
         'tickets_pcent': ((100 * efringer_tickets) / efringer_total) if efringers_sold else 0,
@@ -296,11 +278,15 @@ def festival_summary(request):
         'unused_pcent': ((100 * efringer_unused) / efringer_total) if efringers_sold else 0,
     }
 
-    # Volunteer tickets
+    # Volunteer tickets (comps earned are calculated as in User.volunteer_comps_earned)
+    comps = defaultdict(int)
+    for user_id, comps_per_shift in Shift.objects.filter(user__festival = festival, user__is_volunteer = True).values_list('user_id', 'role__comps_per_shift'):
+        comps[user_id] += comps_per_shift
     volunteers_earned = 0
-    for volunteer in User.objects.filter(festival=festival, is_volunteer=True):
-        volunteers_earned += volunteer.volunteer_comps_earned
-    volunteer_tickets = Ticket.objects.filter(type=festival.volunteer_ticket_type, sale__festival = festival, sale__completed__isnull = False, refund__isnull = True).count() or 0
+    for user_comps in comps.values():
+        user_comps = int(user_comps)
+        volunteers_earned += user_comps if festival.volunteer_comps == 0 else min(user_comps, festival.volunteer_comps)
+    volunteer_tickets = ticket_counts[festival.volunteer_ticket_type.id]['active']
     volunteer_unused = volunteers_earned - volunteer_tickets
     volunteers = {
         'earned': volunteers_earned,
@@ -312,22 +298,43 @@ def festival_summary(request):
         'unused_pcent': ((100 * volunteer_unused) / volunteers_earned) if volunteers_earned else 0,
     }
 
+    return {
+        'sales_by_channel': sales_by_channel,
+        'sales_by_type': sales_by_type,
+        'sales_by_payment': sales_by_payment,
+        'buckets': buckets,
+        'tickets': tickets_by_type,
+        'fringers': fringers_use,
+        'efringers': efringers_use,
+        'volunteers': volunteers,
+    }
+
+
+@require_GET
+@login_required
+@user_passes_test(lambda u: u.is_admin)
+def festival_summary(request):
+
+    # General stuff
+    festival = request.festival
+    boxoffice_list = [bo for bo in BoxOffice.objects.filter(festival=festival).order_by('name')]
+    venue_list = [v for v in Venue.objects.filter(festival=festival, is_ticketed=True).order_by('name')]
+    summary = _get_festival_summary(festival, boxoffice_list, venue_list)
+    sales_by_channel = summary['sales_by_channel']
+    sales_by_type = summary['sales_by_type']
+    sales_by_payment = summary['sales_by_payment']
+    buckets = summary['buckets']
+    tickets = summary['tickets']
+    fringers = summary['fringers']
+    efringers = summary['efringers']
+    volunteers = summary['volunteers']
+
     # Check for HTML
     format = request.GET['format']
     if format == 'HTML':
 
         # Render HTML
-        context = {
-            'sales_by_channel': sales_by_channel,
-            'sales_by_type': sales_by_type,
-            'sales_by_payment': sales_by_payment,
-            'buckets': buckets,
-            'tickets': tickets,
-            'fringers': fringers,
-            'efringers': efringers,
-            'volunteers': volunteers,
-        }
-        return render(request, 'reports/finance/festival_summary.html', context)
+        return render(request, 'reports/finance/festival_summary.html', summary)
 
     # Render PDF
     response = HttpResponse(content_type = 'application/pdf')
@@ -632,73 +639,8 @@ def boxoffice_summary(request):
     boxoffice = BoxOffice.objects.get(id = int(request.GET['boxoffice']))
     date = datetime.datetime.strptime(request.GET['date'], '%Y%m%d')
 
-    # First/last checkpoints
-    periods = []
-    first = Checkpoint.objects.filter(created__date = date, boxoffice = boxoffice).order_by('created').first()
-    last = Checkpoint.objects.filter(created__date = date, boxoffice = boxoffice).order_by('created').last()
-    if first and last and first != last:
-        sales_cash = Sale.objects.filter(boxoffice = boxoffice, completed__date = date, transaction_type = Sale.TRANSACTION_TYPE_CASH).aggregate(Sum('amount'))['amount__sum'] or 0
-        sales_card = Sale.objects.filter(boxoffice = boxoffice, completed__date = date, transaction_type = Sale.TRANSACTION_TYPE_SQUAREUP).aggregate(Sum('amount'))['amount__sum'] or 0
-        sales_fringers = Fringer.objects.filter(sale__boxoffice = boxoffice, sale__completed__date = date).count() or 0
-        sales_buttons = Sale.objects.filter(boxoffice = boxoffice, completed__date = date).aggregate(Sum('buttons'))['buttons__sum'] or 0
-        refunds_cash = Refund.objects.filter(boxoffice = boxoffice, completed__date = date).aggregate(Sum('amount'))['amount__sum'] or 0
-        periods.append({
-            'title': f"Daily Summary: {first.created.astimezone():%I:%M%p} to {last.created.astimezone():%I:%M%p}",
-            'open': first,
-            'close': last,
-            'sales': {
-                'cash': sales_cash,
-                'card': sales_card,
-                'fringers': sales_fringers,
-                'buttons': sales_buttons,
-            },
-            'refunds': {
-                'cash': refunds_cash,
-            },
-            'variance': {
-                'cash': last.cash - first.cash - sales_cash + refunds_cash,
-                'fringers': last.fringers - first.fringers + sales_fringers,
-                'buttons': last.buttons - first.buttons + sales_buttons,
-            },
-        })
-    else:
-        periods.append({
-            'title': 'Daily Summary',
-            'open': first,
-            'close': last,
-        })
-
-    # Intermediate checkpoints
-    prev_checkpoint = None
-    for checkpoint in boxoffice.checkpoints.filter(created__gte = date, created__lt = (date + datetime.timedelta(days = 1))).order_by('created'):
-        open = prev_checkpoint
-        close = checkpoint
-        if open and close:
-            sales_cash = Sale.objects.filter(boxoffice = boxoffice, completed__gt = open.created, completed__lt = close.created, transaction_type = Sale.TRANSACTION_TYPE_CASH).aggregate(Sum('amount'))['amount__sum'] or 0
-            sales_card = Sale.objects.filter(boxoffice = boxoffice, completed__gt = open.created, completed__lt = close.created, transaction_type = Sale.TRANSACTION_TYPE_SQUAREUP).aggregate(Sum('amount'))['amount__sum'] or 0
-            sales_fringers = Fringer.objects.filter(sale__boxoffice = boxoffice, sale__completed__gt = open.created, sale__completed__lt = close.created).count() or 0
-            sales_buttons = Sale.objects.filter(boxoffice = boxoffice, completed__gt = open.created, completed__lt = close.created).aggregate(Sum('buttons'))['buttons__sum'] or 0
-            refunds_cash = Refund.objects.filter(boxoffice = boxoffice, completed__gt = open.created, completed__lt = close.created).aggregate(Sum('amount'))['amount__sum'] or 0
-            periods.append({
-                'title': f"{open.created.astimezone():%I:%M%p} to {close.created.astimezone():%I:%M%p}",
-                'open': open,
-                'close': close,
-                'sales': {
-                    'cash': sales_cash,
-                    'card': sales_card,
-                    'fringers': sales_fringers,
-                    'buttons': sales_buttons,
-                },
-                'refunds': {
-                    'cash': refunds_cash,
-                },
-                'variance': {
-                    'cash': close.cash - open.cash - sales_cash + refunds_cash,
-                    'fringers': close.fringers - open.fringers + sales_fringers,
-                    'buttons': close.buttons - open.buttons + sales_buttons,
-                },
-            })
-        prev_checkpoint = checkpoint
+    # Reconcile checkpoints
+    periods = get_boxoffice_periods(boxoffice, date)
 
     # Check for HTML
     format = request.GET['format']
@@ -831,69 +773,8 @@ def venue_summary(request):
     venue = Venue.objects.get(id = int(request.GET['venue']))
     date = datetime.datetime.strptime(request.GET['date'], '%Y%m%d')
 
-    # First/last checkpoints
-    periods = []
-    first = Checkpoint.objects.filter(created__date = date, venue = venue).order_by('created').first()
-    last = Checkpoint.objects.filter(created__date = date, venue = venue).order_by('created').last()
-    if first and last and first != last:
-        sales_cash = Sale.objects.filter(venue = venue, completed__date = date, transaction_type = Sale.TRANSACTION_TYPE_CASH).aggregate(Sum('amount'))['amount__sum'] or 0
-        sales_card = Sale.objects.filter(venue = venue, completed__date = date, transaction_type = Sale.TRANSACTION_TYPE_SQUAREUP).aggregate(Sum('amount'))['amount__sum'] or 0
-        sales_fringers = Fringer.objects.filter(sale__venue = venue, sale__completed__date = date).count() or 0
-        sales_buttons = Sale.objects.filter(venue = venue, completed__date = date).aggregate(Sum('buttons'))['buttons__sum'] or 0
-        periods.append({
-            'title': f"Daily Summary: {first.created.astimezone():%I:%M%p} to {last.created.astimezone():%I:%M%p}",
-            'open': first,
-            'close': last,
-            'sales': {
-                'cash': sales_cash,
-                'card': sales_card,
-                'fringers': sales_fringers,
-                'buttons': sales_buttons,
-            },
-            'variance': {
-                'cash': last.cash - first.cash - sales_cash,
-                'fringers': last.fringers - first.fringers + sales_fringers,
-                'buttons': last.buttons - first.buttons + sales_buttons,
-            },
-        })
-    else:
-        periods.append({
-            'title': 'Daily Summary',
-            'open': first,
-            'close': last,
-        })
-
-    # Individual performances
-    for performance in ShowPerformance.objects.filter(venue = venue, date = date).order_by('time'):
-        open = performance.open_checkpoint if performance.has_open_checkpoint else None
-        close = performance.close_checkpoint if performance.has_close_checkpoint else None
-        if open and close:
-            sales_cash = Sale.objects.filter(venue = venue, completed__gt = open.created, completed__lt = close.created, transaction_type = Sale.TRANSACTION_TYPE_CASH).aggregate(Sum('amount'))['amount__sum'] or 0
-            sales_card = Sale.objects.filter(venue = venue, completed__gt = open.created, completed__lt = close.created, transaction_type = Sale.TRANSACTION_TYPE_SQUAREUP).aggregate(Sum('amount'))['amount__sum'] or 0
-            sales_fringers = Fringer.objects.filter(sale__venue = venue, sale__completed__gt = open.created, sale__completed__lt = close.created).count() or 0
-            sales_buttons = Sale.objects.filter(venue = venue, completed__gt = open.created, completed__lt = close.created).aggregate(Sum('buttons'))['buttons__sum'] or 0
-            periods.append({
-                'title': f"{performance.time:%I:%M%p} {performance.show.name}",
-                'open': open,
-                'close': close,
-                'sales': {
-                    'cash': sales_cash,
-                    'card': sales_card,
-                    'fringers': sales_fringers,
-                    'buttons': sales_buttons,
-                },
-                'variance': {
-                    'cash': close.cash - open.cash - sales_cash,
-                    'fringers': close.fringers - open.fringers + sales_fringers,
-                    'buttons': close.buttons - open.buttons + sales_buttons,
-                },
-            })
-        else:
-            periods.append({
-                'title': f"{performance.time:%I:%M%p} {performance.show.name}",
-                'open': open,
-                'close': close,
-            })
+    # Reconcile checkpoints
+    periods = get_venue_periods(venue, date)
 
     # Check for HTML
     format = request.GET['format']
@@ -195,7 +195,7 @@ def _get_performance_tickets_by_type(performance, ticket_types):
     tickets = {}
     for tt in ticket_types:
         tickets[tt.name] = Ticket.objects.filter(type=tt, performance = performance, sale__completed__isnull = False, refund__isnull = True).count()
-    tickets['Total'] = Ticket.objects.filter(performance = performance, sale__completed__isnull = False, refund__isnull = True).count()
+    tickets['Total'] = performance.tickets_confirmed()
     return {
         'date': performance.date,
         'time': performance.time,
@@ -315,7 +315,7 @@ def _get_performance_tickets_by_channel(performance, channels):
         elif c == 'Venue':
             query = query.filter(sale__venue__isnull = False)
         tickets[c] = query.count()
-    tickets['Total'] = Ticket.objects.filter(performance = performance, sale__completed__isnull = False, refund__isnull = True).count()
+    tickets['Total'] = performance.tickets_confirmed()
     return {
         'date': performance.date,
         'time': performance.time,
@@ -428,8 +428,8 @@ def _get_performance_audience(performance):
     return {
         'date': performance.date,
         'time': performance.time,
-        'tickets': Ticket.objects.filter(performance = performance, sale__completed__isnull = False, refund__isnull = True).count(),
-        'tokens_issued': Ticket.objects.filter(performance = performance, sale__completed__isnull = False, refund__isnull = True, token_issued = True).count(),
+        'tickets': performance.tickets_confirmed(),
+        'tokens_issued': performance.tokens_issued(),
         'tokens_collected': performance.audience,
     }
 
@@ -0,0 +1,179 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+from django.db.models.aggregates import Sum
+from django.utils import timezone
+
+from core.models import Festival, User
+from program.models import Company, Venue, Show, ShowPerformance
+from reports.reports.checkpoints import get_boxoffice_periods, get_venue_periods
+from tickets.models import BoxOffice, Checkpoint, Sale, Refund, FringerType, Fringer, TicketType
+
+
+def legacy_totals(sales, fringers, refunds, **window):
+
+    # Original per-window aggregates (used as the reference)
+    totals = {
+        'sales': {
+            'cash': sales.filter(transaction_type = Sale.TRANSACTION_TYPE_CASH, **window).aggregate(Sum('amount'))['amount__sum'] or 0,
+            'card': sales.filter(transaction_type = Sale.TRANSACTION_TYPE_SQUAREUP, **window).aggregate(Sum('amount'))['amount__sum'] or 0,
+            'fringers': fringers.filter(**{f'sale__{name}': value for name, value in window.items()}).count() or 0,
+            'buttons': sales.filter(**window).aggregate(Sum('buttons'))['buttons__sum'] or 0,
+        },
+    }
+    if refunds != None:
+        totals['refunds'] = {'cash': refunds.filter(**window).aggregate(Sum('amount'))['amount__sum'] or 0}
+    return totals
+
+def legacy_period(title, open, close, sales, fringers, refunds, **window):
+    if not window:
+        return {'title': title, 'open': open, 'close': close}
+    period = {'title': title, 'open': open, 'close': close, **legacy_totals(sales, fringers, refunds, **window)}
+    period['variance'] = {
+        'cash': close.cash - open.cash - period['sales']['cash'] + (period['refunds']['cash'] if refunds != None else 0),
+        'fringers': close.fringers - open.fringers + period['sales']['fringers'],
+        'buttons': close.buttons - open.buttons + period['sales']['buttons'],
+    }
+    return period
+
+def legacy_boxoffice_periods(boxoffice, date):
+    sales = Sale.objects.filter(boxoffice = boxoffice)
+    fringers = Fringer.objects.filter(sale__boxoffice = boxoffice)
+    refunds = Refund.objects.filter(boxoffice = boxoffice)
+    checkpoints = list(Checkpoint.objects.filter(created__date = date, boxoffice = boxoffice).order_by('created'))
+    first = checkpoints[0] if checkpoints else None
+    last = checkpoints[-1] if checkpoints else None
+    if first and last and first != last:
+        periods = [legacy_period(f"Daily Summary: {first.created.astimezone():%I:%M%p} to {last.created.astimezone():%I:%M%p}", first, last, sales, fringers, refunds, completed__date = date)]
+    else:
+        periods = [legacy_period('Daily Summary', first, last, sales, fringers, refunds)]
+    for open, close in zip(checkpoints, checkpoints[1:]):
+        periods.append(legacy_period(f"{open.created.astimezone():%I:%M%p} to {close.created.astimezone():%I:%M%p}", open, close, sales, fringers, refunds, completed__gt = open.created, completed__lt = close.created))
+    return periods
+
+def legacy_venue_periods(venue, date):
+    sales = Sale.objects.filter(venue = venue)
+    fringers = Fringer.objects.filter(sale__venue = venue)
+    checkpoints = list(Checkpoint.objects.filter(created__date = date, venue = venue).order_by('created'))
+    first = checkpoints[0] if checkpoints else None
+    last = checkpoints[-1] if checkpoints else None
+    if first and last and first != last:
+        periods = [legacy_period(f"Daily Summary: {first.created.astimezone():%I:%M%p} to {last.created.astimezone():%I:%M%p}", first, last, sales, fringers, None, completed__date = date)]
+    else:
+        periods = [legacy_period('Daily Summary', first, last, sales, fringers, None)]
+    for performance in ShowPerformance.objects.filter(venue = venue, date = date).order_by('time'):
+        open = performance.open_checkpoint if performance.has_open_checkpoint else None
+        close = performance.close_checkpoint if performance.has_close_checkpoint else None
+        title = f"{performance.time:%I:%M%p} {performance.show.name}"
+        if open and close:
+            periods.append(legacy_period(title, open, close, sales, fringers, None, completed__gt = open.created, completed__lt = close.created))
+        else:
+            periods.append(legacy_period(title, open, close, sales, fringers, None))
+    return periods
+
+
+DATE = datetime.date(2026, 6, 1)
+
+def at(hour, minute = 0, days = 0):
+    return timezone.make_aware(datetime.datetime.combine(DATE + datetime.timedelta(days = days), datetime.time(hour, minute)))
+
+@pytest.fixture
+def festival():
+    return Festival.objects.create(name = 'TEST', title = 'Test festival')
+
+@pytest.fixture
+def user(festival):
+    return User.objects.create_user(festival, 'staff@example.com', 'password')
+
+@pytest.fixture
+def fringer_type(festival):
+    ticket_type = TicketType.objects.create(festival = festival, name = 'Fringer')
+    return FringerType.objects.create(festival = festival, name = 'Paper', shows = 6, ticket_type = ticket_type)
+
+def checkpoint(user, created, cash, **kwargs):
+    checkpoint = Checkpoint.objects.create(user = user, cash = Decimal(cash), buttons = 20, fringers = 10, **kwargs)
+    Checkpoint.objects.filter(pk = checkpoint.pk).update(created = created)
+    checkpoint.refresh_from_db()
+    return checkpoint
+
+def sale(user, fringer_type, completed, amount, transaction_type = Sale.TRANSACTION_TYPE_CASH, fringers = 0, **kwargs):
+    sale = Sale.objects.create(festival = user.festival, user = user, completed = completed, amount = Decimal(amount), transaction_type = transaction_type, buttons = 1, **kwargs)
+    for i in range(fringers):
+        Fringer.objects.create(type = fringer_type, sale = sale)
+    return sale
+
+def refund(user, completed, amount, **kwargs):
+    return Refund.objects.create(festival = user.festival, user = user, completed = completed, amount = Decimal(amount), **kwargs)
+
+
+@pytest.mark.django_db
+def test_boxoffice_periods_match_legacy(festival, user, fringer_type):
+
+    boxoffice = BoxOffice.objects.create(festival = festival, name = 'Box office')
+    checkpoints = [checkpoint(user, at(hour), cash, boxoffice = boxoffice) for hour, cash in ((9, '50.00'), (13, '80.00'), (18, '95.00'))]
+
+    # Sales and refunds inside windows, on the checkpoints and at the ends of the day
+    for completed, amount, transaction_type, fringers in (
+        (at(0), '1.00', Sale.TRANSACTION_TYPE_CASH, 1),
+        (at(9), '2.00', Sale.TRANSACTION_TYPE_CASH, 0),
+        (at(10), '4.00', Sale.TRANSACTION_TYPE_CASH, 2),
+        (at(11), '8.00', Sale.TRANSACTION_TYPE_SQUAREUP, 1),
+        (at(13), '16.00', Sale.TRANSACTION_TYPE_CASH, 0),
+        (at(15), '32.00', Sale.TRANSACTION_TYPE_SQUAREUP, 0),
+        (at(18), '64.00', Sale.TRANSACTION_TYPE_CASH, 1),
+        (at(23, 59), '128.00', Sale.TRANSACTION_TYPE_CASH, 0),
+        (at(0, days = 1), '256.00', Sale.TRANSACTION_TYPE_CASH, 0),
+        (at(23, 59, days = -1), '512.00', Sale.TRANSACTION_TYPE_CASH, 0),
+    ):
+        sale(user, fringer_type, completed, amount, transaction_type, fringers, boxoffice = boxoffice)
+    for completed, amount in ((at(9), '0.25'), (at(12), '0.50'), (at(13), '1.25'), (at(0, days = 1), '2.50')):
+        refund(user, completed, amount, boxoffice = boxoffice)
+
+    # Incomplete sales and other box offices are ignored
+    sale(user, fringer_type, None, '100.00', boxoffice = boxoffice)
+    sale(user, fringer_type, at(10), '100.00', boxoffice = BoxOffice.objects.create(festival = festival, name = 'Other'))
+
+    periods = get_boxoffice_periods(boxoffice, DATE)
+    assert periods == legacy_boxoffice_periods(boxoffice, DATE)
+    assert [p['sales']['cash'] for p in periods] == [Decimal('215.00'), Decimal('4.00'), 0]
+
+@pytest.mark.django_db
+def test_boxoffice_periods_without_checkpoints(festival, user, fringer_type):
+
+    # A single checkpoint (or none) gives a daily summary without totals
+    boxoffice = BoxOffice.objects.create(festival = festival, name = 'Box office')
+    sale(user, fringer_type, at(10), '4.00', boxoffice = boxoffice)
+    assert get_boxoffice_periods(boxoffice, DATE) == legacy_boxoffice_periods(boxoffice, DATE)
+    checkpoint(user, at(9), '50.00', boxoffice = boxoffice)
+    assert get_boxoffice_periods(boxoffice, DATE) == legacy_boxoffice_periods(boxoffice, DATE)
+
+@pytest.mark.django_db
+def test_venue_periods_match_legacy(festival, user, fringer_type):
+
+    venue = Venue.objects.create(festival = festival, name = 'Venue', is_ticketed = True, capacity = 50)
+    company = Company.objects.create(festival = festival, name = 'Company')
+    show = Show.objects.create(festival = festival, company = company, name = 'Show', is_ticketed = True)
+    performances = [ShowPerformance.objects.create(show = show, venue = venue, date = DATE, time = datetime.time(hour, 0)) for hour in (14, 19, 22)]
+
+    # Afternoon and evening performances open and closed, the late one still open
+    checkpoint(user, at(13, 30), '20.00', venue = venue, open_performance = performances[0])
+    checkpoint(user, at(15, 30), '40.00', venue = venue, close_performance = performances[0])
+    checkpoint(user, at(18, 30), '40.00', venue = venue, open_performance = performances[1])
+    checkpoint(user, at(20, 30), '70.00', venue = venue, close_performance = performances[1])
+    checkpoint(user, at(21, 30), '70.00', venue = venue, open_performance = performances[2])
+    for completed, amount, transaction_type, fringers in (
+        (at(13, 30), '1.00', Sale.TRANSACTION_TYPE_CASH, 0),
+        (at(14), '2.00', Sale.TRANSACTION_TYPE_CASH, 1),
+        (at(15), '4.00', Sale.TRANSACTION_TYPE_SQUAREUP, 0),
+        (at(15, 30), '8.00', Sale.TRANSACTION_TYPE_CASH, 0),
+        (at(19), '16.00', Sale.TRANSACTION_TYPE_CASH, 2),
+        (at(20, 30), '32.00', Sale.TRANSACTION_TYPE_CASH, 0),
+        (at(21, 45), '64.00', Sale.TRANSACTION_TYPE_CASH, 0),
+        (at(0, days = 1), '128.00', Sale.TRANSACTION_TYPE_CASH, 0),
+    ):
+        sale(user, fringer_type, completed, amount, transaction_type, fringers, venue = venue)
+
+    periods = get_venue_periods(venue, DATE)
+    assert periods == legacy_venue_periods(venue, DATE)
+    assert [p.get('sales', {}).get('cash') for p in periods] == [Decimal('123.00'), Decimal('2.00'), Decimal('16.00'), None]
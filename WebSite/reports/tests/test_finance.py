@@ -0,0 +1,212 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.models import Festival, User
+from program.models import Company, Venue, Show, ShowPerformance
+from reports.reports.finance import _get_festival_summary
+from tickets.models import BoxOffice, Sale, Refund, FringerType, Fringer, TicketType, Ticket, PayAsYouWill, Bucket
+from volunteers.models import Location, Role, Shift
+
+
+def completed(date, hour = 12):
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time(hour, 0)))
+
+def create_festival(name, venue_count):
+
+    # Festival with box office open for three days
+    open_date = datetime.date(2026, 6, 1)
+    festival = Festival.objects.create(name = name, title = 'Test festival', button_price = Decimal('2.00'), volunteer_comps = 4, boxoffice_open = open_date, boxoffice_close = open_date + datetime.timedelta(days = 2))
+    adult = TicketType.objects.create(festival = festival, name = 'Adult', seqno = 1, price = Decimal('8.00'))
+    fringer_ticket = TicketType.objects.create(festival = festival, name = 'Fringer', seqno = 2, price = Decimal('0.00'))
+    volunteer_ticket = TicketType.objects.create(festival = festival, name = 'Volunteer', seqno = 3, price = Decimal('0.00'))
+    paper = FringerType.objects.create(festival = festival, name = 'Paper', shows = 6, price = Decimal('20.00'), is_online = False, ticket_type = fringer_ticket)
+    online = FringerType.objects.create(festival = festival, name = 'eFringer', shows = 6, price = Decimal('18.00'), is_online = True, ticket_type = fringer_ticket)
+    boxoffices = [BoxOffice.objects.create(festival = festival, name = f'BoxOffice {i}') for i in range(2)]
+    venues = [Venue.objects.create(festival = festival, name = f'Venue {i}', is_ticketed = True, capacity = 100) for i in range(venue_count)]
+    company = Company.objects.create(festival = festival, name = 'Company')
+    show = Show.objects.create(festival = festival, company = company, name = 'Ticketed', is_ticketed = True)
+    performances = [ShowPerformance.objects.create(show = show, venue = venue, date = open_date, time = datetime.time(10 + i, 0)) for i, venue in enumerate(venues)]
+    bucket_show = Show.objects.create(festival = festival, company = company, name = 'Buckets', is_ticketed = False)
+    for day in range(3):
+        ShowPerformance.objects.create(show = bucket_show, venue = venues[0], date = open_date + datetime.timedelta(days = day), time = datetime.time(12, 0))
+    user = User.objects.create_user(festival, 'customer@example.com', 'password')
+
+    # Sales over the presale period, the box office dates and after close
+    channels = [{}] + [{'boxoffice': bo} for bo in boxoffices] + [{'venue': v} for v in venues] + [{'boxoffice': boxoffices[0], 'venue': venues[0]}]
+    transaction_types = [Sale.TRANSACTION_TYPE_CASH, Sale.TRANSACTION_TYPE_STRIPE, Sale.TRANSACTION_TYPE_SQUAREUP, None]
+    n = 0
+    for day in range(-2, 5):
+        for channel in channels:
+            n += 1
+            sale = Sale.objects.create(festival = festival, user = user, buttons = n % 3, donation = n % 4, amount = Decimal(n) + Decimal('0.50'), transaction_type = transaction_types[n % 4], completed = completed(open_date + datetime.timedelta(days = day), 9 + n % 12), **channel)
+            Ticket.objects.create(sale = sale, user = user, performance = performances[n % venue_count], type = adult)
+            refunded = Ticket.objects.create(sale = sale, user = user, performance = performances[n % venue_count], type = adult)
+            if n % 5 == 0:
+                refunded.refund = Refund.objects.create(festival = festival, user = user, reason = 'Test', completed = sale.completed)
+                refunded.save()
+            fringer = Fringer.objects.create(user = user, type = online if n % 2 else paper, name = f'F{n}', sale = sale)
+            Ticket.objects.create(sale = sale, user = user, performance = performances[0], type = fringer_ticket, fringer = fringer if fringer.type == online else None)
+            if n % 3 == 0:
+                Ticket.objects.create(sale = sale, user = user, performance = performances[0], type = volunteer_ticket)
+            PayAsYouWill.objects.create(sale = sale, show = bucket_show, amount = n % 5 + 1, fringer = fringer if n % 2 else None)
+    Sale.objects.create(festival = festival, user = user, amount = Decimal('99.00'), transaction_type = Sale.TRANSACTION_TYPE_CASH)
+
+    # Bucket collections
+    for day in range(3):
+        Bucket.objects.create(date = open_date + datetime.timedelta(days = day), company = company, show = bucket_show, cash = Decimal(day + 10), fringers = day + 1, cards = Decimal(day + 5))
+
+    # Volunteers
+    location = Location.objects.create(festival = festival, description = 'Front of house')
+    role = Role.objects.create(festival = festival, description = 'Usher', comps_per_shift = 1.5)
+    for i in range(3):
+        volunteer = User.objects.create_user(festival, f'volunteer{i}@example.com', 'password', is_volunteer = True)
+        for day in range(i + 2):
+            Shift.objects.create(location = location, role = role, user = volunteer, date = open_date + datetime.timedelta(days = day), start_time = datetime.time(10 + i, 0), end_time = datetime.time(11 + i, 0))
+    return festival
+
+def get_lists(festival):
+    boxoffice_list = list(BoxOffice.objects.filter(festival = festival).order_by('name'))
+    venue_list = list(Venue.objects.filter(festival = festival, is_ticketed = True).order_by('name'))
+    return boxoffice_list, venue_list
+
+
+@pytest.fixture
+def festival():
+
+    # Box office open for two days with one box office, one venue and one bucket show
+    open_date = datetime.date(2026, 6, 1)
+    festival = Festival.objects.create(name = 'TEST', title = 'Test festival', button_price = Decimal('2.00'), volunteer_comps = 4, boxoffice_open = open_date, boxoffice_close = open_date + datetime.timedelta(days = 1))
+    adult = TicketType.objects.create(festival = festival, name = 'Adult', seqno = 1, price = Decimal('8.00'))
+    fringer_ticket = TicketType.objects.create(festival = festival, name = 'Fringer', seqno = 2, price = Decimal('0.00'))
+    efringer_ticket = TicketType.objects.create(festival = festival, name = 'eFringer', seqno = 3, price = Decimal('0.00'))
+    volunteer_ticket = TicketType.objects.create(festival = festival, name = 'Volunteer', seqno = 4, price = Decimal('0.00'))
+    paper = FringerType.objects.create(festival = festival, name = 'Paper', shows = 6, price = Decimal('20.00'), is_online = False, ticket_type = fringer_ticket)
+    online = FringerType.objects.create(festival = festival, name = 'eFringer', shows = 6, price = Decimal('18.00'), is_online = True, ticket_type = efringer_ticket)
+    boxoffice = BoxOffice.objects.create(festival = festival, name = 'BoxOffice')
+    venue = Venue.objects.create(festival = festival, name = 'Venue', is_ticketed = True, capacity = 100)
+    company = Company.objects.create(festival = festival, name = 'Company')
+    show = Show.objects.create(festival = festival, company = company, name = 'Ticketed', is_ticketed = True)
+    performance = ShowPerformance.objects.create(show = show, venue = venue, date = open_date, time = datetime.time(19, 0))
+    bucket_show = Show.objects.create(festival = festival, company = company, name = 'Buckets', is_ticketed = False)
+    for day in range(2):
+        ShowPerformance.objects.create(show = bucket_show, venue = venue, date = open_date + datetime.timedelta(days = day), time = datetime.time(12, 0))
+    user = User.objects.create_user(festival, 'customer@example.com', 'password')
+
+    # Online presale (Stripe): adult ticket and eFringer
+    sale = Sale.objects.create(festival = festival, user = user, amount = Decimal('26.00'), transaction_type = Sale.TRANSACTION_TYPE_STRIPE, completed = completed(datetime.date(2026, 5, 30)))
+    Ticket.objects.create(sale = sale, user = user, performance = performance, type = adult)
+    efringer = Fringer.objects.create(user = user, type = online, name = 'F1', sale = sale)
+
+    # Box office on the first day (cash): badge, donation, paper fringer and a ticket using it, adult ticket and PAYW
+    sale = Sale.objects.create(festival = festival, user = user, boxoffice = boxoffice, amount = Decimal('35.00'), buttons = 1, donation = 2, transaction_type = Sale.TRANSACTION_TYPE_CASH, completed = completed(open_date))
+    Fringer.objects.create(type = paper, sale = sale)
+    Ticket.objects.create(sale = sale, user = user, performance = performance, type = fringer_ticket)
+    Ticket.objects.create(sale = sale, user = user, performance = performance, type = adult)
+    PayAsYouWill.objects.create(sale = sale, show = bucket_show, amount = 3)
+
+    # Venue on the second day (SquareUp): two adult tickets, one refunded
+    sale = Sale.objects.create(festival = festival, user = user, venue = venue, amount = Decimal('16.00'), transaction_type = Sale.TRANSACTION_TYPE_SQUAREUP, completed = completed(open_date + datetime.timedelta(days = 1), 18))
+    Ticket.objects.create(sale = sale, user = user, performance = performance, type = adult)
+    Ticket.objects.create(sale = sale, user = user, performance = performance, type = adult, refund = Refund.objects.create(festival = festival, user = user, reason = 'Test', completed = sale.completed))
+
+    # Online on the second day and after the box office closes: eFringer and volunteer tickets and eFringer PAYW
+    sale = Sale.objects.create(festival = festival, user = user, transaction_type = Sale.TRANSACTION_TYPE_STRIPE, completed = completed(open_date + datetime.timedelta(days = 1), 10))
+    Ticket.objects.create(sale = sale, user = user, performance = performance, type = efringer_ticket, fringer = efringer)
+    Ticket.objects.create(sale = sale, user = user, performance = performance, type = volunteer_ticket)
+    PayAsYouWill.objects.create(sale = sale, show = bucket_show, amount = 2, fringer = efringer)
+    sale = Sale.objects.create(festival = festival, user = user, transaction_type = Sale.TRANSACTION_TYPE_STRIPE, completed = completed(open_date + datetime.timedelta(days = 3)))
+    PayAsYouWill.objects.create(sale = sale, show = bucket_show, amount = 1, fringer = efringer)
+
+    # Incomplete sales are ignored
+    Sale.objects.create(festival = festival, user = user, amount = Decimal('99.00'), transaction_type = Sale.TRANSACTION_TYPE_CASH)
+
+    # Bucket collection on the first day
+    Bucket.objects.create(date = open_date, company = company, show = bucket_show, cash = Decimal('10.00'), fringers = 1, cards = Decimal('5.00'))
+
+    # Volunteer with three shifts at 1.5 comps each (limited to 4)
+    location = Location.objects.create(festival = festival, description = 'Front of house')
+    role = Role.objects.create(festival = festival, description = 'Usher', comps_per_shift = 1.5)
+    volunteer = User.objects.create_user(festival, 'volunteer@example.com', 'password', is_volunteer = True)
+    for day in range(3):
+        Shift.objects.create(location = location, role = role, user = volunteer, date = open_date + datetime.timedelta(days = day), start_time = datetime.time(10, 0), end_time = datetime.time(11, 0))
+    return Festival.objects.get(pk = festival.pk)
+
+def rows(rows):
+    return {key: (row.get('pre'), row['dates'], row.get('post'), row['total']) for key, row in rows.items()}
+
+@pytest.mark.django_db
+def test_festival_summary(festival):
+
+    summary = _get_festival_summary(festival, *get_lists(festival))
+    dates = [datetime.date(2026, 6, 1), datetime.date(2026, 6, 2)]
+
+    # Sales by channel, type and payment (presales, each box office date and totals)
+    channel = summary['sales_by_channel']
+    assert channel['dates'] == dates
+    assert rows({'online': channel['online'], **channel['boxoffices'], **channel['venues'], 'totals': channel['totals']}) == {
+        'online': (26, [0, 0], None, 26),
+        'BoxOffice': (0, [35, 0], None, 35),
+        'Venue': (None, [0, 16], None, 16),
+        'totals': (26, [35, 16], None, 77),
+    }
+    assert rows({**summary['sales_by_type']['types'], 'totals': summary['sales_by_type']['totals']}) == {
+        'buttons': (0, [2, 0], None, 2),
+        'fringers': (0, [20, 0], None, 20),
+        'efringers': (18, [0, 0], None, 18),
+        'tickets': (8, [8, 16], None, 32),
+        'payw': (0, [3, 0], None, 3),
+        'donations': (0, [2, 0], None, 2),
+        'totals': (26, [35, 16], None, 77),
+    }
+    assert rows({**summary['sales_by_payment']['payments'], 'totals': summary['sales_by_payment']['totals']}) == {
+        'cash': (0, [35, 0], None, 35),
+        'stripe': (26, [0, 0], None, 26),
+        'squareup': (0, [0, 16], None, 16),
+        'totals': (26, [35, 16], None, 77),
+    }
+
+    # Bucket collections over the bucket show dates (eFringer PAYW after the last date is added at the end)
+    buckets = summary['buckets']
+    assert buckets['dates'] == dates
+    assert rows({**buckets['types'], 'totals': buckets['totals']}) == {
+        'cash': (None, [10, 0], 0, 10),
+        'fringers': (None, [4, 0], 0, 4),
+        'boxoffice': (None, [3, 0], 0, 3),
+        'efringers': (None, [0, 2], 1, 3),
+        'cards': (None, [5, 0], 0, 5),
+        'totals': (None, [22, 2], 1, 25),
+    }
+
+    # Tickets by type and channel (refunded tickets are not counted)
+    assert [(t['description'], t['online'], t['boxoffice'], t['venue'], t['total']) for t in summary['tickets']['types']] == [
+        ('Adult', 1, 1, 1, 3),
+        ('Fringer', 0, 1, 0, 1),
+        ('eFringer', 1, 0, 0, 1),
+        ('Volunteer', 1, 0, 0, 1),
+    ]
+    assert summary['tickets']['totals'] == {'online': 3, 'boxoffice': 2, 'venue': 1, 'total': 6}
+
+    # Use of paper fringers, eFringers and volunteer comps
+    assert summary['fringers'] == {'sold': 1, 'tickets': 1, 'tickets_pcent': pytest.approx(100 / 6), 'buckets': 1, 'buckets_pcent': pytest.approx(100 / 6), 'unused': 4, 'unused_pcent': pytest.approx(400 / 6)}
+    assert summary['efringers'] == {'sold': 1, 'tickets': 1, 'tickets_pcent': pytest.approx(100 / 6), 'buckets': 2, 'buckets_pcent': pytest.approx(200 / 6), 'unused': 3, 'unused_pcent': 50}
+    assert summary['volunteers'] == {'earned': 4, 'tickets': 1, 'tickets_pcent': 25, 'buckets': 0, 'buckets_pcent': 0, 'unused': 3, 'unused_pcent': 75}
+
+@pytest.mark.django_db
+def test_festival_summary_query_count():
+
+    # Query count is the same however many venues (and dates) there are
+    counts = []
+    for venue_count in (1, 6):
+        festival = create_festival(f'TEST{venue_count}', venue_count)
+        boxoffice_list, venue_list = get_lists(festival)
+        festival = Festival.objects.get(pk = festival.pk)
+        with CaptureQueriesContext(connection) as queries:
+            _get_festival_summary(festival, boxoffice_list, venue_list)
+        counts.append(len(queries))
+    assert counts[0] == counts[1]
+    assert counts[0] <= 15
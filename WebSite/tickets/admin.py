@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from .models import BoxOffice, Basket, FringerType, Fringer, TicketType, Ticket, Sale, Refund, Donation, Checkpoint
+from .payments import NEEDS_REFUND
 from core.models import Festival
 from program.models import Venue
 
@@ -54,6 +55,21 @@ class SaleTypeListFilter(admin.SimpleListFilter):
         return queryset
 
 
+class SaleRefundListFilter(admin.SimpleListFilter):
+
+    title = 'Refund'
+    parameter_name = 'refund'
+
+    def lookups(self, request, model_admin):
+        return [('needed', 'Needs refund')]
+
+    def queryset(self, request, queryset):
+        # Cancelled sales that were paid for later (see tickets.payments.complete_sale)
+        if self.value() == 'needed':
+            return queryset.filter(cancelled__isnull = False, notes__contains = NEEDS_REFUND)
+        return queryset
+
+
 class SaleTicketsInline(admin.TabularInline):
 
     model = Ticket
@@ -81,11 +97,11 @@ class SaleAdmin(admin.ModelAdmin):
     model = Sale
     date_hierarchy = 'created'
     search_fields = ['id', 'customer']
-    fields = ['id', 'created', 'updated', 'user', 'boxoffice', 'venue', 'customer', 'buttons', 'amount', 'completed', 'cancelled', 'transaction_type', 'transaction_fee', 'transaction_ID']
+    fields = ['id', 'created', 'updated', 'user', 'boxoffice', 'venue', 'customer', 'buttons', 'amount', 'completed', 'cancelled', 'transaction_type', 'transaction_fee', 'transaction_ID', 'notes']
     readonly_fields = ['id', 'created', 'updated']
     autocomplete_fields = ['user']
-    list_display = ('id', 'customer', 'sale_type', 'amount', 'completed')
-    list_filter = [SaleTypeListFilter]
+    list_display = ('id', 'customer', 'sale_type', 'amount', 'completed', 'cancelled')
+    list_filter = [SaleTypeListFilter, SaleRefundListFilter]
     #inlines = [SaleTicketsInline, SaleFringersInline]
     inlines = [SaleTicketsInline]
 
@@ -0,0 +1,88 @@
+from collections import Counter, defaultdict
+
+from django.db.models import Count
+
+from .context_processors import basket_changed
+from .entitlements import COMP_TICKETS, is_comp, record
+from .inventory import ticket_counters, adjust
+from .models import Ticket, Fringer
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Bulk ticket operations
+#
+# Adding several tickets to a basket or sale and moving a basket to a sale (and back) are done
+# with one INSERT or UPDATE rather than saving each ticket and fringer. Bulk operations do not
+# send the model signals so the performance counters (see tickets.inventory) and volunteer comps
+# (see tickets.entitlements) are adjusted here and the basket summary is marked as changed.
+def create_tickets(performance, ticket_type, quantity, user, basket = None, sale = None):
+
+    # Insert the tickets
+    tickets = Ticket.objects.bulk_create([
+        Ticket(
+            performance = performance,
+            type = ticket_type,
+            user = user,
+            basket = basket,
+            sale = sale,
+        )
+        for i in range(quantity)
+    ])
+
+    # Update counters
+    if sale:
+        counters = ticket_counters(sale.id, sale.completed, None, False)
+        adjust(performance.id, **{name: count * quantity for name, count in counters.items()})
+        if sale.completed and user and is_comp(ticket_type.name, ticket_type.festival_id, user.festival_id):
+            record(user.id, f'Sale {sale.id}', comps_used = quantity)
+    basket_changed()
+    return tickets
+
+def move_tickets(tickets, basket = None, sale = None):
+
+    # Count the tickets being moved by their current counters
+    groups = list(tickets.values('performance_id', 'sale_id', 'sale__completed', 'refund_id', 'token_issued').annotate(count = Count('id')).order_by())
+    comps = list(tickets.filter(COMP_TICKETS).values('user_id', 'sale__completed').annotate(count = Count('id')).order_by())
+
+    # Move them all with a single update
+    moved = tickets.update(basket = basket, sale = sale)
+
+    # Move the tickets from their old counters to the new ones
+    changes = defaultdict(Counter)
+    for group in groups:
+        old = ticket_counters(group['sale_id'], group['sale__completed'], group['refund_id'], group['token_issued'])
+        new = ticket_counters(sale.id if sale else None, sale.completed if sale else None, group['refund_id'], group['token_issued'])
+        for name in new:
+            changes[group['performance_id']][name] += (new[name] - old[name]) * group['count']
+    for performance_id, deltas in changes.items():
+        adjust(performance_id, **deltas)
+
+    # Volunteer comps are used while their tickets are in a completed sale
+    completed = sale != None and sale.completed != None
+    for comp in comps:
+        used = int(completed) - int(comp['sale__completed'] != None)
+        record(comp['user_id'], f'Sale {sale.id}' if sale else 'Basket', comps_used = used * comp['count'])
+    basket_changed()
+    return moved
+
+def move_fringers(fringers, basket = None, sale = None):
+    moved = fringers.update(basket = basket, sale = sale)
+    basket_changed()
+    return moved
+
+def move_basket_to_sale(basket, sale):
+
+    # Move basket tickets and fringers to the sale
+    tickets = move_tickets(Ticket.objects.filter(basket = basket), sale = sale)
+    fringers = move_fringers(Fringer.objects.filter(basket = basket), sale = sale)
+    logger.info(f"{tickets} tickets and {fringers} eFringers moved from basket {basket.user_id} to sale {sale.id}")
+
+def move_sale_to_basket(sale, basket):
+
+    # Return sale tickets and fringers to the basket
+    tickets = move_tickets(Ticket.objects.filter(sale = sale), basket = basket)
+    fringers = move_fringers(Fringer.objects.filter(sale = sale), basket = basket)
+    logger.info(f"{tickets} tickets and {fringers} eFringers returned from sale {sale.id} to basket {basket.user_id}")
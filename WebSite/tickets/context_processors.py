@@ -0,0 +1,65 @@
+from itertools import count
+
+from django.db.models import Count, DecimalField, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils.functional import SimpleLazyObject
+
+from .models import Basket, Ticket, Fringer
+
+# Basket summary
+#
+# The page header shows the basket contents on every page so the summary is calculated by a
+# single query and kept on the request. Any basket, ticket or fringer change (see tickets.signals)
+# moves the generation on so a summary calculated before the change is not reused.
+_generation = count()
+_current_generation = next(_generation)
+
+def basket_changed():
+    global _current_generation
+    _current_generation = next(_generation)
+
+def _basket_subquery(queryset, aggregate, output_field):
+    return Coalesce(Subquery(queryset.filter(basket_id = OuterRef('pk')).order_by().values('basket_id').annotate(total = aggregate).values('total')), 0, output_field = output_field)
+
+def get_basket_summary(user):
+
+    # Get counts and costs for the basket in one query
+    basket = Basket.objects.filter(user_id = user.id).annotate(
+        ticket_count = _basket_subquery(Ticket.objects.all(), Count('id'), IntegerField()),
+        ticket_cost = _basket_subquery(Ticket.objects.all(), Sum('type__price'), DecimalField(max_digits = 8, decimal_places = 2)),
+        fringer_count = _basket_subquery(Fringer.objects.all(), Count('id'), IntegerField()),
+        fringer_cost = _basket_subquery(Fringer.objects.all(), Sum('type__price'), DecimalField(max_digits = 8, decimal_places = 2)),
+    ).values('buttons', 'ticket_count', 'ticket_cost', 'fringer_count', 'fringer_cost', 'user__festival__button_price').first()
+    if not basket:
+        basket = {'buttons': 0, 'ticket_count': 0, 'ticket_cost': 0, 'fringer_count': 0, 'fringer_cost': 0, 'user__festival__button_price': 0}
+    button_cost = basket['buttons'] * (basket['user__festival__button_price'] or 0)
+    total_count = basket['ticket_count'] + basket['fringer_count'] + basket['buttons']
+    return {
+        'ticket_count': basket['ticket_count'],
+        'fringer_count': basket['fringer_count'],
+        'buttons': basket['buttons'],
+        'total_count': total_count,
+        'is_empty': total_count == 0,
+        'ticket_cost': basket['ticket_cost'],
+        'fringer_cost': basket['fringer_cost'],
+        'button_cost': button_cost,
+        'total_cost': basket['ticket_cost'] + basket['fringer_cost'] + button_cost,
+    }
+
+def _get_request_summary(request):
+
+    # Reuse the summary for this request unless the basket has changed
+    generation, summary = getattr(request, '_basket_summary', (None, None))
+    if generation != _current_generation:
+        generation = _current_generation
+        summary = get_basket_summary(request.user)
+        request._basket_summary = (generation, summary)
+    return summary
+
+def basket(request):
+
+    # Basket summary for logged in users (only calculated if used)
+    user = getattr(request, 'user', None)
+    if not (user and user.is_authenticated):
+        return {}
+    return {'basket_summary': SimpleLazyObject(lambda: _get_request_summary(request))}
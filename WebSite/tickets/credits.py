@@ -0,0 +1,38 @@
+from django.db.models import F
+
+from .models import Fringer, Ticket
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Fringer credits
+#
+# Each fringer holds its remaining credits, maintained by the signal handlers in tickets.signals
+# as tickets and PAYW donations are added, refunded or removed. Redeeming a credit is a
+# conditional decrement: the UPDATE only succeeds if a credit remains and it locks the fringer
+# row until the caller's transaction commits, so a concurrent redemption of the same fringer
+# waits and then sees this one. The ticket or donation created for the redemption must be
+# marked as redeemed (see mark_redeemed) so the signal handlers do not take the credit again.
+def adjust_credits(fringer_id, delta):
+    if fringer_id and delta:
+        Fringer.objects.filter(pk = fringer_id).update(remaining = F('remaining') + delta)
+
+def redeem(fringer, performance = None):
+
+    # Take a credit (if there is one)
+    if not Fringer.objects.filter(pk = fringer.pk, remaining__gt = 0).update(remaining = F('remaining') - 1):
+        logger.info(f"eFringer {fringer.name} has no credits remaining")
+        return False
+
+    # Fringers can only be used once for each performance
+    if performance and Ticket.objects.filter(fringer = fringer, performance = performance, refund__isnull = True).exists():
+        adjust_credits(fringer.pk, 1)
+        logger.info(f"eFringer {fringer.name} already used for this performance")
+        return False
+    return True
+
+def mark_redeemed(instance):
+    instance._fringer_redeemed = True
+    return instance
@@ -0,0 +1,85 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, Q, Sum
+
+from volunteers.models import Shift
+from .models import BadgesIssued, Entitlement, EntitlementBalance, Sale, Ticket
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Volunteer comps and badges
+#
+# Each user has a balance row holding the volunteer comps they have earned (from their shifts)
+# and used (volunteer tickets in completed sales) and the badges they have purchased online and
+# collected. The balances are maintained incrementally by the signal handlers in tickets.signals
+# and every change is also added to the user's ledger so the balances can be audited and rebuilt
+# (see the rebuild_entitlements command): the balances always equal the totals of the ledger.
+# Pages read the balance row rather than aggregating shifts, tickets and sales.
+BALANCES = ('comps_earned', 'comps_used', 'badges_purchased', 'badges_issued')
+
+COMP_TICKETS = Q(type__name = 'Volunteer', type__festival = F('user__festival'))
+ONLINE_BADGES = Q(boxoffice__isnull = True, venue__isnull = True, completed__isnull = False, buttons__gt = 0)
+
+def is_comp(type_name, type_festival_id, user_festival_id):
+
+    # Volunteer tickets use the festival's 'Volunteer' ticket type
+    return (type_name == 'Volunteer') and (type_festival_id == user_festival_id)
+
+def badges_purchased(boxoffice_id, venue_id, completed, buttons):
+
+    # Badges contributed by a single sale (only online sales are collected later)
+    return buttons if (boxoffice_id == None) and (venue_id == None) and (completed != None) and (buttons > 0) else 0
+
+def count_entitlements(users):
+
+    # Calculate balances from scratch for a queryset of users (by user id)
+    balances = {user_id: {'comps_earned': 0.0, 'comps_used': 0, 'badges_purchased': 0, 'badges_issued': 0} for user_id in users.values_list('id', flat = True)}
+    for s in Shift.objects.filter(user__in = users).values('user_id').annotate(total = Sum('role__comps_per_shift')).order_by():
+        balances[s['user_id']]['comps_earned'] = s['total'] or 0.0
+    for t in Ticket.objects.filter(COMP_TICKETS, user__in = users, sale__completed__isnull = False).values('user_id').annotate(count = Count('id')).order_by():
+        balances[t['user_id']]['comps_used'] = t['count']
+    for s in Sale.objects.filter(ONLINE_BADGES, user__in = users).values('user_id').annotate(total = Sum('buttons')).order_by():
+        balances[s['user_id']]['badges_purchased'] = s['total']
+    for b in BadgesIssued.objects.filter(user__in = users).values('user_id').annotate(total = Sum('badges')).order_by():
+        balances[b['user_id']]['badges_issued'] = b['total']
+    return balances
+
+def ledger_totals(user_id):
+
+    # Totals of the user's ledger by kind
+    totals = {name: 0 for name in BALANCES}
+    for e in Entitlement.objects.filter(user_id = user_id).values('kind').annotate(total = Sum('amount')).order_by():
+        totals[e['kind']] = e['total']
+    return totals
+
+def get_balance(user):
+
+    # Get balance row creating it if necessary (with an opening balance from the user's shifts,
+    # tickets and sales)
+    try:
+        return EntitlementBalance.objects.get(user = user)
+    except EntitlementBalance.DoesNotExist:
+        counts = count_entitlements(get_user_model().objects.filter(pk = user.pk))[user.pk]
+        totals = ledger_totals(user.pk)
+        record(user.pk, 'Opening balance', **{name: counts[name] - totals[name] for name in BALANCES})
+        balance, created = EntitlementBalance.objects.get_or_create(user = user, defaults = ledger_totals(user.pk))
+        return balance
+
+def record(user_id, reason, **deltas):
+
+    # Add changes to the user's ledger and apply them to the balances
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not user_id or not deltas:
+        return
+    Entitlement.objects.bulk_create([Entitlement(user_id = user_id, kind = name, amount = delta, reason = reason) for name, delta in deltas.items()])
+    changes = {name: F(name) + delta for name, delta in deltas.items()}
+    if not EntitlementBalance.objects.filter(user_id = user_id).update(**changes):
+
+        # Create a missing balance row from the ledger totals (which include these changes). If
+        # another transaction has just created it the changes still have to be applied.
+        balance, created = EntitlementBalance.objects.get_or_create(user_id = user_id, defaults = ledger_totals(user_id))
+        if not created:
+            EntitlementBalance.objects.filter(user_id = user_id).update(**changes)
+        logger.warning(f"Entitlement balance for user {user_id} was missing")
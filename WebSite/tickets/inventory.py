@@ -0,0 +1,83 @@
+from collections import Counter
+
+from django.db.models import Count, F, Q
+
+from .models import PerformanceInventory
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Seat inventory
+#
+# Each performance has an inventory row holding counts of its reserved, confirmed and refunded
+# tickets and the tokens issued for them. The counts are maintained incrementally by the signal
+# handlers in tickets.signals so pages and reports can read them without aggregating over tickets.
+# The row is also the lock point for every sales channel: reserve() locks it and checks capacity
+# and the lock is held until the caller's transaction commits the new tickets.
+COUNTERS = ('reserved', 'confirmed', 'refunded', 'tokens_issued')
+
+def ticket_counters(sale_id, sale_completed, refund_id, token_issued):
+
+    # Counters contributed by a single ticket
+    confirmed = (sale_id != None) and (sale_completed != None) and (refund_id == None)
+    return Counter({
+        'reserved': 1 if (sale_id != None) and (sale_completed == None) else 0,
+        'confirmed': 1 if confirmed else 0,
+        'refunded': 1 if refund_id != None else 0,
+        'tokens_issued': 1 if confirmed and token_issued else 0,
+    })
+
+def count_tickets(tickets):
+
+    # Calculate counters from scratch for a queryset of tickets (grouped by performance id)
+    counts = tickets.values('performance_id').annotate(
+        reserved = Count('id', filter = Q(sale__isnull = False, sale__completed__isnull = True)),
+        confirmed = Count('id', filter = Q(sale__completed__isnull = False, refund__isnull = True)),
+        refunded = Count('id', filter = Q(refund__isnull = False)),
+        tokens_issued = Count('id', filter = Q(sale__completed__isnull = False, refund__isnull = True, token_issued = True)),
+    ).order_by()
+    return {c['performance_id']: {name: c[name] for name in COUNTERS} for c in counts}
+
+def get_inventory(performance):
+
+    # Get inventory row creating it from the ticket counts if necessary
+    try:
+        return PerformanceInventory.objects.get(performance = performance)
+    except PerformanceInventory.DoesNotExist:
+        counters = count_tickets(performance.tickets.all()).get(performance.id, {})
+        inventory, created = PerformanceInventory.objects.get_or_create(performance = performance, defaults = counters)
+        return inventory
+
+def adjust(performance_id, **deltas):
+
+    # Apply incremental changes to a performance's counters
+    changes = {name: F(name) + delta for name, delta in deltas.items() if delta}
+    if changes:
+        PerformanceInventory.objects.filter(performance_id = performance_id).update(**changes)
+
+def seats_available(capacity, inventory):
+
+    # Capacity less seats already held (reserved or confirmed)
+    available = capacity - inventory.reserved - inventory.confirmed if capacity else 0
+    return available if available > 0 else 0
+
+def available(performance):
+    return seats_available(performance.venue.capacity or 0, get_inventory(performance))
+
+def reserve(performance, count):
+
+    # Nothing to reserve
+    if count <= 0:
+        return True
+
+    # Lock the inventory row and check there is capacity for the additional tickets. The lock is
+    # held until the caller's transaction commits so the tickets must be saved in the same transaction.
+    get_inventory(performance)
+    inventory = PerformanceInventory.objects.select_for_update().get(performance = performance)
+    capacity = performance.venue.capacity or 0
+    if inventory.reserved + inventory.confirmed + count <= capacity:
+        return True
+    logger.info(f"Reservation of {count} seats for performance {performance.id} rejected")
+    return False
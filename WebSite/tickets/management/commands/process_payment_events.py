@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tickets.payments import process_pending
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = 'Complete (or cancel) the sales reported by the Stripe and Square payment events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-attempts', type = int, default = getattr(settings, 'PAYMENT_EVENT_MAX_ATTEMPTS', 5), help = 'Number of times an event is tried before it is left for investigation')
+        parser.add_argument('--loop', action = 'store_true', help = 'Keep running, processing events every --interval seconds')
+        parser.add_argument('--interval', type = int, default = 5, help = 'Seconds between runs in loop mode')
+
+    def handle(self, *args, **options):
+
+        # Process once or until stopped (in loop mode errors are logged and the next run continues)
+        if not options['loop']:
+            self.process(options['max_attempts'])
+            return
+        while True:
+            try:
+                self.process(options['max_attempts'])
+            except Exception:
+                logger.exception('Payment event processing failed')
+            time.sleep(options['interval'])
+
+    def process(self, max_attempts):
+        processed, failed = process_pending(max_attempts)
+        self.stdout.write(f'{processed} payment events processed, {failed} failed')
@@ -0,0 +1,52 @@
+import math
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.models import User
+from tickets.entitlements import BALANCES, count_entitlements, get_balance, record
+from tickets.models import EntitlementBalance
+
+
+class Command(BaseCommand):
+
+    help = 'Rebuild (or verify) the volunteer comps and badges balances from the shifts, tickets and sales'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--festival', help = 'Festival name (default is all festivals)')
+        parser.add_argument('--check', action = 'store_true', help = 'Report differences without updating the balances')
+
+    def handle(self, *args, **options):
+
+        # Get users
+        users = User.objects.all()
+        if options['festival']:
+            users = users.filter(festival__name = options['festival'])
+
+        with transaction.atomic():
+
+            # Calculate balances from the shifts, tickets and sales and compare with the stored values
+            counts = count_entitlements(users)
+            stored = {b.user_id: b for b in EntitlementBalance.objects.select_for_update().filter(user__in = users)}
+            mismatches = 0
+            for user_id, expected in counts.items():
+                balance = stored.get(user_id)
+                actual = {name: getattr(balance, name) for name in BALANCES} if balance else None
+                if actual and all(math.isclose(actual[name], expected[name], abs_tol = 1e-6) for name in BALANCES):
+                    continue
+                mismatches += 1
+                self.stdout.write(f'User {user_id}: stored {actual}, expected {expected}')
+                if not options['check']:
+
+                    # Record the corrections in the ledger
+                    if not balance:
+                        balance = get_balance(users.get(pk = user_id))
+                    record(user_id, 'Rebuild', **{name: expected[name] - getattr(balance, name) for name in BALANCES})
+
+        # Report
+        if options['check']:
+            if mismatches:
+                raise CommandError(f'{mismatches} user(s) have incorrect entitlement balances')
+            self.stdout.write(self.style.SUCCESS('Entitlement balances verified'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Entitlement balances rebuilt ({mismatches} user(s) corrected)'))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from program.models import ShowPerformance
+from tickets.inventory import COUNTERS, count_tickets
+from tickets.models import PerformanceInventory, Ticket
+
+
+class Command(BaseCommand):
+
+    help = 'Rebuild (or verify) the per-performance ticket counters from the tickets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--festival', help = 'Festival name (default is all festivals)')
+        parser.add_argument('--check', action = 'store_true', help = 'Report differences without updating the counters')
+
+    def handle(self, *args, **options):
+
+        # Get performances
+        performances = ShowPerformance.objects.all()
+        tickets = Ticket.objects.all()
+        if options['festival']:
+            performances = performances.filter(show__festival__name = options['festival'])
+            tickets = tickets.filter(performance__show__festival__name = options['festival'])
+
+        with transaction.atomic():
+
+            # Calculate counters from the tickets and compare with the stored values
+            counts = count_tickets(tickets)
+            stored = {i.performance_id: i for i in PerformanceInventory.objects.select_for_update().filter(performance__in = performances)}
+            mismatches = 0
+            for performance_id in performances.values_list('id', flat = True):
+                expected = counts.get(performance_id, {name: 0 for name in COUNTERS})
+                inventory = stored.get(performance_id)
+                actual = {name: getattr(inventory, name) for name in COUNTERS} if inventory else None
+                if actual == expected:
+                    continue
+                mismatches += 1
+                self.stdout.write(f'Performance {performance_id}: stored {actual}, expected {expected}')
+                if not options['check']:
+                    PerformanceInventory.objects.update_or_create(performance_id = performance_id, defaults = expected)
+
+        # Report
+        if options['check']:
+            if mismatches:
+                raise CommandError(f'{mismatches} performance(s) have incorrect ticket counters')
+            self.stdout.write(self.style.SUCCESS('Ticket counters verified'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Ticket counters rebuilt ({mismatches} performance(s) corrected)'))
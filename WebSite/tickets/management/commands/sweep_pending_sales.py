@@ -0,0 +1,130 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+import stripe
+
+from program.models import ShowPerformance
+from tickets.bulk import move_sale_to_basket
+from tickets.models import Basket, Sale, Ticket
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = 'Release the seats held by Stripe and Square payments that were never completed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type = int, default = getattr(settings, 'PENDING_SALE_TTL_MINUTES', 60), help = 'Minutes a payment can be pending before it is abandoned')
+        parser.add_argument('--square-ttl', type = int, default = getattr(settings, 'SQUARE_PENDING_SALE_TTL_MINUTES', 24 * 60), help = 'Minutes a Square point of sale payment can be pending before it is abandoned')
+        parser.add_argument('--batch', type = int, default = 100, help = 'Number of sales processed in each transaction')
+        parser.add_argument('--loop', action = 'store_true', help = 'Keep running, sweeping every --interval seconds')
+        parser.add_argument('--interval', type = int, default = 60, help = 'Seconds between sweeps in loop mode')
+
+    def handle(self, *args, **options):
+
+        # Sweep once or until stopped (in loop mode errors are logged and the next sweep continues)
+        if not options['loop']:
+            self.sweep(options['ttl'], options['square_ttl'], options['batch'])
+            return
+        while True:
+            try:
+                self.sweep(options['ttl'], options['square_ttl'], options['batch'])
+            except Exception:
+                logger.exception('Pending sale sweep failed')
+            time.sleep(options['interval'])
+
+    def sweep(self, ttl, square_ttl, batch_size):
+
+        # Process abandoned payments in batches. A Square point of sale payment cannot be expired
+        # so it is only abandoned once it is well past the time a callback or webhook could still
+        # arrive (one that does arrive later flags the sale as needing a refund, see complete_sale).
+        now = timezone.now()
+        pending = Sale.objects.filter(
+            Q(transaction_type = Sale.TRANSACTION_TYPE_STRIPE, updated__lt = now - datetime.timedelta(minutes = ttl)) |
+            Q(transaction_type = Sale.TRANSACTION_TYPE_SQUAREUP, updated__lt = now - datetime.timedelta(minutes = square_ttl)),
+            completed__isnull = True,
+            cancelled__isnull = True,
+        )
+        sales = 0
+        reclaimed = {}
+        after_id = 0
+        while True:
+            batch_ids = list(pending.filter(id__gt = after_id).order_by('id').values_list('id', flat = True)[:batch_size])
+            if not batch_ids:
+                break
+            after_id = batch_ids[-1]
+
+            # Expire the Stripe checkout sessions first (outside the transaction) so they can no
+            # longer be paid; sales whose session could not be expired are left for the next sweep
+            open_sessions = []
+            for sale in pending.filter(id__in = batch_ids, transaction_type = Sale.TRANSACTION_TYPE_STRIPE, transaction_ID__isnull = False):
+                if not self.expire_session(sale):
+                    open_sessions.append(sale.id)
+
+            with transaction.atomic():
+                batch = list(pending.select_for_update(skip_locked = True).filter(id__in = batch_ids).exclude(id__in = open_sessions).order_by('id'))
+                for p in Ticket.objects.filter(sale__in = batch).values('performance_id').annotate(count = Count('id')).order_by():
+                    reclaimed[p['performance_id']] = reclaimed.get(p['performance_id'], 0) + p['count']
+                for sale in batch:
+                    self.abandon(sale)
+            sales += len(batch)
+
+        # Log reclaimed capacity
+        if sales:
+            for performance in ShowPerformance.objects.filter(id__in = reclaimed).select_related('show').order_by('date', 'time'):
+                logger.info(f"{reclaimed[performance.id]} seats reclaimed for {performance.show.name} on {performance.date} at {performance.time}")
+            logger.info(f"{sales} abandoned payments swept ({sum(reclaimed.values())} seats reclaimed)")
+        self.stdout.write(f'{sales} abandoned payments swept ({sum(reclaimed.values())} seats reclaimed)')
+
+    def expire_session(self, sale):
+
+        # Expire the checkout session (a session that has already expired is fine but one that has
+        # been paid must be left for the payment to complete the sale)
+        stripe.api_key = settings.STRIPE_PRIVATE_KEY
+        try:
+            stripe.checkout.Session.expire(sale.transaction_ID)
+            logger.info(f"Stripe session {sale.transaction_ID} for sale {sale.id} expired")
+            return True
+        except stripe.InvalidRequestError:
+            try:
+                status = stripe.checkout.Session.retrieve(sale.transaction_ID).status
+            except stripe.StripeError as e:
+                logger.error(f"Stripe session {sale.transaction_ID} for sale {sale.id} not retrieved: {e}")
+                return False
+            if status != 'expired':
+                logger.warning(f"Stripe session {sale.transaction_ID} for sale {sale.id} is {status} (not abandoned)")
+            return status == 'expired'
+        except stripe.StripeError as e:
+            logger.error(f"Stripe session {sale.transaction_ID} for sale {sale.id} not expired: {e}")
+            return False
+
+    def abandon(self, sale):
+
+        # Online (Stripe) sales are returned to the customer's basket, as if the payment had
+        # been cancelled; unpaid box office and venue (Square) tickets are deleted
+        if sale.is_stripe and not (sale.boxoffice_id or sale.venue_id):
+            basket, created = Basket.objects.get_or_create(user_id = sale.user_id)
+            move_sale_to_basket(sale, basket)
+            basket.buttons += sale.buttons
+            basket.save()
+        else:
+            sale.tickets.all().delete()
+
+        # Cancel the sale
+        sale.buttons = 0
+        sale.amount = 0
+        sale.transaction_type = None
+        sale.transaction_fee = 0
+        sale.cancelled = timezone.now()
+        sale.notes = f'{sale.notes}\nPayment abandoned'.strip()
+        sale.save()
+        logger.info(f"Sale {sale.id} cancelled (payment abandoned)")
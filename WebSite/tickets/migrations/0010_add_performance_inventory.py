@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-17 12:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('program', '0001_initial'),
+        ('tickets', '0009_Add_bucket_adience'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerformanceInventory',
+            fields=[
+                ('performance', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='inventory', serialize=False, to='program.showperformance')),
+                ('held', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunSQL('insert into tickets_performanceinventory (performance_id, held) select sp.id, count(s.id) from program_showperformance sp left join tickets_ticket t on t.performance_id = sp.id left join tickets_sale s on s.id = t.sale_id and (s.completed is null or t.refund_id is null) group by sp.id', reverse_sql=''),
+    ]
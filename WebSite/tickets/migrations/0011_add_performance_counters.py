@@ -0,0 +1,39 @@
+# Generated by Django 5.0.14 on 2026-10-17 12:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0010_add_performance_inventory'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='performanceinventory',
+            name='held',
+        ),
+        migrations.AddField(
+            model_name='performanceinventory',
+            name='confirmed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='performanceinventory',
+            name='refunded',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='performanceinventory',
+            name='reserved',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='performanceinventory',
+            name='tokens_issued',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL('insert into tickets_performanceinventory (performance_id, reserved, confirmed, refunded, tokens_issued) select sp.id, 0, 0, 0, 0 from program_showperformance sp where not exists (select 1 from tickets_performanceinventory pi where pi.performance_id = sp.id)', reverse_sql=''),
+        migrations.RunSQL('update tickets_performanceinventory pi set reserved = c.reserved, confirmed = c.confirmed, refunded = c.refunded, tokens_issued = c.tokens_issued from (select t.performance_id, count(t.id) filter (where t.sale_id is not null and s.completed is null) as reserved, count(t.id) filter (where s.completed is not null and t.refund_id is null) as confirmed, count(t.id) filter (where t.refund_id is not null) as refunded, count(t.id) filter (where s.completed is not null and t.refund_id is null and t.token_issued) as tokens_issued from tickets_ticket t left join tickets_sale s on s.id = t.sale_id group by t.performance_id) c where pi.performance_id = c.performance_id', reverse_sql=''),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.14 on 2026-10-17 13:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('program', '0002_show_search_vector'),
+        ('tickets', '0011_add_performance_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fringer',
+            name='remaining',
+            field=models.IntegerField(blank=True, default=0),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['fringer', 'performance'], name='tickets_tic_fringer_e85b80_idx'),
+        ),
+        migrations.RunSQL('update tickets_fringer f set remaining = ft.shows - (select count(*) from tickets_ticket t where t.fringer_id = f.id and t.refund_id is null) - (select count(*) from tickets_payasyouwill p where p.fringer_id = f.id) from tickets_fringertype ft where ft.id = f.type_id', reverse_sql=''),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.14 on 2026-10-17 13:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_merge_volunteer_into_user'),
+        ('tickets', '0012_fringer_remaining'),
+        ('volunteers', '0003_merge_volunteer_into_user'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntitlementBalance',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='entitlement_balance', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('comps_earned', models.FloatField(default=0)),
+                ('comps_used', models.IntegerField(default=0)),
+                ('badges_purchased', models.IntegerField(default=0)),
+                ('badges_issued', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Entitlement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('comps_earned', 'Comps earned'), ('comps_used', 'Comps used'), ('badges_purchased', 'Badges purchased'), ('badges_issued', 'Badges issued')], max_length=16)),
+                ('amount', models.FloatField()),
+                ('reason', models.CharField(blank=True, default='', max_length=64)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entitlements', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunSQL("insert into tickets_entitlementbalance (user_id, comps_earned, comps_used, badges_purchased, badges_issued) select u.id, coalesce((select sum(r.comps_per_shift) from volunteers_shift s join volunteers_role r on r.id = s.role_id where s.user_id = u.id), 0), (select count(*) from tickets_ticket t join tickets_tickettype tt on tt.id = t.type_id join tickets_sale s on s.id = t.sale_id where t.user_id = u.id and tt.name = 'Volunteer' and tt.festival_id = u.festival_id and s.completed is not null), coalesce((select sum(s.buttons) from tickets_sale s where s.user_id = u.id and s.boxoffice_id is null and s.venue_id is null and s.completed is not null and s.buttons > 0), 0), coalesce((select sum(b.badges) from tickets_badgesissued b where b.user_id = u.id), 0) from core_user u", reverse_sql=''),
+        migrations.RunSQL("insert into tickets_entitlement (user_id, kind, amount, reason, created) select user_id, kind, amount, 'Opening balance', now() from (select user_id, 'comps_earned' as kind, comps_earned as amount from tickets_entitlementbalance union all select user_id, 'comps_used', comps_used from tickets_entitlementbalance union all select user_id, 'badges_purchased', badges_purchased from tickets_entitlementbalance union all select user_id, 'badges_issued', badges_issued from tickets_entitlementbalance) opening where amount <> 0", reverse_sql=''),
+    ]
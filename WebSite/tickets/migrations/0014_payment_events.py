@@ -0,0 +1,33 @@
+# Generated by Django 5.0.14 on 2026-10-17 13:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0013_entitlements'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_type', models.PositiveIntegerField(choices=[(1, 'Cash'), (2, 'Stripe'), (3, 'SquareUp')])),
+                ('event_id', models.CharField(max_length=128)),
+                ('event_type', models.CharField(max_length=64)),
+                ('payload', models.JSONField(default=dict)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('received', models.DateTimeField(auto_now_add=True)),
+                ('processed', models.DateTimeField(blank=True, null=True)),
+                ('sale', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_events', to='tickets.sale')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['processed', 'id'], name='tickets_pay_process_e81bf8_idx')],
+                'unique_together': {('transaction_type', 'event_id')},
+            },
+        ),
+    ]
@@ -4,6 +4,7 @@ from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
 from django.utils import timezone
 from django.db import models
+from django.db.models import Exists, OuterRef
 from decimal import Decimal, ROUND_05UP
 
 from core.models import TimeStampedModel, Festival
@@ -11,6 +12,28 @@ from core.utils import AutoOneToOneField
 
 from program.models import Company, Show, ShowPerformance, Venue
 
+def get_ticket_performances(tickets, fringer_names = False):
+
+    # Group tickets by performance in date, time and show order (a single query however many
+    # tickets or performances there are)
+    performances = {}
+    for t in tickets.select_related('performance__show', 'type', 'fringer').order_by('performance__date', 'performance__time', 'performance__show__name', 'performance_id', 'id'):
+        performance = performances.get(t.performance_id)
+        if not performance:
+            p = t.performance
+            performance = performances[t.performance_id] = {
+                'id': p.id,
+                'uuid': p.uuid,
+                'show': p.show.name,
+                'date' : p.date,
+                'time': p.time,
+                'ticket_cost': 0,
+                'tickets': [],
+            }
+        performance['ticket_cost'] += t.price
+        performance['tickets'].append({'id': t.id, 'uuid': t.uuid, 'description': f"{t.description}: {t.fringer.name}" if fringer_names and t.fringer else t.description, 'cost': t.price})
+    return list(performances.values())
+
 class BoxOffice(TimeStampedModel):
     
     festival = models.ForeignKey(Festival, on_delete=models.PROTECT, related_name='boxoffices')
@@ -76,11 +99,11 @@ class Sale(TimeStampedModel):
 
     @property
     def fringer_cost(self):
-        return sum([f.price for f in self.fringers.all()])
+        return sum([f.price for f in self.fringers.select_related('type')])
 
     @property
     def ticket_cost(self):
-        return sum([t.price for t in self.tickets.all()])
+        return sum([t.price for t in self.tickets.select_related('type')])
 
     @property
     def payw_cost(self):
@@ -124,21 +147,7 @@ class Sale(TimeStampedModel):
     
     @property
     def ticket_performances(self):
-        performances = []
-        for ticket in self.tickets.values('performance_id').distinct():
-            p = ShowPerformance.objects.get(pk = ticket['performance_id'])
-            tickets = self.tickets.filter(performance_id = ticket['performance_id'])
-            performance = {
-                'id': p.id,
-                'uuid': p.uuid,
-                'show': p.show.name,
-                'date' : p.date,
-                'time': p.time,
-                'ticket_cost': sum(t.price for t in tickets.all()), 
-                'tickets': [{'id': t.id, 'uuid': t.uuid, 'description': f"{t.description}: {t.fringer.name}" if t.fringer else t.description, 'cost': t.price} for t in tickets],
-            }
-            performances.append(performance)
-        return performances
+        return get_ticket_performances(self.tickets.all(), fringer_names = True)
 
     def transaction_type_description(self):
         if self.transaction_type == self.TRANSACTION_TYPE_CASH:
@@ -181,7 +190,7 @@ class Refund(TimeStampedModel):
 
     @property
     def ticket_cost(self):
-        return sum([t.price for t in self.tickets.all()])
+        return sum([t.price for t in self.tickets.select_related('type')])
 
     @property
     def total_cost(self):
@@ -189,21 +198,7 @@ class Refund(TimeStampedModel):
 
     @property
     def performances(self):
-        performances = []
-        for ticket in self.tickets.values('performance_id').distinct():
-            p = ShowPerformance.objects.get(pk = ticket['performance_id'])
-            tickets = self.tickets.filter(performance_id = ticket['performance_id'])
-            performance = {
-                'id': p.id,
-                'uuid': p.uuid,
-                'show': p.show.name,
-                'date' : p.date,
-                'time': p.time,
-                'ticket_cost': sum(t.price for t in tickets.all()), 
-                'tickets': [{'id': t.id, 'uuid': t.uuid, 'description': t.description, 'cost': t.price} for t in tickets],
-            }
-            performances.append(performance)
-        return performances
+        return get_ticket_performances(self.tickets.all())
 
     def __str__(self):
         return f'{self.id} ({self.customer})'
@@ -244,11 +239,11 @@ class Basket(TimeStampedModel):
 
     @property
     def ticket_cost(self):
-        return sum([t.price for t in self.tickets.all()])
+        return sum([t.price for t in self.tickets.select_related('type')])
 
     @property
     def fringer_cost(self):
-        return sum([f.price for f in self.fringers.all()])
+        return sum([f.price for f in self.fringers.select_related('type')])
 
     @property
     def button_cost(self):
@@ -260,21 +255,7 @@ class Basket(TimeStampedModel):
 
     @property
     def performances(self):
-        performances = []
-        for t in self.tickets.values('performance_id').distinct():
-            p = ShowPerformance.objects.get(pk = t['performance_id'])
-            tickets = self.tickets.filter(performance = p)
-            performance = {
-                'id': p.id,
-                'uuid': p.uuid,
-                'show': p.show.name,
-                'date' : p.date,
-                'time': p.time,
-                'ticket_cost': sum(t.price for t in tickets), 
-                'tickets': [{'id': t.id, 'uuid': t.uuid, 'description': t.description, 'cost': t.price} for t in tickets],
-            }
-            performances.append(performance)
-        return performances
+        return get_ticket_performances(self.tickets.all())
 
     def __str__(self):
         return f'{self.user}'
@@ -333,6 +314,7 @@ class Fringer(TimeStampedModel):
     name = models.CharField(max_length = 32)
     basket = models.ForeignKey(Basket, on_delete = models.CASCADE, null = True, blank = True, related_name = 'fringers')
     sale = models.ForeignKey(Sale, on_delete = models.CASCADE, null = True, blank = True, related_name = 'fringers')
+    remaining = models.IntegerField(blank = True, default = 0)
 
     class Meta:
         #ordering = ['user', 'name']
@@ -356,22 +338,25 @@ class Fringer(TimeStampedModel):
 
     @property
     def used(self):
-        return self.tickets.filter(refund = None).count() + self.PAYW_donations.count()
+        return self.type.shows - self.remaining
 
     @property
     def available(self):
-        return self.type.shows - self.used
+        return self.remaining
 
     @property
     def valid_tickets(self):
         return self.tickets.exclude(refund__isnull = False)
 
     def is_available(self, performance = None):
-        return (self.available > 0) and ((performance == None) or (performance not in [t.performance for t in self.tickets.filter(refund__isnull = True)]))
+        return (self.remaining > 0) and ((performance == None) or not self.tickets.filter(performance = performance, refund__isnull = True).exists())
 
     @staticmethod
     def get_available(user, performance = None):
-        return [f for f in user.fringers.exclude(sale__completed__isnull = True) if f.is_available(performance)]
+        fringers = user.fringers.exclude(sale__completed__isnull = True).filter(remaining__gt = 0).select_related('type')
+        if performance:
+            fringers = fringers.exclude(Exists(Ticket.objects.filter(fringer = OuterRef('pk'), performance = performance, refund__isnull = True)))
+        return list(fringers)
     
 class Ticket(TimeStampedModel):
 
@@ -384,8 +369,11 @@ class Ticket(TimeStampedModel):
     refund = models.ForeignKey(Refund, on_delete = models.SET_NULL, null = True, blank = True, related_name = 'tickets')
     token_issued = models.BooleanField(default = False)
 
-    #class Meta:
-    #    ordering = ['performance']
+    class Meta:
+        #ordering = ['performance']
+        indexes = [
+            models.Index(fields = ['fringer', 'performance']),
+        ]
 
     #def __str__(self):
     #    return f'{self.id} ({self.description}): {self.performance}'
@@ -406,6 +394,19 @@ class Ticket(TimeStampedModel):
     def price(self):
         return self.type.price
 
+class PerformanceInventory(models.Model):
+
+    # Ticket counters for a performance. This row is the lock point for all sales channels and
+    # the counters are maintained by tickets.signals (see tickets.inventory).
+    performance = models.OneToOneField(ShowPerformance, on_delete = models.CASCADE, primary_key = True, related_name = 'inventory')
+    reserved = models.IntegerField(default = 0)
+    confirmed = models.IntegerField(default = 0)
+    refunded = models.IntegerField(default = 0)
+    tokens_issued = models.IntegerField(default = 0)
+
+    def __str__(self):
+        return f'{self.performance_id}: {self.reserved}/{self.confirmed}/{self.refunded}/{self.tokens_issued}'
+
 class Checkpoint(TimeStampedModel):
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL, null = True, on_delete = models.PROTECT, related_name = 'checkpoints')
@@ -468,3 +469,61 @@ class BadgesIssued(TimeStampedModel):
     boxoffice = models.ForeignKey(BoxOffice, null = True, blank = True, on_delete = models.PROTECT, related_name = 'badges_issued')
     venue = models.ForeignKey(Venue, null = True, blank = True, on_delete = models.PROTECT, related_name = 'badges_issued')
     badges = models.IntegerField()
+
+class Entitlement(models.Model):
+
+    # Ledger of changes to a user's volunteer comps and badges (see tickets.entitlements)
+    KIND_COMPS_EARNED = 'comps_earned'
+    KIND_COMPS_USED = 'comps_used'
+    KIND_BADGES_PURCHASED = 'badges_purchased'
+    KIND_BADGES_ISSUED = 'badges_issued'
+    KIND_CHOICES = (
+        (KIND_COMPS_EARNED, 'Comps earned'),
+        (KIND_COMPS_USED, 'Comps used'),
+        (KIND_BADGES_PURCHASED, 'Badges purchased'),
+        (KIND_BADGES_ISSUED, 'Badges issued'),
+    )
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete = models.CASCADE, related_name = 'entitlements')
+    kind = models.CharField(max_length = 16, choices = KIND_CHOICES)
+    amount = models.FloatField()
+    reason = models.CharField(max_length = 64, blank = True, default = '')
+    created = models.DateTimeField(auto_now_add = True)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.kind} {self.amount:+g} ({self.reason})'
+
+class EntitlementBalance(models.Model):
+
+    # Current totals of a user's entitlement ledger. The balances are maintained by tickets.signals
+    # (see tickets.entitlements).
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete = models.CASCADE, primary_key = True, related_name = 'entitlement_balance')
+    comps_earned = models.FloatField(default = 0)
+    comps_used = models.IntegerField(default = 0)
+    badges_purchased = models.IntegerField(default = 0)
+    badges_issued = models.IntegerField(default = 0)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.comps_earned:g}/{self.comps_used}/{self.badges_purchased}/{self.badges_issued}'
+
+class PaymentEvent(models.Model):
+
+    # Payment notification from Stripe or Square stored once per event id (see tickets.payments)
+    transaction_type = models.PositiveIntegerField(choices = Sale.TRANSACTION_TYPE_CHOICES)
+    event_id = models.CharField(max_length = 128)
+    event_type = models.CharField(max_length = 64)
+    sale = models.ForeignKey(Sale, null = True, blank = True, on_delete = models.SET_NULL, related_name = 'payment_events')
+    payload = models.JSONField(default = dict)
+    attempts = models.IntegerField(default = 0)
+    error = models.TextField(blank = True, default = '')
+    received = models.DateTimeField(auto_now_add = True)
+    processed = models.DateTimeField(null = True, blank = True)
+
+    class Meta:
+        unique_together = ('transaction_type', 'event_id')
+        indexes = [
+            models.Index(fields = ['processed', 'id']),
+        ]
+
+    def __str__(self):
+        return f'{self.get_transaction_type_display()} {self.event_type} {self.event_id}'
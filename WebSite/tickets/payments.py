@@ -0,0 +1,226 @@
+import base64
+import hashlib
+import hmac
+
+from django.conf import settings
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from core.outbox import queue_message
+from .bulk import move_sale_to_basket
+from .models import Basket, PaymentEvent, Sale
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Payment events
+#
+# Sales paid by card are completed from payment events rather than from the pages the customer
+# (or the Square point of sale app) returns to. Signed Stripe and Square webhooks and Square
+# point of sale callbacks are stored once per event id and processed by the
+# process_payment_events command (callbacks are also processed straight away as the box office
+# and venue are waiting for them). Completing a sale locks the sale row and does nothing if it
+# is already complete, so replayed or duplicate events, page refreshes and concurrent workers
+# cannot complete a sale (or send its e-mail) twice. The return pages only show the sale state.
+STRIPE_COMPLETED = ('checkout.session.completed', 'checkout.session.async_payment_succeeded')
+STRIPE_FAILED = ('checkout.session.expired', 'checkout.session.async_payment_failed')
+SQUARE_PAYMENT = ('payment.created', 'payment.updated')
+SQUARE_CALLBACK = 'pos.callback'
+NEEDS_REFUND = 'Payment received after the sale was cancelled (needs refund)'
+
+def verify_square_signature(body, signature, url):
+
+    # Square signs the notification URL followed by the body with the subscription's signature key
+    key = getattr(settings, 'SQUARE_WEBHOOK_SIGNATURE_KEY', '')
+    if not key or not signature:
+        return False
+    digest = hmac.new(key.encode(), url.encode() + body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode(), signature)
+
+def _sale_id(value):
+    try:
+        return Sale.objects.filter(pk = int(value)).values_list('id', flat = True).first()
+    except (TypeError, ValueError):
+        return None
+
+def record_event(transaction_type, event_id, event_type, sale_id, payload):
+
+    # Store event (unless it has already been received)
+    event, created = PaymentEvent.objects.get_or_create(
+        transaction_type = transaction_type,
+        event_id = event_id,
+        defaults = {
+            'event_type': event_type,
+            'sale_id': _sale_id(sale_id),
+            'payload': payload,
+        },
+    )
+    if created:
+        logger.info(f"Payment event {event} received (sale {event.sale_id})")
+    else:
+        logger.info(f"Duplicate payment event {event} ignored")
+    return event, created
+
+def record_stripe_event(payload):
+    session = payload.get('data', {}).get('object', {})
+    return record_event(Sale.TRANSACTION_TYPE_STRIPE, payload['id'], payload.get('type', ''), session.get('client_reference_id'), payload)
+
+def record_square_event(payload):
+    payment = payload.get('data', {}).get('object', {}).get('payment', {})
+    return record_event(Sale.TRANSACTION_TYPE_SQUAREUP, payload['event_id'], payload.get('type', ''), payment.get('note'), payload)
+
+def record_square_callback(sale, server_transaction_id, client_transaction_id):
+    payload = {
+        'server_transaction_id': server_transaction_id,
+        'client_transaction_id': client_transaction_id,
+    }
+    return record_event(Sale.TRANSACTION_TYPE_SQUAREUP, f'callback:{server_transaction_id}', SQUARE_CALLBACK, sale.id, payload)
+
+def queue_confirmation(sale):
+
+    # Online sales are confirmed to the customer's account e-mail
+    if sale.tickets.exists() or sale.fringers.exists() or sale.buttons:
+        context = {
+            'festival': sale.festival,
+            'fringers': sale.fringers.order_by('name'),
+            'tickets': sale.tickets.order_by('performance__date', 'performance__time', 'performance__show__name'),
+            'badges': sale.buttons,
+        }
+        body = render_to_string('tickets/sale_email.txt', context)
+        queue_message(sale.user.email, 'Confirmation from ' + sale.festival.title, body, reference = f'sale:{sale.id}')
+
+def queue_receipt(sale, email):
+
+    # Box office receipt (in the caller's transaction)
+    context = {
+        'festival': sale.festival,
+        'buttons': sale.buttons,
+        'fringers': sale.fringers.count(),
+        'tickets': sale.tickets.order_by('performance__date', 'performance__time', 'performance__show__name')
+    }
+    body = render_to_string('boxoffice/sale_email.txt', context)
+    queue_message(email, 'Tickets for ' + sale.festival.title, body, reference = f'sale:{sale.id}')
+
+def complete_sale(sale_id, transaction_id = None):
+
+    # Lock the sale (so duplicate events wait) and complete it unless that has already happened
+    sale = Sale.objects.select_for_update().select_related('festival', 'user').filter(pk = sale_id).first()
+    if not sale:
+        logger.error(f"Payment received for unknown sale {sale_id}")
+        return False
+    if sale.completed:
+        logger.info(f"Sale {sale.id} already completed")
+        return False
+    if sale.cancelled:
+
+        # The customer has paid for a sale that no longer has any items so flag it for a refund
+        # (see the Needs refund filter in the sale admin)
+        if NEEDS_REFUND not in sale.notes:
+            if transaction_id and not sale.transaction_ID:
+                sale.transaction_ID = transaction_id
+            sale.notes = f'{sale.notes}\n{NEEDS_REFUND}'.strip()
+            sale.save()
+        logger.error(f"Payment received for cancelled sale {sale.id} (needs refund)")
+        return False
+
+    # Tokens for venue ticket sales are issued immediately
+    if sale.venue_id:
+        for ticket in sale.tickets.all():
+            ticket.token_issued = True
+            ticket.save()
+
+    # Complete the sale and queue its confirmation or receipt
+    if transaction_id:
+        sale.transaction_ID = transaction_id
+    sale.completed = timezone.now()
+    sale.save()
+    logger.info(f"Sale {sale.id} completed ({sale.get_transaction_type_display()})")
+    if not sale.boxoffice_id and not sale.venue_id:
+        queue_confirmation(sale)
+    elif sale.boxoffice_id and sale.customer:
+        queue_receipt(sale, sale.customer)
+    return True
+
+def cancel_stripe_sale(sale, basket = None):
+
+    # Move sale items back into basket and cancel sale
+    basket = basket or Basket.objects.get_or_create(user_id = sale.user_id)[0]
+    move_sale_to_basket(sale, basket)
+    basket.buttons = sale.buttons
+    basket.save()
+    sale.buttons = 0
+    sale.amount = 0
+    sale.transaction_type = None
+    sale.transaction_fee = 0
+    sale.cancelled = timezone.now()
+    sale.save()
+    logger.info(f"Sale {sale.id} cancelled")
+
+def _stripe_payment_failed(event):
+
+    # Return the items to the customer's basket (unless the sale has completed or been cancelled)
+    sale = Sale.objects.select_for_update().filter(pk = event.sale_id).first()
+    if sale and not sale.completed and not sale.cancelled:
+        logger.info(f"Stripe payment for sale {sale.id} not completed ({event.event_type})")
+        cancel_stripe_sale(sale)
+
+def _apply(event):
+
+    # Act on the event
+    if event.transaction_type == Sale.TRANSACTION_TYPE_STRIPE:
+        session = event.payload.get('data', {}).get('object', {})
+        if event.event_type in STRIPE_COMPLETED and session.get('payment_status') == 'paid':
+            complete_sale(event.sale_id)
+        elif event.event_type in STRIPE_FAILED:
+            _stripe_payment_failed(event)
+    elif event.event_type == SQUARE_CALLBACK:
+        complete_sale(event.sale_id, event.payload['server_transaction_id'])
+    elif event.event_type in SQUARE_PAYMENT:
+        payment = event.payload.get('data', {}).get('object', {}).get('payment', {})
+        if payment.get('status') == 'COMPLETED':
+            complete_sale(event.sale_id, payment.get('id'))
+
+def _process_locked(event):
+
+    # Process an event locked by the caller (recording any error so it can be retried)
+    try:
+        with transaction.atomic():
+            _apply(event)
+        event.processed = timezone.now()
+        event.error = ''
+    except Exception as e:
+        logger.exception(f"Payment event {event} failed")
+        event.error = str(e) or type(e).__name__
+    event.attempts += 1
+    event.save()
+    return event.processed != None
+
+def process_event(event_id):
+
+    # Process a single event now (waiting for a worker that is already processing it)
+    with transaction.atomic():
+        event = PaymentEvent.objects.select_for_update().get(pk = event_id)
+        return event.processed != None or _process_locked(event)
+
+def process_pending(max_attempts = None):
+
+    # Process every event that is waiting (each at most once per run)
+    max_attempts = max_attempts or getattr(settings, 'PAYMENT_EVENT_MAX_ATTEMPTS', 5)
+    processed = failed = 0
+    after_id = 0
+    while True:
+        with transaction.atomic():
+            event = PaymentEvent.objects.select_for_update(skip_locked = True).filter(processed__isnull = True, attempts__lt = max_attempts, id__gt = after_id).order_by('id').first()
+            if not event:
+                break
+            after_id = event.id
+            if _process_locked(event):
+                processed += 1
+            else:
+                failed += 1
+    if processed or failed:
+        logger.info(f"{processed} payment events processed, {failed} failed")
+    return processed, failed
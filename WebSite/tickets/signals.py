@@ -1,7 +1,22 @@
+from collections import Counter, defaultdict
+
 from django.contrib.auth import user_logged_in, user_logged_out
+from django.db.models import Count, F, Q
+from django.db.models.signals import post_save, pre_save, pre_delete, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 
+from core.models import User
+from program.models import ShowPerformance
+from volunteers.models import Role, Shift
+
+from .bulk import move_sale_to_basket
+from .context_processors import basket_changed
+from .inventory import ticket_counters, adjust
+from .credits import adjust_credits
+from .entitlements import COMP_TICKETS, is_comp, badges_purchased, record
+from .models import PerformanceInventory, Sale, Refund, Basket, Ticket, Fringer, FringerType, PayAsYouWill, BadgesIssued, EntitlementBalance
+
 # Logging
 import logging
 logger = logging.getLogger(__name__)
@@ -10,18 +25,11 @@ logger = logging.getLogger(__name__)
 def user_logged_in_signal(sender, user, request, **kwargs):
     logger.info(f"User {user} logged on")
 
-    # Delete any incomplete sales and return items to basket
-    for sale in user.sales.filter(boxoffice__isnull = True, venue__isnull = True, completed__isnull = True):
-        for ticket in sale.tickets.all():
-            ticket.basket = user.basket
-            ticket.sale = None
-            ticket.save()
-            logger.info(f"{ticket.description} ticket for {ticket.performance.show.name} on {ticket.performance.date} at {ticket.performance.time} returned to basket {user.id}")
-        for fringer in sale.fringers.all():
-            fringer.basket = user.basket
-            fringer.sale = None
-            fringer.save()
-            logger.info(f"eFringer {fringer.name} returned to basket {user.id}")
+    # Delete any incomplete sales and return items to basket (except Stripe payments that may
+    # still be completed by a webhook, which are cancelled by the webhook or sweep_pending_sales)
+    awaiting_payment = Q(transaction_type = Sale.TRANSACTION_TYPE_STRIPE, transaction_ID__isnull = False, cancelled__isnull = True)
+    for sale in user.sales.filter(boxoffice__isnull = True, venue__isnull = True, completed__isnull = True).exclude(awaiting_payment):
+        move_sale_to_basket(sale, user.basket)
         logger.info(f"Sale {sale.id} auto-deleted (online)")
         sale.delete()
 
@@ -29,3 +37,250 @@ def user_logged_in_signal(sender, user, request, **kwargs):
 @receiver(user_logged_out)
 def user_logged_out_signal(sender, user, request, **kwargs):
     logger.info(f"User {user} logged out")
+
+
+# Performance ticket counters (see tickets.inventory)
+TICKET_STATE = ('performance_id', 'sale_id', 'sale__completed', 'refund_id', 'token_issued', 'fringer_id', 'user_id', 'user__festival_id', 'type__name', 'type__festival_id')
+
+def _comp_user(saved):
+
+    # User whose volunteer comp is used by a ticket (if it is a volunteer ticket in a completed sale)
+    if saved['sale__completed'] != None and is_comp(saved['type__name'], saved['type__festival_id'], saved['user__festival_id']):
+        return saved['user_id']
+    return None
+
+@receiver(post_save, sender = ShowPerformance)
+def performance_saved(sender, instance, created, raw = False, **kwargs):
+
+    # Create inventory for new performances
+    if created and not raw:
+        PerformanceInventory.objects.get_or_create(performance = instance)
+
+@receiver(pre_save, sender = Ticket)
+def ticket_saving(sender, instance, raw = False, **kwargs):
+
+    # Remember the saved state so the counters can be adjusted once the ticket is saved
+    instance._saved_counters = None
+    instance._saved_fringer = None
+    instance._saved_comp = None
+    if not raw and not instance._state.adding:
+        saved = Ticket.objects.filter(pk = instance.pk).values(*TICKET_STATE).first()
+        if saved:
+            instance._saved_counters = (saved['performance_id'], ticket_counters(saved['sale_id'], saved['sale__completed'], saved['refund_id'], saved['token_issued']))
+            instance._saved_fringer = saved['fringer_id'] if saved['refund_id'] == None else None
+            instance._saved_comp = _comp_user(saved)
+
+@receiver(post_save, sender = Ticket)
+def ticket_saved(sender, instance, raw = False, **kwargs):
+
+    # Move ticket from its old counters to its new ones
+    if raw:
+        return
+    changes = defaultdict(Counter)
+    saved = getattr(instance, '_saved_counters', None)
+    if saved:
+        changes[saved[0]].subtract(saved[1])
+    changes[instance.performance_id].update(ticket_counters(instance.sale_id, instance.sale.completed if instance.sale_id else None, instance.refund_id, instance.token_issued))
+    for performance_id, deltas in changes.items():
+        adjust(performance_id, **deltas)
+
+    # Move the fringer credit (unless it was taken when the ticket was redeemed)
+    saved_fringer = getattr(instance, '_saved_fringer', None)
+    fringer = instance.fringer_id if instance.refund_id == None else None
+    if saved_fringer != fringer:
+        adjust_credits(saved_fringer, 1)
+        if not getattr(instance, '_fringer_redeemed', False):
+            adjust_credits(fringer, -1)
+    instance._fringer_redeemed = False
+
+    # Move the volunteer comp
+    saved_comp = getattr(instance, '_saved_comp', None)
+    comp = None
+    if instance.sale_id and instance.type_id and instance.user_id and Ticket.objects.filter(COMP_TICKETS, pk = instance.pk, sale__completed__isnull = False).exists():
+        comp = instance.user_id
+    if saved_comp != comp:
+        record(saved_comp, f'Ticket {instance.id}', comps_used = -1)
+        record(comp, f'Ticket {instance.id}', comps_used = 1)
+
+@receiver(pre_delete, sender = Ticket)
+def ticket_deleting(sender, instance, **kwargs):
+
+    # Remove ticket from its counters and return its fringer credit and volunteer comp (using the
+    # saved state as the instance may be out of date)
+    saved = Ticket.objects.filter(pk = instance.pk).values(*TICKET_STATE).first()
+    if not saved:
+        return
+    counters = ticket_counters(saved['sale_id'], saved['sale__completed'], saved['refund_id'], saved['token_issued'])
+    adjust(saved['performance_id'], **{name: -count for name, count in counters.items()})
+    if saved['refund_id'] == None:
+        adjust_credits(saved['fringer_id'], 1)
+    record(_comp_user(saved), f'Ticket {instance.pk} deleted', comps_used = -1)
+
+@receiver(pre_save, sender = Sale)
+def sale_saving(sender, instance, raw = False, **kwargs):
+
+    # Remember if the sale was complete and the badges it added
+    instance._saved_completed = None
+    instance._saved_badges = None
+    if not raw and not instance._state.adding:
+        saved = Sale.objects.filter(pk = instance.pk).values('user_id', 'boxoffice_id', 'venue_id', 'completed', 'buttons').first()
+        if saved:
+            instance._saved_completed = saved['completed']
+            instance._saved_badges = (saved['user_id'], badges_purchased(saved['boxoffice_id'], saved['venue_id'], saved['completed'], saved['buttons']))
+
+@receiver(post_save, sender = Sale)
+def sale_saved(sender, instance, created, raw = False, **kwargs):
+    if raw:
+        return
+
+    # Move the badges purchased online
+    saved_badges = getattr(instance, '_saved_badges', None)
+    badges = (instance.user_id, badges_purchased(instance.boxoffice_id, instance.venue_id, instance.completed, instance.buttons))
+    if saved_badges != badges:
+        if saved_badges:
+            record(saved_badges[0], f'Sale {instance.id}', badges_purchased = -saved_badges[1])
+        record(badges[0], f'Sale {instance.id}', badges_purchased = badges[1])
+
+    # Completing a sale moves its tickets from reserved to confirmed (and cancelling completion
+    # moves them back)
+    if created or ((instance.completed == None) == (getattr(instance, '_saved_completed', None) == None)):
+        return
+    sign = 1 if instance.completed else -1
+    for p in instance.tickets.values('performance_id').annotate(
+        total = Count('id'),
+        active = Count('id', filter = Q(refund__isnull = True)),
+        tokens = Count('id', filter = Q(refund__isnull = True, token_issued = True)),
+    ).order_by():
+        adjust(p['performance_id'], reserved = -sign * p['total'], confirmed = sign * p['active'], tokens_issued = sign * p['tokens'])
+    for c in instance.tickets.filter(COMP_TICKETS).values('user_id').annotate(count = Count('id')).order_by():
+        record(c['user_id'], f'Sale {instance.id}', comps_used = sign * c['count'])
+
+@receiver(pre_delete, sender = Sale)
+def sale_deleting(sender, instance, **kwargs):
+
+    # Remove the badges purchased (the tickets are removed by their own signal handlers)
+    saved = Sale.objects.filter(pk = instance.pk).values('user_id', 'boxoffice_id', 'venue_id', 'completed', 'buttons').first()
+    if saved:
+        record(saved['user_id'], f'Sale {instance.pk} deleted', badges_purchased = -badges_purchased(saved['boxoffice_id'], saved['venue_id'], saved['completed'], saved['buttons']))
+
+@receiver(pre_delete, sender = Refund)
+def refund_deleting(sender, instance, **kwargs):
+
+    # Tickets are returned to their sales when a refund is deleted
+    for p in instance.tickets.values('performance_id').annotate(
+        total = Count('id'),
+        active = Count('id', filter = Q(sale__completed__isnull = False)),
+        tokens = Count('id', filter = Q(sale__completed__isnull = False, token_issued = True)),
+    ).order_by():
+        adjust(p['performance_id'], refunded = -p['total'], confirmed = p['active'], tokens_issued = p['tokens'])
+    for f in instance.tickets.filter(fringer__isnull = False).values('fringer_id').annotate(count = Count('id')).order_by():
+        adjust_credits(f['fringer_id'], -f['count'])
+
+
+# Fringer credits (see tickets.credits)
+@receiver(pre_save, sender = Fringer)
+def fringer_saving(sender, instance, raw = False, **kwargs):
+
+    # New fringers start with all the credits of their type
+    if not raw and instance._state.adding:
+        instance.remaining = instance.type.shows
+
+@receiver(pre_save, sender = FringerType)
+def fringer_type_saving(sender, instance, raw = False, **kwargs):
+
+    # Changing the number of shows changes the credits of every fringer of that type
+    if not raw and not instance._state.adding:
+        shows = FringerType.objects.filter(pk = instance.pk).values_list('shows', flat = True).first()
+        if shows != None and shows != instance.shows:
+            Fringer.objects.filter(type = instance).update(remaining = F('remaining') + instance.shows - shows)
+
+@receiver(post_save, sender = PayAsYouWill)
+def payw_saved(sender, instance, created, raw = False, **kwargs):
+    if created and not raw and not getattr(instance, '_fringer_redeemed', False):
+        adjust_credits(instance.fringer_id, -1)
+
+@receiver(pre_delete, sender = PayAsYouWill)
+def payw_deleting(sender, instance, **kwargs):
+    adjust_credits(instance.fringer_id, 1)
+
+
+# Volunteer comps and badges (see tickets.entitlements)
+@receiver(post_save, sender = User)
+def user_saved(sender, instance, created, raw = False, **kwargs):
+
+    # Create balances for new users
+    if created and not raw:
+        EntitlementBalance.objects.get_or_create(user = instance)
+
+@receiver(pre_save, sender = Shift)
+def shift_saving(sender, instance, raw = False, **kwargs):
+
+    # Remember who earned the shift's comps
+    instance._saved_comps = None
+    if not raw and not instance._state.adding:
+        instance._saved_comps = Shift.objects.filter(pk = instance.pk).values_list('user_id', 'role__comps_per_shift').first()
+
+@receiver(post_save, sender = Shift)
+def shift_saved(sender, instance, raw = False, **kwargs):
+
+    # Move the comps earned when the shift is taken, released or its role changes
+    if raw:
+        return
+    saved = getattr(instance, '_saved_comps', None)
+    comps = (instance.user_id, instance.role.comps_per_shift) if instance.user_id else None
+    if saved and not saved[0]:
+        saved = None
+    if saved != comps:
+        if saved:
+            record(saved[0], f'Shift {instance.id}', comps_earned = -saved[1])
+        if comps:
+            record(comps[0], f'Shift {instance.id}', comps_earned = comps[1])
+
+@receiver(pre_delete, sender = Shift)
+def shift_deleting(sender, instance, **kwargs):
+    saved = Shift.objects.filter(pk = instance.pk).values_list('user_id', 'role__comps_per_shift').first()
+    if saved and saved[0]:
+        record(saved[0], f'Shift {instance.pk} deleted', comps_earned = -saved[1])
+
+@receiver(pre_save, sender = Role)
+def role_saving(sender, instance, raw = False, **kwargs):
+
+    # Changing the comps per shift changes the comps earned by everyone with a shift in that role
+    if not raw and not instance._state.adding:
+        comps_per_shift = Role.objects.filter(pk = instance.pk).values_list('comps_per_shift', flat = True).first()
+        if comps_per_shift != None and comps_per_shift != instance.comps_per_shift:
+            for s in Shift.objects.filter(role = instance, user__isnull = False).values('user_id').annotate(count = Count('id')).order_by():
+                record(s['user_id'], f'Role {instance.pk}', comps_earned = s['count'] * (instance.comps_per_shift - comps_per_shift))
+
+@receiver(pre_save, sender = BadgesIssued)
+def badges_issued_saving(sender, instance, raw = False, **kwargs):
+    instance._saved_badges = None
+    if not raw and not instance._state.adding:
+        instance._saved_badges = BadgesIssued.objects.filter(pk = instance.pk).values_list('user_id', 'badges').first()
+
+@receiver(post_save, sender = BadgesIssued)
+def badges_issued_saved(sender, instance, raw = False, **kwargs):
+    if raw:
+        return
+    saved = getattr(instance, '_saved_badges', None)
+    if saved != (instance.user_id, instance.badges):
+        if saved:
+            record(saved[0], f'Badges issued {instance.id}', badges_issued = -saved[1])
+        record(instance.user_id, f'Badges issued {instance.id}', badges_issued = instance.badges)
+
+@receiver(pre_delete, sender = BadgesIssued)
+def badges_issued_deleting(sender, instance, **kwargs):
+    saved = BadgesIssued.objects.filter(pk = instance.pk).values_list('user_id', 'badges').first()
+    if saved:
+        record(saved[0], f'Badges issued {instance.pk} deleted', badges_issued = -saved[1])
+
+
+# Basket summary (see tickets.context_processors)
+@receiver(post_save, sender = Basket)
+@receiver(post_delete, sender = Basket)
+@receiver(post_save, sender = Ticket)
+@receiver(post_delete, sender = Ticket)
+@receiver(post_save, sender = Fringer)
+@receiver(post_delete, sender = Fringer)
+def basket_saved(sender, **kwargs):
+    basket_changed()
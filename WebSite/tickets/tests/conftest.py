@@ -0,0 +1,25 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+from core.models import Festival, User
+from program.models import Company, Venue, Show, ShowPerformance
+from tickets.models import Ticket, TicketType
+
+
+@pytest.fixture
+def basket(client):
+
+    # Logged in user with two tickets in their basket
+    festival = Festival.objects.create(name = 'TEST', title = 'Test festival', is_live = True)
+    venue = Venue.objects.create(festival = festival, name = 'Venue', is_ticketed = True, capacity = 10)
+    company = Company.objects.create(festival = festival, name = 'Company')
+    show = Show.objects.create(festival = festival, company = company, name = 'Show', is_ticketed = True)
+    performance = ShowPerformance.objects.create(show = show, venue = venue, date = datetime.date(2026, 6, 1), time = datetime.time(19, 0))
+    adult = TicketType.objects.create(festival = festival, name = 'Adult', price = Decimal('8.00'))
+    user = User.objects.create_user(festival, 'customer@example.com', 'password')
+    client.force_login(user)
+    for i in range(2):
+        Ticket.objects.create(performance = performance, type = adult, user = user, basket = user.basket)
+    return user.basket
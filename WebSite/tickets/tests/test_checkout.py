@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+import stripe
+from django.db import connection
+from django.urls import reverse
+
+from tickets.inventory import get_inventory
+from tickets.models import Sale, Ticket
+
+
+@pytest.mark.django_db(transaction = True)
+def test_stripe_session_created_outside_transaction(client, basket):
+
+    # The sale must be committed (and no transaction open) when Stripe is called
+    calls = []
+    def create_session(**kwargs):
+        sale = Sale.objects.get(pk = int(kwargs['client_reference_id']))
+        calls.append((connection.in_atomic_block, sale.tickets.count(), Ticket.objects.filter(basket = basket).count(), kwargs['line_items'][0]['price_data']['unit_amount']))
+        return SimpleNamespace(id = 'cs_test_1', url = 'https://checkout.stripe.test/cs_test_1')
+
+    with mock.patch('stripe.checkout.Session.create', side_effect = create_session):
+        response = client.post(reverse('tickets:checkout_stripe'))
+    assert calls == [(False, 2, 0, 1600)]
+    assert response.status_code == 302
+    assert response['Location'] == 'https://checkout.stripe.test/cs_test_1'
+    sale = Sale.objects.get()
+    assert (sale.transaction_ID, sale.transaction_type, sale.completed) == ('cs_test_1', Sale.TRANSACTION_TYPE_STRIPE, None)
+    inventory = get_inventory(sale.tickets.first().performance)
+    assert (inventory.reserved, inventory.confirmed) == (2, 0)
+
+@pytest.mark.django_db(transaction = True)
+def test_stripe_failure_returns_sale_to_basket(client, basket):
+
+    with mock.patch('stripe.checkout.Session.create', side_effect = stripe.APIConnectionError('Stripe unavailable')):
+        response = client.post(reverse('tickets:checkout_stripe'))
+    assert response.status_code == 200
+    sale = Sale.objects.get()
+    assert sale.cancelled != None
+    assert sale.tickets.count() == 0
+    assert Ticket.objects.filter(basket = basket).count() == 2
+    inventory = get_inventory(Ticket.objects.first().performance)
+    assert (inventory.reserved, inventory.confirmed) == (0, 0)
@@ -0,0 +1,87 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+
+from tickets.bulk import move_basket_to_sale
+from tickets.inventory import COUNTERS, count_tickets
+from tickets.models import PerformanceInventory, Refund, Sale, Ticket
+
+
+def assert_counters(performance):
+
+    # Stored counters must match a recount of the tickets
+    inventory = PerformanceInventory.objects.get(performance = performance)
+    expected = count_tickets(Ticket.objects.all()).get(performance.id, {name: 0 for name in COUNTERS})
+    assert {name: getattr(inventory, name) for name in COUNTERS} == expected
+    return expected
+
+@pytest.fixture
+def sale(basket):
+
+    # Basket tickets moved to an online sale
+    user = basket.user
+    sale = Sale.objects.create(festival = user.festival, user = user, customer = user.email)
+    move_basket_to_sale(basket, sale)
+    return sale
+
+@pytest.mark.django_db
+def test_counters_follow_ticket_transitions(sale):
+
+    performance = sale.tickets.first().performance
+    assert assert_counters(performance) == {'reserved': 2, 'confirmed': 0, 'refunded': 0, 'tokens_issued': 0}
+
+    # Complete sale
+    sale.completed = timezone.now()
+    sale.save()
+    assert assert_counters(performance)['confirmed'] == 2
+
+    # Issue token
+    ticket = sale.tickets.first()
+    ticket.token_issued = True
+    ticket.save()
+    assert assert_counters(performance)['tokens_issued'] == 1
+
+    # Refund ticket
+    refund = Refund.objects.create(festival = sale.festival, user = sale.user, completed = timezone.now())
+    ticket.refund = refund
+    ticket.save()
+    assert assert_counters(performance) == {'reserved': 0, 'confirmed': 1, 'refunded': 1, 'tokens_issued': 0}
+
+    # Delete refund
+    refund.delete()
+    assert assert_counters(performance) == {'reserved': 0, 'confirmed': 2, 'refunded': 0, 'tokens_issued': 1}
+
+    # Delete ticket
+    Ticket.objects.get(pk = ticket.pk).delete()
+    assert assert_counters(performance) == {'reserved': 0, 'confirmed': 1, 'refunded': 0, 'tokens_issued': 0}
+
+    # Delete sale
+    sale.delete()
+    assert assert_counters(performance) == {'reserved': 0, 'confirmed': 0, 'refunded': 0, 'tokens_issued': 0}
+
+@pytest.mark.django_db
+def test_rebuild_inventory_check(sale):
+
+    # Counters maintained by the signals verify
+    performance = sale.tickets.first().performance
+    out = StringIO()
+    call_command('rebuild_inventory', '--check', stdout = out)
+    assert 'Ticket counters verified' in out.getvalue()
+
+    # Drifted counters are reported but not changed by --check
+    PerformanceInventory.objects.filter(performance = performance).update(reserved = 5)
+    out = StringIO()
+    with pytest.raises(CommandError):
+        call_command('rebuild_inventory', '--check', stdout = out)
+    assert f'Performance {performance.id}' in out.getvalue()
+    assert PerformanceInventory.objects.get(performance = performance).reserved == 5
+
+    # Rebuild corrects them
+    out = StringIO()
+    call_command('rebuild_inventory', stdout = out)
+    assert '1 performance(s) corrected' in out.getvalue()
+    assert_counters(performance)
+    call_command('rebuild_inventory', '--check', stdout = StringIO())
@@ -0,0 +1,63 @@
+import pytest
+from django.utils import timezone
+
+from tickets.credits import mark_redeemed, redeem
+from tickets.models import Fringer, FringerType, Refund, Sale, Ticket
+
+
+@pytest.fixture
+def fringer(basket):
+
+    # Purchased fringer with two credits
+    user = basket.user
+    ticket_type = basket.tickets.first().type
+    fringer_type = FringerType.objects.create(festival = user.festival, name = 'Two', shows = 2, is_online = True, ticket_type = ticket_type)
+    sale = Sale.objects.create(festival = user.festival, user = user, customer = user.email, completed = timezone.now())
+    return Fringer.objects.create(user = user, type = fringer_type, name = 'F1', sale = sale)
+
+def use(fringer, performance):
+
+    # Redeem a credit and create the ticket (as buy_fringers_use does)
+    assert redeem(fringer, performance)
+    ticket = mark_redeemed(Ticket(user = fringer.user, performance = performance, type = fringer.type.ticket_type, fringer = fringer, sale = fringer.sale))
+    ticket.save()
+    return ticket
+
+def remaining(fringer):
+    fringer.refresh_from_db()
+    return fringer.remaining
+
+@pytest.mark.django_db
+def test_redeem_decrements_remaining(basket, fringer):
+
+    performance = basket.tickets.first().performance
+    assert remaining(fringer) == 2
+    assert redeem(fringer, performance)
+    assert remaining(fringer) == 1
+    assert redeem(fringer)
+    assert remaining(fringer) == 0
+
+@pytest.mark.django_db
+def test_redeem_exhausted_fringer_fails(basket, fringer):
+
+    performance = basket.tickets.first().performance
+    Fringer.objects.filter(pk = fringer.pk).update(remaining = 0)
+    assert not redeem(fringer, performance)
+    assert remaining(fringer) == 0
+
+@pytest.mark.django_db
+def test_redeem_same_performance_rejected(basket, fringer):
+
+    # A second redemption for the same performance is rejected and its credit returned
+    performance = basket.tickets.first().performance
+    ticket = use(fringer, performance)
+    assert remaining(fringer) == 1
+    assert not redeem(fringer, performance)
+    assert remaining(fringer) == 1
+
+    # Refunding the ticket returns its credit and allows the performance again
+    ticket.refund = Refund.objects.create(festival = fringer.type.festival, user = fringer.user, completed = timezone.now())
+    ticket.save()
+    assert remaining(fringer) == 2
+    assert redeem(fringer, performance)
+    assert remaining(fringer) == 1
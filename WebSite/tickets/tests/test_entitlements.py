@@ -0,0 +1,118 @@
+import datetime
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+
+from tickets.entitlements import BALANCES, count_entitlements, get_balance, ledger_totals, record
+from tickets.models import BadgesIssued, Entitlement, EntitlementBalance, Sale, Ticket, TicketType
+from volunteers.models import Location, Role, Shift
+
+
+def balances(user):
+    balance = EntitlementBalance.objects.get(user = user)
+    return {name: getattr(balance, name) for name in BALANCES}
+
+def assert_balances(user):
+
+    # Stored balances must equal the ledger totals and a recount of the shifts, tickets and sales
+    stored = balances(user)
+    assert stored == ledger_totals(user.id)
+    assert stored == count_entitlements(type(user).objects.filter(pk = user.pk))[user.pk]
+    return stored
+
+@pytest.fixture
+def shift(basket):
+
+    # Shift with two comps
+    festival = basket.user.festival
+    role = Role.objects.create(festival = festival, description = 'Bar staff', comps_per_shift = 2)
+    location = Location.objects.create(festival = festival, description = 'Bar')
+    return Shift.objects.create(location = location, role = role, date = datetime.date(2026, 6, 1), start_time = datetime.time(10, 0), end_time = datetime.time(12, 0))
+
+@pytest.mark.django_db
+def test_ledger_follows_comps_and_badges(basket, shift):
+
+    user = basket.user
+    festival = user.festival
+    assert assert_balances(user) == {'comps_earned': 0, 'comps_used': 0, 'badges_purchased': 0, 'badges_issued': 0}
+
+    # Take shift
+    shift.user = user
+    shift.save()
+    assert assert_balances(user)['comps_earned'] == 2
+
+    # Use a volunteer ticket
+    volunteer = TicketType.objects.create(festival = festival, name = 'Volunteer')
+    sale = Sale.objects.create(festival = festival, user = user, customer = user.email, buttons = 3)
+    ticket = Ticket.objects.create(performance = basket.tickets.first().performance, type = volunteer, user = user, sale = sale)
+    assert assert_balances(user)['comps_used'] == 0
+    sale.completed = timezone.now()
+    sale.save()
+    assert assert_balances(user) == {'comps_earned': 2, 'comps_used': 1, 'badges_purchased': 3, 'badges_issued': 0}
+
+    # Collect badges
+    issued = BadgesIssued.objects.create(user = user, badges = 2)
+    assert assert_balances(user)['badges_issued'] == 2
+
+    # Undo everything
+    issued.delete()
+    ticket.delete()
+    sale.delete()
+    shift.user = None
+    shift.save()
+    assert assert_balances(user) == {'comps_earned': 0, 'comps_used': 0, 'badges_purchased': 0, 'badges_issued': 0}
+
+@pytest.mark.django_db
+def test_record_creates_missing_balance(basket):
+
+    # The balance row is created from the ledger (so earlier changes are not lost)
+    user = basket.user
+    record(user.id, 'Test', comps_earned = 2)
+    EntitlementBalance.objects.filter(user = user).delete()
+    record(user.id, 'Test', comps_earned = 1, comps_used = 1)
+    assert balances(user) == {'comps_earned': 3, 'comps_used': 1, 'badges_purchased': 0, 'badges_issued': 0}
+    assert balances(user) == ledger_totals(user.id)
+
+@pytest.mark.django_db
+def test_get_balance_records_opening_balance(basket, shift):
+
+    # A missing balance row is created from the shifts, tickets and sales with a matching ledger entry
+    user = basket.user
+    Shift.objects.filter(pk = shift.pk).update(user = user)
+    EntitlementBalance.objects.filter(user = user).delete()
+    assert get_balance(user).comps_earned == 2
+    assert assert_balances(user)['comps_earned'] == 2
+    assert Entitlement.objects.get(user = user).reason == 'Opening balance'
+
+@pytest.mark.django_db
+def test_rebuild_entitlements(basket, shift):
+
+    # Balances maintained by the signals verify
+    user = basket.user
+    shift.user = user
+    shift.save()
+    call_command('rebuild_entitlements', '--check', stdout = StringIO())
+
+    # Changes that bypass the signals are reported but not changed by --check
+    Shift.objects.filter(pk = shift.pk).update(user = None)
+    out = StringIO()
+    with pytest.raises(CommandError):
+        call_command('rebuild_entitlements', '--check', stdout = out)
+    assert f'User {user.id}' in out.getvalue()
+    assert balances(user)['comps_earned'] == 2
+
+    # Rebuild records the corrections in the ledger
+    out = StringIO()
+    call_command('rebuild_entitlements', stdout = out)
+    assert '1 user(s) corrected' in out.getvalue()
+    assert assert_balances(user)['comps_earned'] == 0
+    assert Entitlement.objects.filter(user = user, reason = 'Rebuild').count() == 1
+
+    # Missing balance rows are rebuilt too
+    EntitlementBalance.objects.filter(user = user).delete()
+    call_command('rebuild_entitlements', stdout = StringIO())
+    assert_balances(user)
+    call_command('rebuild_entitlements', '--check', stdout = StringIO())
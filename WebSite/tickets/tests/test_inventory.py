@@ -0,0 +1,136 @@
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import User
+from tickets.bulk import move_basket_to_sale
+from tickets.inventory import get_inventory, reserve
+from tickets.models import BoxOffice, Checkpoint, Fringer, FringerType, Refund, Sale, Ticket, TicketType
+
+
+def sell_out(performance):
+
+    # Completed sale for every seat in the venue
+    festival = performance.show.festival
+    user = User.objects.create_user(festival, 'other@example.com', 'password')
+    ticket_type = TicketType.objects.create(festival = festival, name = 'Other', price = Decimal('8.00'))
+    sale = Sale.objects.create(festival = festival, user = user, customer = user.email, completed = timezone.now())
+    for i in range(performance.venue.capacity):
+        Ticket.objects.create(performance = performance, type = ticket_type, user = user, sale = sale)
+    return sale
+
+@pytest.mark.django_db
+def test_reserve_rejects_sale_beyond_capacity(basket):
+
+    performance = basket.tickets.first().performance
+    assert reserve(performance, 10)
+    assert not reserve(performance, 11)
+    sale = Sale.objects.create(festival = performance.show.festival, user = basket.user, customer = basket.user.email)
+    move_basket_to_sale(basket, sale)
+    assert get_inventory(performance).reserved == 2
+    assert reserve(performance, 8)
+    assert not reserve(performance, 9)
+
+@pytest.mark.django_db
+def test_stripe_checkout_refused_when_full(client, basket):
+
+    performance = basket.tickets.first().performance
+    sell_out(performance)
+    with mock.patch('stripe.checkout.Session.create') as create_session:
+        response = client.post(reverse('tickets:checkout_stripe'))
+    assert not create_session.called
+    assert response.status_code == 200
+    assert b'Your card has not been charged' in response.content
+    assert Sale.objects.filter(user = basket.user).count() == 0
+    assert basket.tickets.count() == 2
+    inventory = get_inventory(performance)
+    assert (inventory.reserved, inventory.confirmed) == (0, 10)
+
+@pytest.mark.django_db
+def test_volunteer_use_refused_when_full(client, basket):
+
+    performance = basket.tickets.first().performance
+    TicketType.objects.create(festival = performance.show.festival, name = 'Volunteer')
+    sell_out(performance)
+    response = client.post(reverse('tickets:buy_volunteer_use', args = [performance.uuid]))
+    assert response.status_code == 200
+    assert Sale.objects.filter(user = basket.user).count() == 0
+    assert get_inventory(performance).confirmed == 10
+
+@pytest.mark.django_db
+def test_fringer_use_refused_when_full(client, basket):
+
+    performance = basket.tickets.first().performance
+    festival = performance.show.festival
+    fringer_type = FringerType.objects.create(festival = festival, name = 'Six', shows = 6, is_online = True, ticket_type = basket.tickets.first().type)
+    sale = Sale.objects.create(festival = festival, user = basket.user, customer = basket.user.email, completed = timezone.now())
+    fringer = Fringer.objects.create(user = basket.user, type = fringer_type, name = 'F1', sale = sale, remaining = 6)
+    sell_out(performance)
+    response = client.post(reverse('tickets:buy_fringers_use', args = [performance.uuid]), {'fringer_id': [fringer.id]})
+    assert response.status_code == 200
+    assert not fringer.tickets.exists()
+    fringer.refresh_from_db()
+    assert fringer.remaining == 6
+    assert get_inventory(performance).confirmed == 10
+
+@pytest.mark.django_db
+def test_boxoffice_refused_when_full(client, basket):
+
+    performance = basket.tickets.first().performance
+    festival = performance.show.festival
+    TicketType.objects.filter(festival = festival).update(is_boxoffice = True)
+    boxoffice = BoxOffice.objects.create(festival = festival, name = 'Box office')
+    user = User.objects.create_user(festival, 'boxoffice@example.com', 'password', is_boxoffice = True)
+    client.force_login(user)
+    sale = Sale.objects.create(festival = festival, boxoffice = boxoffice, user = user)
+    sell_out(performance)
+    response = client.post(reverse('boxoffice:sale_tickets_add', args = [sale.uuid, performance.uuid]), {'Ticket_Adult': 1, 'Ticket_Other': 0})
+    assert response.status_code == 200
+    assert not sale.tickets.exists()
+    assert get_inventory(performance).confirmed == 10
+
+@pytest.mark.django_db
+def test_venue_refused_when_full(client, basket):
+
+    performance = basket.tickets.first().performance
+    festival = performance.show.festival
+    adult = TicketType.objects.get(festival = festival, name = 'Adult')
+    TicketType.objects.filter(pk = adult.pk).update(is_venue = True)
+    user = User.objects.create_user(festival, 'venue@example.com', 'password', is_venue = True)
+    client.force_login(user)
+    Checkpoint.objects.create(user = user, venue = performance.venue, open_performance = performance, cash = 0, buttons = 0, fringers = 0)
+    sale = Sale.objects.create(festival = festival, venue = performance.venue, user = user)
+    sell_out(performance)
+    response = client.post(reverse('venue:sale_items', args = [performance.uuid, sale.uuid]), {f'ticket_{adult.id}': 1, 'buttons': 0, 'fringers': 0})
+    assert response.status_code == 200
+    assert not sale.tickets.exists()
+    assert get_inventory(performance).confirmed == 10
+
+@pytest.mark.django_db
+def test_ticket_cancel_rejects_other_user(client, basket):
+
+    ticket = sell_out(basket.tickets.first().performance).tickets.first()
+    response = client.post(reverse('tickets:myaccount_ticket_cancel', args = [ticket.uuid]))
+    assert response['HX-Redirect'] == reverse('tickets:myaccount')
+    ticket.refresh_from_db()
+    assert ticket.refund == None
+
+@pytest.mark.django_db
+def test_ticket_cancel_repeated(client, basket):
+
+    performance = basket.tickets.first().performance
+    sale = Sale.objects.create(festival = performance.show.festival, user = basket.user, customer = basket.user.email, completed = timezone.now())
+    move_basket_to_sale(basket, sale)
+    ticket = sale.tickets.first()
+    response = client.post(reverse('tickets:myaccount_ticket_cancel', args = [ticket.uuid]))
+    assert response.status_code == 200
+    response = client.post(reverse('tickets:myaccount_ticket_cancel', args = [ticket.uuid]))
+    assert response['HX-Redirect'] == reverse('tickets:myaccount')
+    ticket.refresh_from_db()
+    assert ticket.refund != None
+    assert Refund.objects.count() == 1
+    inventory = get_inventory(performance)
+    assert (inventory.confirmed, inventory.refunded) == (1, 1)
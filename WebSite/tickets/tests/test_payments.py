@@ -0,0 +1,147 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+from pathlib import Path
+from string import Template
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+
+from core.models import OutboxMessage
+from tickets.inventory import get_inventory
+from tickets.models import BoxOffice, PaymentEvent, Sale, Ticket
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+SQUARE_URL = 'http://testserver/tickets/webhook/square'
+
+
+def load_event(name, sale):
+    return Template((FIXTURES / name).read_text()).substitute(sale_id = sale.id)
+
+def stripe_signature(payload, secret):
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+def square_signature(payload, key):
+    return base64.b64encode(hmac.new(key.encode(), (SQUARE_URL + payload).encode(), hashlib.sha256).digest()).decode()
+
+def post_stripe(client, payload, secret = 'whsec_test'):
+    return client.post(reverse('tickets:stripe_webhook'), payload, content_type = 'application/json', HTTP_STRIPE_SIGNATURE = stripe_signature(payload, secret))
+
+@pytest.fixture
+def webhook_settings(settings):
+    settings.STRIPE_WEBHOOK_SECRET = 'whsec_test'
+    settings.SQUARE_WEBHOOK_SIGNATURE_KEY = 'square_test'
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    return settings
+
+@pytest.fixture
+def stripe_sale(client, basket, webhook_settings):
+
+    # Sale waiting for its Stripe payment
+    session = SimpleNamespace(id = 'cs_test_1', url = 'https://checkout.stripe.test/cs_test_1')
+    with mock.patch('stripe.checkout.Session.create', return_value = session):
+        client.post(reverse('tickets:checkout_stripe'))
+    return Sale.objects.get()
+
+@pytest.fixture
+def boxoffice_sale(basket, webhook_settings):
+
+    # Box office sale waiting for its Square payment
+    festival = basket.user.festival
+    boxoffice = BoxOffice.objects.create(festival = festival, name = 'Box office')
+    sale = Sale.objects.create(festival = festival, boxoffice = boxoffice, user = basket.user, customer = 'buyer@example.com', amount = 16, transaction_type = Sale.TRANSACTION_TYPE_SQUAREUP, transaction_fee = 0)
+    Ticket.objects.filter(basket = basket).update(basket = None, sale = sale)
+    return sale
+
+
+@pytest.mark.django_db
+def test_replayed_stripe_event_completes_sale_once(client, stripe_sale):
+
+    # The same event delivered twice is stored and processed once
+    payload = load_event('stripe_checkout_completed.json', stripe_sale)
+    assert post_stripe(client, payload).status_code == 200
+    assert post_stripe(client, payload).status_code == 200
+    assert PaymentEvent.objects.count() == 1
+    call_command('process_payment_events')
+    call_command('process_payment_events')
+    stripe_sale.refresh_from_db()
+    assert stripe_sale.completed != None
+    assert stripe_sale.transaction_ID == 'cs_test_1'
+    assert list(OutboxMessage.objects.values_list('to', 'reference')) == [('customer@example.com', f'sale:{stripe_sale.id}')]
+    inventory = get_inventory(stripe_sale.tickets.first().performance)
+    assert (inventory.reserved, inventory.confirmed) == (0, 2)
+
+@pytest.mark.django_db
+def test_stripe_event_with_bad_signature_rejected(client, stripe_sale):
+    payload = load_event('stripe_checkout_completed.json', stripe_sale)
+    assert post_stripe(client, payload, secret = 'whsec_other').status_code == 400
+    assert PaymentEvent.objects.count() == 0
+
+@pytest.mark.django_db
+def test_success_page_waits_for_webhook(client, stripe_sale):
+
+    # The return page does not complete the sale but polls until the event has been processed
+    response = client.get(reverse('tickets:checkout_success', args = [stripe_sale.uuid]))
+    assert response.status_code == 200
+    assert 'tickets/checkout_pending.html' in [t.name for t in response.templates]
+    status_url = reverse('tickets:checkout_status', args = [stripe_sale.uuid])
+    assert client.get(status_url).status_code == 204
+    stripe_sale.refresh_from_db()
+    assert stripe_sale.completed == None
+    post_stripe(client, load_event('stripe_checkout_completed.json', stripe_sale))
+    call_command('process_payment_events')
+    response = client.get(status_url)
+    assert response['HX-Redirect'] == reverse('tickets:checkout_success', args = [stripe_sale.uuid])
+    response = client.get(reverse('tickets:checkout_success', args = [stripe_sale.uuid]))
+    assert 'tickets/checkout_confirm.html' in [t.name for t in response.templates]
+    assert OutboxMessage.objects.count() == 1
+
+@pytest.mark.django_db
+def test_expired_stripe_session_returns_sale_to_basket(client, basket, stripe_sale):
+    post_stripe(client, load_event('stripe_checkout_expired.json', stripe_sale))
+    call_command('process_payment_events')
+    stripe_sale.refresh_from_db()
+    assert (stripe_sale.completed, stripe_sale.cancelled != None) == (None, True)
+    assert Ticket.objects.filter(basket = basket).count() == 2
+
+    # A late completion event does not complete the cancelled sale
+    post_stripe(client, load_event('stripe_checkout_completed.json', stripe_sale))
+    call_command('process_payment_events')
+    stripe_sale.refresh_from_db()
+    assert stripe_sale.completed == None
+    assert OutboxMessage.objects.count() == 0
+
+@pytest.mark.django_db
+def test_square_webhook_completes_sale_once(client, boxoffice_sale):
+    payload = load_event('square_payment_updated.json', boxoffice_sale)
+    for i in range(2):
+        response = client.post(reverse('tickets:square_webhook'), payload, content_type = 'application/json', HTTP_X_SQUARE_HMACSHA256_SIGNATURE = square_signature(payload, 'square_test'))
+        assert response.status_code == 200
+    response = client.post(reverse('tickets:square_webhook'), payload, content_type = 'application/json', HTTP_X_SQUARE_HMACSHA256_SIGNATURE = square_signature(payload, 'square_other'))
+    assert response.status_code == 400
+    call_command('process_payment_events')
+    boxoffice_sale.refresh_from_db()
+    assert boxoffice_sale.transaction_ID == 'sq_payment_test_1'
+    assert boxoffice_sale.completed != None
+    assert list(OutboxMessage.objects.values_list('to', flat = True)) == ['buyer@example.com']
+
+@pytest.mark.django_db
+def test_repeated_square_callback_completes_sale_once(client, boxoffice_sale):
+    params = {
+        'com.squareup.pos.SERVER_TRANSACTION_ID': 'sq_server_1',
+        'com.squareup.pos.CLIENT_TRANSACTION_ID': 'sq_client_1',
+        'com.squareup.pos.REQUEST_METADATA': json.dumps({'boxoffice_id': boxoffice_sale.boxoffice_id, 'sale_id': boxoffice_sale.id}),
+    }
+    for i in range(2):
+        assert client.get(reverse('boxoffice:square_callback'), params).status_code == 302
+    boxoffice_sale.refresh_from_db()
+    assert boxoffice_sale.transaction_ID == 'sq_server_1'
+    assert PaymentEvent.objects.get().processed != None
+    assert OutboxMessage.objects.count() == 1
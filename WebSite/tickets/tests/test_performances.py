@@ -0,0 +1,52 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+from program.models import Show, ShowPerformance
+from tickets.models import Ticket, TicketType
+
+
+def add_tickets(basket, count):
+
+    # Tickets spread over new performances (of a new show) on 1-3 June
+    performance = basket.tickets.first().performance
+    child = TicketType.objects.get_or_create(festival = performance.show.festival, name = 'Child', defaults = {'price': Decimal('5.00')})[0]
+    show = Show.objects.create(festival = performance.show.festival, company = performance.show.company, name = f'Another show {count}', is_ticketed = True)
+    for i in range(count):
+        p = ShowPerformance.objects.get_or_create(show = show, venue = performance.venue, date = datetime.date(2026, 6, 1 + i % 3), time = datetime.time(14, 0))[0]
+        Ticket.objects.create(performance = p, type = child, user = basket.user, basket = basket)
+
+@pytest.mark.django_db
+def test_basket_performances(basket, django_assert_num_queries):
+
+    # Two adult tickets for a single performance
+    with django_assert_num_queries(1):
+        performances = basket.performances
+    performance = basket.tickets.first().performance
+    assert performances == [{
+        'id': performance.id,
+        'uuid': performance.uuid,
+        'show': 'Show',
+        'date': datetime.date(2026, 6, 1),
+        'time': datetime.time(19, 0),
+        'ticket_cost': Decimal('16.00'),
+        'tickets': [{'id': t.id, 'uuid': t.uuid, 'description': 'Adult', 'cost': Decimal('8.00')} for t in basket.tickets.order_by('id')],
+    }]
+
+@pytest.mark.django_db
+def test_performances_queries_constant(basket, django_assert_num_queries):
+
+    # The same single query for one ticket as for many tickets over several performances
+    basket.tickets.order_by('id').last().delete()
+    with django_assert_num_queries(1):
+        assert len(basket.performances) == 1
+    add_tickets(basket, 7)
+    with django_assert_num_queries(1):
+        performances = basket.performances
+
+    # Performances in date, time and show order with their tickets and costs
+    assert [(p['date'].day, p['time'].hour, p['show']) for p in performances] == [(1, 14, 'Another show 7'), (1, 19, 'Show'), (2, 14, 'Another show 7'), (3, 14, 'Another show 7')]
+    assert [len(p['tickets']) for p in performances] == [3, 1, 2, 2]
+    assert [p['ticket_cost'] for p in performances] == [Decimal('15.00'), Decimal('8.00'), Decimal('10.00'), Decimal('10.00')]
+    assert all(t['description'] == 'Child' for p in performances if p['show'] != 'Show' for t in p['tickets'])
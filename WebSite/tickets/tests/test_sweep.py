@@ -0,0 +1,110 @@
+import datetime
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+import stripe
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+
+from tickets.admin import SaleAdmin, SaleRefundListFilter
+from tickets.inventory import get_inventory
+from tickets.models import BoxOffice, Sale, Ticket
+from tickets.payments import NEEDS_REFUND, complete_sale
+
+
+@pytest.fixture
+def pending_sale(client, basket):
+
+    # Stripe sale created two hours ago that has not been paid
+    session = SimpleNamespace(id = 'cs_test_1', url = 'https://checkout.stripe.test/cs_test_1')
+    with mock.patch('stripe.checkout.Session.create', return_value = session) as create:
+        client.post(reverse('tickets:checkout_stripe'))
+    assert create.call_args.kwargs['expires_at'] <= timezone.now().timestamp() + 60 * 60
+    Sale.objects.update(updated = timezone.now() - datetime.timedelta(hours = 2))
+    return Sale.objects.get()
+
+def sweep(expire = None, retrieve = None):
+    with mock.patch('stripe.checkout.Session.expire', **(expire or {})) as expired, mock.patch('stripe.checkout.Session.retrieve', **(retrieve or {})):
+        call_command('sweep_pending_sales')
+    return expired
+
+
+@pytest.mark.django_db
+def test_abandoned_sale_returned_to_basket(basket, pending_sale):
+    expired = sweep()
+    expired.assert_called_once_with('cs_test_1')
+    pending_sale.refresh_from_db()
+    assert pending_sale.cancelled != None
+    assert Ticket.objects.filter(basket = basket).count() == 2
+    inventory = get_inventory(Ticket.objects.first().performance)
+    assert (inventory.reserved, inventory.confirmed) == (0, 0)
+
+@pytest.mark.django_db
+def test_already_expired_session_swept(pending_sale):
+    sweep(expire = {'side_effect': stripe.InvalidRequestError('Session is expired', None)}, retrieve = {'return_value': SimpleNamespace(status = 'expired')})
+    pending_sale.refresh_from_db()
+    assert pending_sale.cancelled != None
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('expire, retrieve', [
+    ({'side_effect': stripe.InvalidRequestError('Session is complete', None)}, {'return_value': SimpleNamespace(status = 'complete')}),
+    ({'side_effect': stripe.APIConnectionError('Stripe unavailable')}, {}),
+])
+def test_session_not_expired_keeps_sale(basket, pending_sale, expire, retrieve):
+
+    # A paid session (or one that could not be expired) keeps its seats until the next sweep
+    sweep(expire = expire, retrieve = retrieve)
+    pending_sale.refresh_from_db()
+    assert (pending_sale.cancelled, pending_sale.tickets.count()) == (None, 2)
+    inventory = get_inventory(Ticket.objects.first().performance)
+    assert (inventory.reserved, inventory.confirmed) == (2, 0)
+
+@pytest.mark.django_db
+def test_recent_sale_not_swept(pending_sale):
+    Sale.objects.update(updated = timezone.now())
+    expired = sweep()
+    expired.assert_not_called()
+    pending_sale.refresh_from_db()
+    assert pending_sale.cancelled == None
+
+@pytest.fixture
+def square_sale(basket):
+
+    # Box office sale waiting for the Square point of sale app
+    user = basket.user
+    sale = Sale.objects.create(festival = user.festival, user = user, boxoffice = BoxOffice.objects.create(festival = user.festival, name = 'Box office'), amount = 16, transaction_type = Sale.TRANSACTION_TYPE_SQUAREUP)
+    basket.tickets.update(basket = None, sale = sale)
+    return sale
+
+@pytest.mark.django_db
+def test_square_sale_kept_longer(square_sale):
+
+    # Kept past the Stripe TTL (a callback may still arrive)
+    Sale.objects.update(updated = timezone.now() - datetime.timedelta(hours = 2))
+    sweep()
+    square_sale.refresh_from_db()
+    assert (square_sale.cancelled, square_sale.tickets.count()) == (None, 2)
+
+    # Abandoned once past the Square TTL
+    Sale.objects.update(updated = timezone.now() - datetime.timedelta(hours = 25))
+    sweep()
+    square_sale.refresh_from_db()
+    assert square_sale.cancelled != None
+    assert square_sale.tickets.count() == 0
+
+@pytest.mark.django_db
+def test_payment_for_cancelled_sale_flagged(square_sale):
+
+    # A late payment does not complete the sale but flags it as needing a refund (once)
+    Sale.objects.update(updated = timezone.now() - datetime.timedelta(hours = 25))
+    sweep()
+    assert not complete_sale(square_sale.id, 'square_txn_1')
+    assert not complete_sale(square_sale.id, 'square_txn_1')
+    square_sale.refresh_from_db()
+    assert square_sale.completed == None
+    assert square_sale.transaction_ID == 'square_txn_1'
+    assert square_sale.notes.count(NEEDS_REFUND) == 1
+    needs_refund = SaleRefundListFilter(None, {'refund': ['needed']}, Sale, SaleAdmin)
+    assert list(needs_refund.queryset(None, Sale.objects.all())) == [square_sale]
@@ -31,7 +31,10 @@ urlpatterns = [
     path('checkout/fringer/<uuid:fringer_uuid>/remove', views.checkout_fringer_remove, name = 'checkout_fringer_remove'),
     path('checkout/stripe', views.checkout_stripe, name = 'checkout_stripe'),
     path('checkout/success/<uuid:sale_uuid>', views.checkout_success, name = 'checkout_success'),
+    path('checkout/status/<uuid:sale_uuid>', views.checkout_status, name = 'checkout_status'),
     path('checkout/cancel/<uuid:sale_uuid>', views.checkout_cancel, name = 'checkout_cancel'),
+    path('webhook/stripe', views.stripe_webhook, name = 'stripe_webhook'),
+    path('webhook/square', views.square_webhook, name = 'square_webhook'),
     path('donations', views.donations, name = 'donations'),
     path('donation/stripe', views.donation_stripe, name = 'donation_stripe'),
     path('donation/success', views.donation_success, name = 'donation_success'),
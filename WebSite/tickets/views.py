@@ -17,7 +17,6 @@ from django.urls import reverse
 from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.template.loader import render_to_string
-from django.core.mail import send_mail
 from django.views.decorators.http import require_GET, require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.cache import never_cache
@@ -30,6 +29,10 @@ from django_htmx.http import HttpResponseClientRedirect
 
 from .models import Sale, Refund, Basket, FringerType, Fringer, TicketType, Ticket, Donation, PayAsYouWill
 from .forms import BuyTicketForm, RenameFringerForm, BuyFringerForm, CheckoutButtonsForm
+from .inventory import reserve
+from .bulk import create_tickets, move_basket_to_sale
+from .payments import cancel_stripe_sale, record_square_event, record_stripe_event, verify_square_signature
+from .credits import redeem, mark_redeemed
 from program.models import Show, ShowPerformance
 
 # Logging
@@ -153,8 +156,15 @@ def myaccount(request):
 @transaction.atomic
 def myaccount_ticket_cancel(request, ticket_uuid):
 
-    # Get ticket to be cancelled
-    ticket = get_object_or_404(Ticket, uuid = ticket_uuid)
+    # Get ticket to be cancelled (locked so a repeated submit waits and then finds the refund)
+    ticket = get_object_or_404(Ticket.objects.select_for_update(), uuid = ticket_uuid)
+    if ticket.user != request.user:
+        logger.warning(f"Ticket {ticket.id} cancel by {request.user} rejected (not their ticket)")
+        messages.error(request, "This ticket cannot be cancelled")
+        return HttpResponseClientRedirect(reverse('tickets:myaccount'))
+    if ticket.refund:
+        messages.error(request, f"{ticket.description} ticket for {ticket.performance.show.name} has already been cancelled")
+        return HttpResponseClientRedirect(reverse('tickets:myaccount'))
 
     # Create a refund and add the ticket
     refund = Refund(
@@ -375,14 +385,7 @@ def buy_tickets_add(request, performance_uuid):
 
                 # Create tickets and add to basket
                 if quantity > 0:
-                    for i in range(0, quantity):
-                        ticket = Ticket(
-                            performance = performance,
-                            type = ticket_type,
-                            user = request.user,
-                            basket = basket,
-                        )
-                        ticket.save()
+                    create_tickets(performance, ticket_type, quantity, request.user, basket = basket)
 
                     # Confirm purchase
                     logger.info(f"{quantity} x {ticket_type.name} tickets for {performance.show.name} on {performance.date} at {performance.time} added to basket")
@@ -427,9 +430,9 @@ def buy_fringers_use(request, performance_uuid):
     basket = request.user.basket
     performance = get_object_or_404(ShowPerformance, uuid = performance_uuid)
 
-    # Check if there are still enough tickets available
+    # Reserve seats for the tickets
     tickets_requested = len(request.POST.getlist('fringer_id'))
-    if (tickets_requested > 0) and (tickets_requested <= performance.tickets_available()):
+    if (tickets_requested > 0) and reserve(performance, tickets_requested):
 
         # Create a sale
         sale = Sale(
@@ -443,18 +446,18 @@ def buy_fringers_use(request, performance_uuid):
         # Process each checked fringer
         for fringer_id in request.POST.getlist('fringer_id'):
 
-            # Get fringer and double check that it has not been used for this performance
-            fringer = Fringer.objects.get(pk = int(fringer_id))
-            if fringer.is_available(performance):
+            # Get fringer and redeem a credit (this also checks that it has not been used for this performance)
+            fringer = get_object_or_404(Fringer, pk = int(fringer_id), user = request.user)
+            if redeem(fringer, performance):
 
                 # Create ticket and add to sale
-                ticket = Ticket(
+                ticket = mark_redeemed(Ticket(
                     user = request.user,
                     performance = performance,
                     type = fringer.type.ticket_type,
                     fringer = fringer,
                     sale = sale,
-                )
+                ))
                 ticket.save()
 
                 # Confirm purchase
@@ -462,8 +465,9 @@ def buy_fringers_use(request, performance_uuid):
                 messages.success(request, f"Ticket purchased with eFringer {fringer.name}")
 
             else:
-                # Fringer already used for this performance
-                logger.warn(f"eFringer {fringer.name} already used for this perfromance")
+                # Fringer has no credits left or has already been used for this performance
+                logger.warn(f"eFringer {fringer.name} not available for this perfromance")
+                messages.warning(request, f"eFringer {fringer.name} is not available for this performance")
 
         # Confirm purchase
         return HttpResponseClientRedirect(reverse('tickets:buy_fringers_use_confirm', args = [performance.uuid]))
@@ -555,8 +559,8 @@ def buy_volunteer_use(request, performance_uuid):
     basket = request.user.basket
     performance = get_object_or_404(ShowPerformance, uuid = performance_uuid)
 
-    # Check if there are still enough tickets available
-    if (performance.tickets_available() > 0):
+    # Reserve a seat for the ticket
+    if reserve(performance, 1):
 
         # Create a sale
         sale = Sale(
@@ -649,14 +653,17 @@ def payw_donate(request, show_uuid):
         # Create donations for each fringer seleted
         for fringer_id in fringer_ids:
 
-            # Get fringer and donate to this show
-            fringer = Fringer.objects.get(pk = int(fringer_id))
-            payw = PayAsYouWill(
+            # Get fringer and donate a credit to this show
+            fringer = get_object_or_404(Fringer, pk = int(fringer_id), user = request.user)
+            if not redeem(fringer):
+                messages.warning(request, f"eFringer {fringer.name} has no credits remaining")
+                continue
+            payw = mark_redeemed(PayAsYouWill(
                 sale = sale,
                 show = show,
                 fringer = fringer,
                 amount = fringer.type.ticket_type.payment,
-            )
+            ))
             payw.save()
 
             # Confirm donation
@@ -858,58 +865,60 @@ def checkout_stripe(request):
     # Get basket
     basket = request.user.basket
 
-    # Check that tickets are still available
-    tickets_available = True
-    for p in basket.tickets.values('performance').annotate(count = Count('performance')):
-        performance = ShowPerformance.objects.get(pk = p["performance"])
-        available = performance.tickets_available()
-        if p["count"] > available:
-            messages.error(request, f"Your basket contains {p['count']} tickets for {performance.show.name} but there are only {available} tickets available.")
-            logger.info(f"Basket contains {p['count']} tickets for {performance.show.name} but there are only {available} available")
-            tickets_available = False
+    # Phase 1: reserve the seats and move the basket to a pending sale. The transaction (and the
+    # inventory row locks taken by reserve) is committed before Stripe is called.
+    with transaction.atomic():
+
+        # Reserve seats for the tickets in the basket
+        tickets_available = True
+        for p in basket.tickets.values('performance').annotate(count = Count('performance')):
+            performance = ShowPerformance.objects.get(pk = p["performance"])
+            if not reserve(performance, p["count"]):
+                available = performance.tickets_available()
+                messages.error(request, f"Your basket contains {p['count']} tickets for {performance.show.name} but there are only {available} tickets available.")
+                logger.info(f"Basket contains {p['count']} tickets for {performance.show.name} but there are only {available} available")
+                tickets_available = False
+
+        # If tickets no longer available undo any reservations
+        if not tickets_available:
+            transaction.set_rollback(True)
 
-    # If tickets no longer available redisplay checkout with notifications
+        # Create sale and move tickets and fringers from basket to sale
+        else:
+            sale = Sale(
+                festival = request.festival,
+                user = request.user,
+                customer = request.user.email,
+                amount = basket.total_cost,
+                transaction_type = Sale.TRANSACTION_TYPE_STRIPE,
+                transaction_fee = 0,
+            )
+            sale.save()
+            logger.info(f"Sale {sale.id} created")
+            move_basket_to_sale(basket, sale)
+            sale.buttons = basket.buttons
+            sale.save()
+            basket.buttons = 0
+            basket.save()
+
+    # Redisplay checkout with notifications (once the reservations have been rolled back)
     if not tickets_available:
         messages.error(request, "Your card has not been charged.")
         context = {
-            'basket': basket
+            'basket': basket,
+            'buttons_form': checkout_buttons_form(basket),
         }
         return render(request, "tickets/checkout.html", context)
 
-    # Use a transaction to protect the conversion of basket to sale and creation of Stripe session
-    with transaction.atomic():
-
-        # Create sale and move tickets and fringers from basket to sale
-        sale = Sale(
-            festival = request.festival,
-            user = request.user,
-            customer = request.user.email,
-            amount = basket.total_cost,
-            transaction_type = Sale.TRANSACTION_TYPE_STRIPE,
-            transaction_fee = 0,
-        )
-        sale.save()
-        logger.info(f"Sale {sale.id} created")
-        for ticket in basket.tickets.all():
-            ticket.basket = None
-            ticket.sale = sale
-            ticket.save()
-            logger.info(f"{ticket.description} ticket for {ticket.performance.show.name} on {ticket.performance.date} at {ticket.performance.time} added to sale {sale.id}")
-        for fringer in basket.fringers.all():
-            fringer.basket = None
-            fringer.sale = sale
-            fringer.save()
-            logger.info(f"eFringer {fringer.name} added to sale {sale.id}")
-        sale.buttons = basket.buttons
-        sale.save()
-        basket.buttons = 0
-        basket.save()
-
-        # Create Stripe session
+    # Phase 2: create the Stripe session outside any transaction (if that fails the sale is
+    # returned to the basket). The session expires before sweep_pending_sales abandons the sale
+    # (Stripe's minimum is 30 minutes, the sweeper expires the session itself if the TTL is shorter).
+    try:
         stripe.api_key = settings.STRIPE_PRIVATE_KEY
         session = stripe.checkout.Session.create(
             client_reference_id = str(sale.id),
-            customer_email = basket.user.email,
+            expires_at = int(timezone.now().timestamp()) + 60 * max(getattr(settings, 'PENDING_SALE_TTL_MINUTES', 60), 30),
+            customer_email = request.user.email,
             payment_method_types = ['card'],
             mode = 'payment',
             line_items = [{
@@ -926,79 +935,103 @@ def checkout_stripe(request):
             success_url = request.build_absolute_uri(reverse('tickets:checkout_success', args=[sale.uuid])),
             cancel_url = request.build_absolute_uri(reverse('tickets:checkout_cancel', args=[sale.uuid])),
         )
-        logger.info(f"Stripe PI {session.id} created for sale {sale.id}")
-        sale.transaction_ID = session.id
-        sale.save()
+    except stripe.StripeError as e:
+        logger.error(f"Stripe session for sale {sale.id} failed: {e}")
+        with transaction.atomic():
+            cancel_stripe_sale(sale, basket)
+        messages.error(request, "Card payments are not available at the moment. Your card has not been charged.")
+        context = {
+            'basket': basket,
+            'buttons_form': checkout_buttons_form(basket),
+        }
+        return render(request, "tickets/checkout.html", context)
 
+    # Record the session id
+    Sale.objects.filter(pk = sale.pk).update(transaction_ID = session.id, updated = timezone.now())
+    logger.info(f"Stripe PI {session.id} created for sale {sale.id}")
     return redirect(session.url, code=303)
 
 @login_required
 @require_GET
 def checkout_success(request, sale_uuid):
 
-    # Get sale and mark as complete
-    sale = get_object_or_404(Sale, uuid = sale_uuid)
-    sale.completed = timezone.now()
-    sale.save()
-    logger.info(f"Stripe payment for sale {sale.id} succeeded")
-    logger.info(f"Credit card charged £{sale.total_cost:2f}")
-    logger.info(f"Sale {sale.id} completed")
-
-    # Send e-mail to confirm tickets
-    if sale.tickets or sale.buttons:
-        context = {
-            'festival': request.festival,
-            'fringers': sale.fringers.order_by('name'),
-            'tickets': sale.tickets.order_by('performance__date', 'performance__time', 'performance__show__name'),
-            'badges': sale.buttons,
-        }
-        body = render_to_string('tickets/sale_email.txt', context)
-        send_mail('Confirmation from ' + request.festival.title, body, settings.DEFAULT_FROM_EMAIL, [request.user.email])
-
-    # Display confirmation
+    # The sale is completed by the Stripe webhook (see tickets.payments) so this page only shows
+    # the sale if that has happened and otherwise waits for it
+    sale = get_object_or_404(Sale, uuid = sale_uuid, user = request.user)
+    if sale.cancelled:
+        messages.error(request, "Your payment was not completed. Your card has not been charged.")
+        return redirect(reverse('tickets:checkout'))
     context = {
         'sale': sale,
     }
+    if not sale.completed:
+        return render(request, 'tickets/checkout_pending.html', context)
     return render(request, 'tickets/checkout_confirm.html', context)
 
+@login_required
+@require_GET
+def checkout_status(request, sale_uuid):
+
+    # Polled by the pending page until the sale is completed (or cancelled)
+    sale = get_object_or_404(Sale, uuid = sale_uuid, user = request.user)
+    if sale.completed or sale.cancelled:
+        return HttpResponseClientRedirect(reverse('tickets:checkout_success', args = [sale.uuid]))
+    return HttpResponse(status = 204)
 
 @login_required
 @require_GET
+@transaction.atomic
 def checkout_cancel(request, sale_uuid):
 
     # Get basket and sale
     basket = request.user.basket
-    sale = get_object_or_404(Sale, uuid = sale_uuid)
-    logger.info(f"Stripe payment for sale {sale.id} cancelled")
+    sale = get_object_or_404(Sale.objects.select_for_update(), uuid = sale_uuid)
 
-    # Move sale items back into basket and delete sale
-    for ticket in sale.tickets.all():
-        ticket.basket = basket
-        ticket.sale = None
-        ticket.save()
-        logger.info(f"{ticket.description} ticket for {ticket.performance.show.name} on {ticket.performance.date} at {ticket.performance.time} returned to basket {basket.user.id}")
-    for fringer in sale.fringers.all():
-        fringer.basket = basket
-        fringer.sale = None
-        fringer.save()
-        logger.info(f"eFringer {fringer.name} returned to basket {basket.user.id}")
-    basket.buttons = sale.buttons
-    basket.save()
-    sale.buttons = 0
-    sale.amount = 0
-    sale.transaction_type = None
-    sale.transaction_fee = 0
-    sale.cancelled = timezone.now()
-    sale.save()
-    logger.info(f"Sale {sale.id} cancelled")
+    # A sale that has already been paid (or cancelled) is left alone
+    if sale.completed:
+        return redirect(reverse('tickets:checkout_success', args = [sale.uuid]))
+    if not sale.cancelled:
+        logger.info(f"Stripe payment for sale {sale.id} cancelled")
+        cancel_stripe_sale(sale, basket)
 
     # Display checkout with notification
     messages.error(request, f"Payment cancelled. Your card has not been charged.")
     context = {
-        'basket': basket
+        'basket': basket,
+        'buttons_form': checkout_buttons_form(basket),
     }
     return render(request, "tickets/checkout.html", context)
 
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+
+    # Check the signature and store the event (duplicates are acknowledged but not stored again)
+    try:
+        stripe.Webhook.construct_event(request.body, request.headers.get('Stripe-Signature', ''), settings.STRIPE_WEBHOOK_SECRET)
+        payload = json.loads(request.body)
+    except (ValueError, stripe.SignatureVerificationError) as e:
+        logger.warning(f"Stripe webhook rejected: {e}")
+        return HttpResponse(status = 400)
+    record_stripe_event(payload)
+    return HttpResponse(status = 200)
+
+@csrf_exempt
+@require_POST
+def square_webhook(request):
+
+    # Check the signature and store the event (duplicates are acknowledged but not stored again)
+    if not verify_square_signature(request.body, request.headers.get('X-Square-Hmacsha256-Signature', ''), request.build_absolute_uri()):
+        logger.warning("Square webhook rejected: invalid signature")
+        return HttpResponse(status = 400)
+    try:
+        payload = json.loads(request.body)
+        record_square_event(payload)
+    except (ValueError, KeyError) as e:
+        logger.warning(f"Square webhook rejected: {e}")
+        return HttpResponse(status = 400)
+    return HttpResponse(status = 200)
+
 @require_GET
 def donations(request):
 
@@ -35,6 +35,8 @@ from reportlab.lib import colors
 from core.models import User
 from program.models import Show, ShowPerformance, Venue
 from tickets.models import Sale, TicketType, Ticket, FringerType,  Fringer, Checkpoint, BadgesIssued
+from tickets.inventory import reserve
+from tickets.payments import process_event, record_square_callback
 from .forms import OpenCheckpointForm, SaleItemsForm, SaleUpdateForm, CloseCheckpointForm
 
 # Logging
@@ -99,17 +101,13 @@ def square_callback(request):
         # Display main page with the sale still selected
         return redirect(reverse('venue:main_performance_sale', args=[venue.uuid, performance.uuid, sale.uuid]))
 
-    # Tokens for venue ticket sales are issued immediately
-    for ticket in sale.tickets.all():
-        ticket.token_issued = True
-        ticket.save()
-
-    # Complete the sale
-    sale.transaction_ID = server_transaction_id
-    sale.completed = timezone.now()
-    sale.save()
-    logger.info(f"Sale {sale.id} completed (SquareUp)")
-    messages.success(request, "Card payment completed")
+    # Record the payment and complete the sale (repeated callbacks are ignored and, if completing
+    # the sale fails, it is completed later by the process_payment_events command)
+    event, created = record_square_callback(sale, server_transaction_id, client_transaction_id)
+    if process_event(event.id):
+        messages.success(request, "Card payment completed")
+    else:
+        messages.warning(request, "Card payment received, the sale will be completed shortly")
 
     # Display main page for new sale
     return redirect(reverse('venue:main_performance', args=[venue.uuid, performance.uuid]))
@@ -422,10 +420,10 @@ def sale_items(request, performance_uuid, sale_uuid):
     form = sale_items_form(performance, sale, request.POST)
     if form.is_valid():
 
-        # Check if there are sufficient tickets
+        # Reserve seats for any additional tickets
         requested_tickets = form.ticket_count
-        available_tickets = performance.tickets_available() + sale.tickets.count()
-        if requested_tickets <= available_tickets:
+        current_tickets = sale.tickets.count()
+        if reserve(performance, requested_tickets - current_tickets):
 
             # Adjust ticket numbers
             for ticket_type in form.ticket_types:
@@ -471,6 +469,7 @@ def sale_items(request, performance_uuid, sale_uuid):
 
         # Insufficient tickets
         else:
+            available_tickets = performance.tickets_available() + current_tickets
             logger.info(f"Sale {sale.id} insufficient tickets ({requested_tickets} requested, {available_tickets} available)")
             form.add_error(None, f"There are only {available_tickets} tickets available for this performance.")
 
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class VolunteersConfig(AppConfig):
     name = 'volunteers'
+
+    def ready(self):
+        # Connect signals using @receiver
+        from . import signals
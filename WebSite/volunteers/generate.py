@@ -0,0 +1,63 @@
+from collections import defaultdict
+
+from django.db import transaction
+
+from program.models import ShowPerformance
+from .models import Shift
+from .openshifts import invalidate_open_shifts
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Shift generation
+#
+# Shifts are generated from templates for a range of dates. The existing shifts for the dates
+# and locations are loaded once into an index of time intervals by (location, role, date) and each
+# candidate is checked against the index (and the candidates already accepted) in memory. The
+# accepted shifts are then inserted with a single bulk_create, or just returned for a test run
+# (bulk_create does not send the Shift signals but generated shifts have no volunteer yet, so
+# only the open shifts cache needs to be invalidated).
+def load_shift_index(locations, dates):
+
+    # Existing shift times by (location, role, date)
+    index = defaultdict(list)
+    for location_id, role_id, date, start_time, end_time in Shift.objects.filter(location__in=locations, date__in=dates).values_list('location_id', 'role_id', 'date', 'start_time', 'end_time'):
+        index[(location_id, role_id, date)].append((start_time, end_time))
+    return index
+
+def shift_overlaps(index, shift):
+
+    # Check if any shift in the index overlaps the supplied shift (with the same location and role)
+    for start_time, end_time in index[(shift.location_id, shift.role_id, shift.date)]:
+        if (shift.start_time < end_time) and (shift.end_time > start_time):
+            return True
+    return False
+
+def performances_by_date(venue, dates):
+
+    # Performances (with their shows) at the venue for each date
+    performances = defaultdict(list)
+    for performance in ShowPerformance.objects.filter(venue=venue, date__in=dates).select_related('show').order_by('date', 'time'):
+        performances[performance.date].append(performance)
+    return performances
+
+def generate_shifts(candidates, locations, dates, dry_run=False):
+
+    # Keep the candidates that do not overlap an existing shift or an earlier candidate
+    with transaction.atomic():
+        index = load_shift_index(locations, dates)
+        shifts = []
+        for shift in candidates:
+            if not shift_overlaps(index, shift):
+                index[(shift.location_id, shift.role_id, shift.date)].append((shift.start_time, shift.end_time))
+                shifts.append(shift)
+
+        # Save them (unless this is a test run)
+        if not dry_run:
+            Shift.objects.bulk_create(shifts)
+            for festival_id in {location.festival_id for location in locations}:
+                invalidate_open_shifts(festival_id)
+            logger.info(f"{len(shifts)} shifts generated")
+    return shifts
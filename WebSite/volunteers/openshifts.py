@@ -0,0 +1,78 @@
+import uuid
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from tickets.entitlements import record
+from .models import Commitment, Shift
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Open shifts
+#
+# The shifts a volunteer can accept depend only on the festival, their roles and whether they have
+# a DBS check, so the open shifts for each combination are loaded in one query (with their
+# locations, roles and commitments), grouped by date and held in the shared (database) cache. Any
+# change to the festival's shifts, commitments, roles or locations invalidates every entry for the
+# festival by changing its version once the change is committed (see volunteers.signals). Shifts are claimed with a conditional UPDATE
+# so when two volunteers accept the same shift at once only one of them gets it.
+def _version_key(festival_id):
+    return f'volunteers:open_shifts_version:{festival_id}'
+
+def _open_shifts_key(festival_id, version, role_ids, is_dbs):
+    return f'volunteers:open_shifts:{festival_id}:{version}:{",".join(str(id) for id in role_ids)}:{int(is_dbs)}'
+
+def get_open_shifts(festival, role_ids, is_dbs):
+
+    # Get the festival's cache version (starting a new one if necessary)
+    version = cache.get(_version_key(festival.id))
+    if version == None:
+        version = uuid.uuid4().hex
+        cache.set(_version_key(festival.id), version, None)
+
+    # Get open shifts by date from the cache (loading them if necessary)
+    role_ids = sorted(role_ids)
+    key = _open_shifts_key(festival.id, version, role_ids, is_dbs)
+    days = cache.get(key)
+    if days == None:
+        shifts = Shift.objects.filter(location__festival=festival, volunteer_can_accept=True, user__isnull=True, role__in=role_ids)
+        if not is_dbs:
+            shifts = shifts.filter(needs_dbs=False)
+        shifts = shifts.select_related('location', 'role', 'commitment').prefetch_related(Prefetch('commitment__shifts', queryset=Shift.objects.select_related('location', 'role')))
+        by_date = defaultdict(list)
+        for shift in shifts.order_by('date', 'start_time'):
+            by_date[shift.date].append(shift)
+        days = [{'date': date, 'shifts': day_shifts} for date, day_shifts in by_date.items()]
+        cache.set(key, days, None)
+    return days
+
+def invalidate_open_shifts(festival_id):
+
+    # Start a new version once the change is committed (so a concurrent request cannot cache the
+    # old shifts under the new version)
+    transaction.on_commit(lambda: cache.delete(_version_key(festival_id)))
+
+def claim_shift(shift, user):
+
+    # Assign the shift (or all the shifts in its commitment) to the volunteer unless another
+    # volunteer has already claimed it
+    if shift.commitment_id:
+        if not Commitment.objects.filter(pk=shift.commitment_id, user__isnull=True).update(user=user, updated=timezone.now()):
+            return False
+        commitment = Commitment.objects.get(pk=shift.commitment_id)
+        commitment.update_shifts()
+    else:
+        if not Shift.objects.filter(pk=shift.pk, user__isnull=True).update(user=user, updated=timezone.now()):
+            return False
+
+        # The update does not send the Shift signals so record the comps earned
+        record(user.id, f'Shift {shift.id}', comps_earned=shift.role.comps_per_shift)
+    invalidate_open_shifts(shift.location.festival_id)
+    logger.info(f"Shift {shift.id} accepted by {user}")
+    return True
@@ -0,0 +1,21 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Role, Location, Shift, Commitment
+from .openshifts import invalidate_open_shifts
+
+
+# Open shifts cache (see volunteers.openshifts)
+@receiver(post_save, sender = Role)
+@receiver(post_delete, sender = Role)
+@receiver(post_save, sender = Location)
+@receiver(post_delete, sender = Location)
+@receiver(post_save, sender = Commitment)
+@receiver(post_delete, sender = Commitment)
+def open_shifts_changed(sender, instance, **kwargs):
+    invalidate_open_shifts(instance.festival_id)
+
+@receiver(post_save, sender = Shift)
+@receiver(post_delete, sender = Shift)
+def shift_changed(sender, instance, **kwargs):
+    invalidate_open_shifts(instance.location.festival_id)
@@ -0,0 +1,56 @@
+import datetime
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.models import Festival, User
+from volunteers.models import Location, Role, Shift
+
+
+@pytest.fixture
+def festival(client):
+    festival = Festival.objects.create(name = 'TEST', title = 'Test festival', is_live = True)
+    admin = User.objects.create_user(festival, 'admin@example.com', 'password')
+    admin.is_admin = True
+    admin.save()
+    client.force_login(admin)
+    return festival
+
+def generate_fixed(client, location, role, action, templates):
+
+    # Post shift templates for 1-3 June
+    data = {
+        'form-TOTAL_FORMS': len(templates),
+        'form-INITIAL_FORMS': 0,
+        'from_date': '2026-06-01',
+        'to_date': '2026-06-03',
+        'location': location.id,
+        'action': action,
+    }
+    for i, (start_time, end_time) in enumerate(templates):
+        data.update({f'form-{i}-role': role.id, f'form-{i}-start_time': start_time, f'form-{i}-end_time': end_time})
+    return client.post(reverse('volunteers:admin_shift_generate_fixed'), data)
+
+
+@pytest.mark.django_db
+def test_test_run_does_not_write(client, festival):
+    location = Location.objects.create(festival = festival, description = 'Bar')
+    role = Role.objects.create(festival = festival, description = 'Bar staff')
+    response = generate_fixed(client, location, role, 'Test', [('10:00', '12:00')])
+    assert len(response.context['shifts']) == 3
+    assert Shift.objects.count() == 0
+
+@pytest.mark.django_db
+def test_overlapping_shifts_are_skipped(client, festival):
+
+    # The existing shift on 2 June and the overlapping template are skipped
+    location = Location.objects.create(festival = festival, description = 'Bar')
+    role = Role.objects.create(festival = festival, description = 'Bar staff')
+    Shift.objects.create(location = location, role = role, date = datetime.date(2026, 6, 2), start_time = datetime.time(11, 0), end_time = datetime.time(13, 0))
+    with CaptureQueriesContext(connection) as queries:
+        response = generate_fixed(client, location, role, 'Generate', [('10:00', '12:00'), ('11:00', '14:00'), ('14:00', '16:00')])
+    assert [q['sql'].split()[0] for q in queries.captured_queries if '"volunteers_shift"' in q['sql']] == ['SELECT', 'INSERT']
+    assert len(response.context['shifts']) == 5
+    assert sorted(Shift.objects.values_list('date__day', 'start_time__hour')) == [(1, 10), (1, 14), (2, 11), (2, 14), (3, 10), (3, 14)]
@@ -0,0 +1,71 @@
+import datetime
+
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.models import Festival, User
+from volunteers.models import Location, Role, Shift
+
+
+@pytest.fixture
+def festival():
+    cache.clear()
+    return Festival.objects.create(name = 'TEST', title = 'Test festival', is_live = True)
+
+@pytest.fixture
+def role(festival):
+    return Role.objects.create(festival = festival, description = 'Bar staff', comps_per_shift = 1)
+
+@pytest.fixture
+def shifts(festival, role):
+
+    # Two open shifts on each of 1-3 June
+    location = Location.objects.create(festival = festival, description = 'Bar')
+    return [Shift.objects.create(location = location, role = role, date = datetime.date(2026, 6, day), start_time = datetime.time(hour, 0), end_time = datetime.time(hour + 2, 0)) for day in (1, 2, 3) for hour in (10, 14)]
+
+def volunteer(festival, role, email):
+    user = User.objects.create_user(festival, email, 'password')
+    user.is_volunteer = True
+    user.save()
+    user.volunteer_roles.add(role)
+    return user
+
+
+@pytest.mark.django_db
+def test_open_shifts_loaded_once(client, festival, role, shifts, django_capture_on_commit_callbacks):
+    client.force_login(volunteer(festival, role, 'volunteer@example.com'))
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(reverse('volunteers:shift_list'))
+    assert [(day['date'].day, len(day['shifts'])) for day in response.context['days']] == [(1, 2), (2, 2), (3, 2)]
+    assert len([q for q in queries.captured_queries if 'FROM "volunteers_shift"' in q['sql']]) == 2
+    with CaptureQueriesContext(connection) as queries:
+        client.get(reverse('volunteers:shift_list'))
+    assert len([q for q in queries.captured_queries if 'FROM "volunteers_shift"' in q['sql']]) == 1
+
+    # Saving a shift invalidates the cached shifts once it is committed
+    with django_capture_on_commit_callbacks(execute = True):
+        shifts[0].volunteer_can_accept = False
+        shifts[0].save()
+        response = client.get(reverse('volunteers:shift_list'))
+        assert [(day['date'].day, len(day['shifts'])) for day in response.context['days']] == [(1, 2), (2, 2), (3, 2)]
+    response = client.get(reverse('volunteers:shift_list'))
+    assert [(day['date'].day, len(day['shifts'])) for day in response.context['days']] == [(1, 1), (2, 2), (3, 2)]
+
+@pytest.mark.django_db
+def test_shift_claimed_once(client, festival, role, shifts, django_capture_on_commit_callbacks):
+    first = volunteer(festival, role, 'first@example.com')
+    second = volunteer(festival, role, 'second@example.com')
+    client.force_login(first)
+    with django_capture_on_commit_callbacks(execute = True):
+        client.get(reverse('volunteers:shift_accept', args = [shifts[0].uuid]))
+    client.force_login(second)
+    with django_capture_on_commit_callbacks(execute = True):
+        response = client.get(reverse('volunteers:shift_accept', args = [shifts[0].uuid]))
+    assert [str(m) for m in response.context['messages']] == ['Shift has been accepted by another volunteer']
+    shifts[0].refresh_from_db()
+    assert shifts[0].user == first
+    assert (first.volunteer_comps_earned, second.volunteer_comps_earned) == (1, 0)
+    assert [len(day['shifts']) for day in response.context['days']] == [1, 2, 2]
@@ -21,9 +21,10 @@ from crispy_forms.bootstrap import FormActions, TabHolder, Tab
 
 from core.models import User
 from content.models import Document
-from program.models import ShowPerformance
 
 from .models import Role, Location, Shift, Commitment
+from .generate import generate_shifts, performances_by_date
+from .openshifts import get_open_shifts, claim_shift
 from .forms import (
     AdminRoleForm, AdminLocationForm, AdminShiftForm, AdminCommitmentForm,
     AdminShiftFixedForm, AdminShiftFixedFormset, AdminShiftGenerateFixedForm,
@@ -39,20 +40,10 @@ logger = logging.getLogger(__name__)
 
 def render_shifts(request, user):
 
-    # Get available shifts
-    shifts = Shift.objects.filter(location__festival=request.festival, volunteer_can_accept=True, user__isnull=True, role__in=user.volunteer_roles.all())
-    if user.is_dbs == False:
-        shifts = shifts.filter(needs_dbs = False)
-
-    # Get days that have shifts defined
-    days = []
-    for day in shifts.order_by('date').values('date').distinct():
-        days.append({
-            'date': day['date'],
-            'shifts': shifts.filter(date = day['date']).order_by('start_time')
-        })
+    # Get available shifts grouped by date
+    days = get_open_shifts(request.festival, user.volunteer_roles.values_list('id', flat=True), user.is_dbs)
     context = {
-        'my_shifts': user.volunteer_shifts.all(),
+        'my_shifts': user.volunteer_shifts.select_related('location', 'role'),
         'can_cancel': settings.VOLUNTEER_CANCEL_SHIFTS,
         'days': days,
     }
@@ -73,42 +64,36 @@ def shift_list(request):
 
 
 @login_required
-@transaction.atomic
 def shift_accept(request, slug):
 
     # Get shift and assign to volunteer (if the shift is part of a commitment assign all shifts
     # in the commitment)
-    shift = get_object_or_404(Shift, uuid=slug)
-    if not shift.user:
-        if shift.commitment:
-            shift.commitment.user = request.user
-            shift.commitment.save()
-            shift.commitment.update_shifts()
-        else:
-            shift.user = request.user
-            shift.save()
+    shift = get_object_or_404(Shift.objects.select_related('location', 'role'), uuid=slug)
+    with transaction.atomic():
+        claimed = claim_shift(shift, request.user)
+    if claimed:
         messages.success(request, 'Shift accepted')
     else:
         messages.error(request, 'Shift has been accepted by another volunteer')
 
-    # Render the page
+    # Render the page (after the commit so the open shifts are up to date)
     return render_shifts(request, request.user)
 
 
 @login_required
-@transaction.atomic
 def shift_cancel(request, slug):
 
     # Get shift and de-assign
-    shift = get_object_or_404(Shift, uuid=slug)
-    if shift.user == request.user:
-        shift.user = None
-        shift.save()
-        messages.success(request, 'Shift cancelled')
-    else:
-        messages.error(request, 'Shift is assigned to another volunteer')
+    with transaction.atomic():
+        shift = get_object_or_404(Shift.objects.select_for_update(), uuid=slug)
+        if shift.user == request.user:
+            shift.user = None
+            shift.save()
+            messages.success(request, 'Shift cancelled')
+        else:
+            messages.error(request, 'Shift is assigned to another volunteer')
 
-    # Render the page
+    # Render the page (after the commit so the open shifts are up to date)
     return render_shifts(request, request.user)
 
 
@@ -831,14 +816,6 @@ def admin_shift_delete(request, slug):
     return redirect('volunteers:admin_shift_list')
 
 
-def existing_shift_overlaps(shift):
-
-    # Check if any existing shifts overlap the supplied shift (with he same location and role)
-    for existing in Shift.objects.filter(location=shift.location, role=shift.role, date=shift.date):
-        if (shift.start_time < existing.end_time) and (shift.end_time > existing.start_time):
-            return True
-    return False
-
 @login_required
 def admin_shift_generate_fixed(request):
 
@@ -865,6 +842,7 @@ def admin_shift_generate_fixed(request):
     )
 
     shifts = []
+    dry_run = request.POST.get('action', None) == 'Test'
     if request.method == 'POST':
 
         # Validate shift templates and generation parameters
@@ -876,7 +854,8 @@ def admin_shift_generate_fixed(request):
             dates = [from_date + datetime.timedelta(days=x) for x in range((to_date - from_date).days + 1)]
             location = generate_form.cleaned_data['location']
 
-            # Process each shift template
+            # Create a candidate shift for each shift template and date
+            candidates = []
             for form in template_formset:
 
                 # Get template details
@@ -886,16 +865,11 @@ def admin_shift_generate_fixed(request):
                     end_time = form.cleaned_data['end_time']
                     admin = form.cleaned_data['admin']
                     for date in dates:
-                        shift = Shift(location=location, role=role, date=date, start_time=start_time, end_time=end_time, volunteer_can_accept=not admin)
-                        if not existing_shift_overlaps(shift):
-                            shift.save()
-                            shifts.append(shift)
-        
-        # If test only delete generated shifts
-        if request.POST.get('action', None) == 'Test':
-            for shift in shifts:
-                shift.delete()
-        
+                        candidates.append(Shift(location=location, role=role, date=date, start_time=start_time, end_time=end_time, volunteer_can_accept=not admin))
+
+            # Save the shifts that do not overlap existing shifts (unless this is a test)
+            shifts = generate_shifts(candidates, [location], dates, dry_run=dry_run)
+
     context = {
         'breadcrumbs': [
             { 'text': 'Volunteer Admin', 'url': reverse('volunteers:admin_home') },
@@ -905,6 +879,7 @@ def admin_shift_generate_fixed(request):
         'template_formset': template_formset,
         'generate_form': generate_form,
         'shifts': shifts,
+        'dry_run': dry_run,
     }
     return render(request, 'volunteers/admin_shift_generate.html', context)
 
@@ -953,6 +928,7 @@ def admin_shift_generate_venue(request):
     )
 
     shifts = []
+    dry_run = request.POST.get('action', None) == 'Test'
     if request.method == 'POST':
 
         # Validate shift templates and generation parameters
@@ -964,8 +940,10 @@ def admin_shift_generate_venue(request):
             dates = [from_date + datetime.timedelta(days=x) for x in range((to_date - from_date).days + 1)]
             venue = generate_form.cleaned_data['venue']
             location = generate_form.cleaned_data['location']
+            performances = performances_by_date(venue, dates)
 
-            # Process each shift template
+            # Create a candidate shift for each shift template and performance
+            candidates = []
             for form in template_formset:
 
                 # Get template details
@@ -977,19 +955,14 @@ def admin_shift_generate_venue(request):
                     end_type = form.cleaned_data['end_type']
                     admin = form.cleaned_data['admin']
                     for date in dates:
-                        for performance in ShowPerformance.objects.filter(venue=venue, date=date):
+                        for performance in performances[date]:
                             shift_start = calc_shift_time(performance, start_type, start_mins)
                             shift_end = calc_shift_time(performance, end_type, end_mins)
-                            shift = Shift(location=location, role=role, date=date, start_time=shift_start, end_time=shift_end, volunteer_can_accept=not admin)
-                            if not existing_shift_overlaps(shift):
-                                shift.save()
-                                shifts.append(shift)
-        
-        # If test only delete generated shifts
-        if request.POST.get('action', None) == 'Test':
-            for shift in shifts:
-                shift.delete()
-        
+                            candidates.append(Shift(location=location, role=role, date=date, start_time=shift_start, end_time=shift_end, volunteer_can_accept=not admin))
+
+            # Save the shifts that do not overlap existing shifts (unless this is a test)
+            shifts = generate_shifts(candidates, [location], dates, dry_run=dry_run)
+
     context = {
         'breadcrumbs': [
             { 'text': 'Volunteer Admin', 'url': reverse('volunteers:admin_home') },
@@ -999,6 +972,7 @@ def admin_shift_generate_venue(request):
         'template_formset': template_formset,
         'generate_form': generate_form,
         'shifts': shifts,
+        'dry_run': dry_run,
     }
     return render(request, 'volunteers/admin_shift_generate.html', context)
 
@@ -103,6 +103,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'tickets.context_processors.basket',
             ],
         },
     },
@@ -143,12 +144,29 @@ LOGOUT_REDIRECT_URL = "/home"
 CRISPY_ALLOWED_TEMPLATE_PACKS = 'bootstrap4'
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
+# Cache (shared by every process so the cached festivals, menus, schedules, etc. are invalidated
+# everywhere when they change; the table is created by the core migrations)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'core_cache',
+    },
+}
+
 # Sessions
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 
 # Application settings
 FESTIVAL_COOKIE = 'TFFestival'
 VOLUNTEER_CANCEL_SHIFTS = False
+PENDING_SALE_TTL_MINUTES = 60
+SQUARE_PENDING_SALE_TTL_MINUTES = 24 * 60
+EMAIL_OUTBOX_BATCH_SIZE = 100
+EMAIL_OUTBOX_MAX_ATTEMPTS = 6
+EMAIL_OUTBOX_RETRY_SECONDS = 60
+EMAIL_OUTBOX_STALE_MINUTES = 15
+PAYMENT_EVENT_MAX_ATTEMPTS = 5
+SCHEDULE_PDF_RETAIN_MINUTES = 60
 
 # Suppress unwanted system checks
 SILENCED_SYSTEM_CHECKS = ["auth.W004"]
\ No newline at end of file